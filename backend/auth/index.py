@@ -1,228 +1,174 @@
-import json
-import os
 import hashlib
-import secrets
-import psycopg2
-from datetime import datetime, timedelta
+from framework import Router, error, json_response
+from presence import presence
+from tokens import ACCESS_TOKEN_TTL, issue_token, verify_token, revocations
 
 def hash_password(password: str) -> str:
     """Хеширование пароля с использованием SHA-256"""
     return hashlib.sha256(password.encode()).hexdigest()
 
-def generate_token(user_id: int) -> str:
-    """Генерация токена авторизации"""
-    secret = secrets.token_urlsafe(32)
-    return f"{user_id}:{secret}"
+def generate_tokens(user_id: int) -> dict:
+    """Пара токенов: access для запросов и refresh для его обновления"""
+    token, _ = issue_token(user_id, 'access')
+    refresh_token, _ = issue_token(user_id, 'refresh')
+    return {'token': token, 'refresh_token': refresh_token, 'expires_in': ACCESS_TOKEN_TTL}
 
-def parse_token(token: str) -> int:
-    """Извлечение user_id из токена"""
-    try:
-        user_id = int(token.split(':')[0])
-        return user_id
-    except:
-        return None
 
-def get_db_connection():
-    """Подключение к базе данных"""
-    dsn = os.environ['DATABASE_URL']
-    return psycopg2.connect(dsn)
+router = Router(unknown_action='Неизвестное действие')
 
-def handler(event: dict, context) -> dict:
-    """API для регистрации и авторизации пользователей"""
-    
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
-            },
-            'body': ''
+
+@router.teardown
+def flush_presence(request):
+    if request.has_connection:
+        presence.flush(request.conn)
+
+
+@router.route('POST', 'register')
+def register(request) -> dict:
+    body = request.body
+    username = body.get('username', '').strip().lower()
+    email = body.get('email', '').strip().lower()
+    password = body.get('password', '')
+    display_name = body.get('display_name', '').strip()
+
+    if not username or not email or not password or not display_name:
+        return error('Все поля обязательны')
+
+    if len(username) < 3 or len(username) > 20:
+        return error('Username должен быть от 3 до 20 символов')
+
+    if len(password) < 6:
+        return error('Пароль должен быть минимум 6 символов')
+
+    request.cur.execute("SELECT id FROM users WHERE username = %s OR email = %s", (username, email))
+    if request.cur.fetchone():
+        return error('Username или email уже существует')
+
+    password_hash = hash_password(password)
+    request.cur.execute(
+        "INSERT INTO users (username, email, password_hash, display_name) VALUES (%s, %s, %s, %s) RETURNING id",
+        (username, email, password_hash, display_name)
+    )
+    user_id = request.cur.fetchone()[0]
+    request.conn.commit()
+
+    tokens = generate_tokens(user_id)
+
+    return json_response({
+        'success': True,
+        **tokens,
+        'user': {
+            'id': user_id,
+            'username': username,
+            'display_name': display_name,
+            'email': email
         }
-    
-    if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
+    })
+
+
+@router.route('POST', 'login')
+def login(request) -> dict:
+    body = request.body
+    username = body.get('username', '').strip().lower()
+    password = body.get('password', '')
+
+    if not username or not password:
+        return error('Username и пароль обязательны')
+
+    password_hash = hash_password(password)
+    request.cur.execute(
+        "SELECT id, username, email, display_name, avatar_url, bio FROM users WHERE username = %s AND password_hash = %s",
+        (username, password_hash)
+    )
+    user = request.cur.fetchone()
+
+    if not user:
+        return error('Неверный username или пароль', 401)
+
+    presence.heartbeat(user[0])
+
+    tokens = generate_tokens(user[0])
+
+    return json_response({
+        'success': True,
+        **tokens,
+        'user': {
+            'id': user[0],
+            'username': user[1],
+            'email': user[2],
+            'display_name': user[3],
+            'avatar_url': user[4],
+            'bio': user[5]
         }
-    
-    try:
-        body = json.loads(event.get('body', '{}'))
-        action = body.get('action')
-        
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        if action == 'register':
-            username = body.get('username', '').strip().lower()
-            email = body.get('email', '').strip().lower()
-            password = body.get('password', '')
-            display_name = body.get('display_name', '').strip()
-            
-            if not username or not email or not password or not display_name:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Все поля обязательны'})
-                }
-            
-            if len(username) < 3 or len(username) > 20:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Username должен быть от 3 до 20 символов'})
-                }
-            
-            if len(password) < 6:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Пароль должен быть минимум 6 символов'})
-                }
-            
-            cur.execute("SELECT id FROM users WHERE username = %s OR email = %s", (username, email))
-            if cur.fetchone():
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Username или email уже существует'})
-                }
-            
-            password_hash = hash_password(password)
-            cur.execute(
-                "INSERT INTO users (username, email, password_hash, display_name) VALUES (%s, %s, %s, %s) RETURNING id",
-                (username, email, password_hash, display_name)
-            )
-            user_id = cur.fetchone()[0]
-            conn.commit()
-            
-            token = generate_token(user_id)
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'token': token,
-                    'user': {
-                        'id': user_id,
-                        'username': username,
-                        'display_name': display_name,
-                        'email': email
-                    }
-                })
-            }
-        
-        elif action == 'login':
-            username = body.get('username', '').strip().lower()
-            password = body.get('password', '')
-            
-            if not username or not password:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Username и пароль обязательны'})
-                }
-            
-            password_hash = hash_password(password)
-            cur.execute(
-                "SELECT id, username, email, display_name, avatar_url, bio FROM users WHERE username = %s AND password_hash = %s",
-                (username, password_hash)
-            )
-            user = cur.fetchone()
-            
-            if not user:
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Неверный username или пароль'})
-                }
-            
-            cur.execute("UPDATE users SET last_seen = CURRENT_TIMESTAMP WHERE id = %s", (user[0],))
-            conn.commit()
-            
-            token = generate_token(user[0])
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'token': token,
-                    'user': {
-                        'id': user[0],
-                        'username': user[1],
-                        'email': user[2],
-                        'display_name': user[3],
-                        'avatar_url': user[4],
-                        'bio': user[5]
-                    }
-                })
-            }
-        
-        elif action == 'verify':
-            token = body.get('token', '')
-            user_id = parse_token(token)
-            
-            if not user_id:
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Невалидный токен'})
-                }
-            
-            cur.execute(
-                "SELECT id, username, email, display_name, avatar_url, bio FROM users WHERE id = %s",
-                (user_id,)
-            )
-            user = cur.fetchone()
-            
-            if not user:
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Пользователь не найден'})
-                }
-            
-            cur.execute("UPDATE users SET last_seen = CURRENT_TIMESTAMP WHERE id = %s", (user[0],))
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'user': {
-                        'id': user[0],
-                        'username': user[1],
-                        'email': user[2],
-                        'display_name': user[3],
-                        'avatar_url': user[4],
-                        'bio': user[5]
-                    }
-                })
-            }
-        
-        else:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Неизвестное действие'})
-            }
-    
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Server error: {str(e)}'})
+    })
+
+
+@router.route('POST', 'verify')
+def verify(request) -> dict:
+    body = request.body
+    claims = verify_token(body.get('token', ''))
+
+    if not claims or revocations.is_revoked(claims['jti'], lambda: request.cur):
+        return error('Невалидный токен', 401)
+
+    request.cur.execute(
+        "SELECT id, username, email, display_name, avatar_url, bio FROM users WHERE id = %s",
+        (claims['sub'],)
+    )
+    user = request.cur.fetchone()
+
+    if not user:
+        return error('Пользователь не найден', 401)
+
+    presence.heartbeat(user[0])
+
+    return json_response({
+        'success': True,
+        'user': {
+            'id': user[0],
+            'username': user[1],
+            'email': user[2],
+            'display_name': user[3],
+            'avatar_url': user[4],
+            'bio': user[5]
         }
-    
-    finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            conn.close()
+    })
+
+
+@router.route('POST', 'refresh')
+def refresh(request) -> dict:
+    body = request.body
+    claims = verify_token(body.get('refresh_token', ''), 'refresh')
+
+    if not claims:
+        return error('Невалидный токен', 401)
+
+    # Refresh-токен одноразовый: повторный обмен того же токена отклоняется
+    if not revocations.revoke(request.cur, claims):
+        request.conn.rollback()
+        return error('Невалидный токен', 401)
+    request.conn.commit()
+
+    return json_response({'success': True, **generate_tokens(claims['sub'])})
+
+
+@router.route('POST', 'logout')
+def logout(request) -> dict:
+    body = request.body
+    for token, token_type in ((body.get('token', ''), 'access'), (body.get('refresh_token', ''), 'refresh')):
+        claims = verify_token(token, token_type)
+        if claims:
+            revocations.revoke(request.cur, claims)
+    request.conn.commit()
+
+    return json_response({'success': True})
+
+
+def handler(event: dict, context) -> dict:
+    """API для регистрации и авторизации пользователей"""
+    return router.dispatch(event, context)
+
+
+async def async_handler(event: dict, context) -> dict:
+    """Асинхронная точка входа: запросы авторизации короткие и выполняются в пуле потоков"""
+    return await router.dispatch_async(event, context)
@@ -0,0 +1,142 @@
+"""Подписанные токены авторизации.
+
+Токен — base64url(JSON с полями sub, typ, kid, exp, jti) и HMAC-SHA256
+подпись этой части ключом kid. Ключи задаются в TOKEN_SECRETS как
+"kid1:secret1,kid2:secret2" (подписывает TOKEN_ACTIVE_KID или первый ключ),
+старые ключи остаются в списке до истечения выданных ими токенов. Для
+одного ключа достаточно TOKEN_SECRET.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+
+ACCESS_TOKEN_TTL = int(os.environ.get('ACCESS_TOKEN_TTL', str(24 * 3600)))
+REFRESH_TOKEN_TTL = int(os.environ.get('REFRESH_TOKEN_TTL', str(30 * 24 * 3600)))
+REVOCATION_REFRESH_INTERVAL = float(os.environ.get('TOKEN_REVOCATION_REFRESH_INTERVAL', '60'))
+
+TOKEN_TYPES = {'access': ACCESS_TOKEN_TTL, 'refresh': REFRESH_TOKEN_TTL}
+
+_keys = None
+
+
+def load_keys() -> tuple:
+    """Ключи подписи из окружения: (активный kid, {kid: secret})"""
+    global _keys
+    if _keys is None:
+        keys = {}
+        for item in os.environ.get('TOKEN_SECRETS', '').split(','):
+            kid, _, secret = item.strip().partition(':')
+            if kid and secret:
+                keys[kid] = secret.encode()
+        if not keys and os.environ.get('TOKEN_SECRET'):
+            keys['default'] = os.environ['TOKEN_SECRET'].encode()
+        active_kid = os.environ.get('TOKEN_ACTIVE_KID') or next(iter(keys), None)
+        _keys = (active_kid, keys)
+    return _keys
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _sign(secret: bytes, payload: str) -> str:
+    return _b64encode(hmac.new(secret, payload.encode(), hashlib.sha256).digest())
+
+
+def issue_token(user_id: int, token_type: str = 'access') -> tuple:
+    """Выпуск токена; возвращает (токен, claims)"""
+    active_kid, keys = load_keys()
+    if active_kid not in keys:
+        raise RuntimeError('TOKEN_SECRET is not configured')
+    claims = {
+        'sub': user_id,
+        'typ': token_type,
+        'kid': active_kid,
+        'exp': int(time.time()) + TOKEN_TYPES[token_type],
+        'jti': secrets.token_urlsafe(12),
+    }
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+    return f"{payload}.{_sign(keys[active_kid], payload)}", claims
+
+
+def verify_token(token: str, token_type: str = 'access') -> dict:
+    """Проверка подписи, типа и срока действия без обращения к базе; None для невалидного"""
+    try:
+        payload, signature = token.split('.')
+        claims = json.loads(_b64decode(payload))
+        secret = load_keys()[1].get(claims['kid'])
+        if secret is None or not hmac.compare_digest(signature, _sign(secret, payload)):
+            return None
+        if claims['typ'] != token_type or claims['exp'] < time.time():
+            return None
+        if not isinstance(claims['sub'], int):
+            return None
+        return claims
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+# Refresh-токены не кешируются: ротация отзывает их часто и хранит по 30 дней,
+# а повторный обмен и так отклоняется вставкой в revoked_tokens
+REVOKED_JTIS_QUERY = "SELECT jti FROM revoked_tokens WHERE token_type = 'access' AND expires_at > %s"
+
+
+class RevocationList:
+    """Отозванные jti access-токенов, кешированные в памяти процесса и перечитываемые раз в интервал"""
+
+    def __init__(self, refresh_interval: float = REVOCATION_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._revoked = set()
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def is_revoked(self, jti: str, cur) -> bool:
+        """Проверка jti; запрос к базе только когда кеш устарел.
+
+        cur может быть функцией, возвращающей курсор: тогда подключение
+        берётся, только если кеш действительно нужно перечитать.
+        """
+        if self.is_stale():
+            if callable(cur):
+                cur = cur()
+            cur.execute(REVOKED_JTIS_QUERY, (int(time.time()),))
+            self.replace({row[0] for row in cur.fetchall()})
+        return jti in self
+
+    def is_stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_interval
+
+    def replace(self, revoked: set):
+        """Новый список отозванных jti, прочитанный из базы"""
+        with self._lock:
+            self._revoked = revoked
+            self._loaded_at = time.monotonic()
+
+    def __contains__(self, jti: str) -> bool:
+        return jti in self._revoked
+
+    def revoke(self, cur, claims: dict) -> bool:
+        """Отзыв токена до истечения срока; False, если он уже был отозван"""
+        cur.execute("""
+            INSERT INTO revoked_tokens (jti, user_id, expires_at, token_type)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (jti) DO NOTHING
+            RETURNING jti
+        """, (claims['jti'], claims['sub'], claims['exp'], claims['typ']))
+        inserted = cur.fetchone() is not None
+        if claims['typ'] == 'access':
+            with self._lock:
+                self._revoked.add(claims['jti'])
+        return inserted
+
+
+revocations = RevocationList()
@@ -0,0 +1,170 @@
+"""Трассировка запроса: время и число строк каждого SQL, этапы обработки.
+
+Курсор запроса оборачивается TracingCursor, который пишет в Trace отпечаток
+SQL (запрос без лишних пробелов и литералов), длительность и rowcount.
+Роутер добавляет этапы acquire (получение подключения), handler и encode
+(сериализация ответа) и выводит одну JSON-строку на запрос в stdout.
+Заголовок Server-Timing раскрывает устройство запросов любому источнику,
+поэтому включается только явно, TRACE_SERVER_TIMING=1. Самый медленный
+SELECT запроса с вероятностью TRACE_EXPLAIN_SAMPLE_RATE повторяется под
+EXPLAIN (ANALYZE), если он дольше TRACE_EXPLAIN_MIN_MS. Не повторяются
+запросы с INSERT/UPDATE/DELETE, блокировками строк FOR UPDATE/SHARE и
+функциями с побочными эффектами: последовательности, уведомления,
+advisory-блокировки, обслуживание партиций.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+TRACE_LOG = os.environ.get('TRACE_LOG', '1') == '1'
+TRACE_SERVER_TIMING = os.environ.get('TRACE_SERVER_TIMING', '0') == '1'
+TRACE_EXPLAIN_SAMPLE_RATE = float(os.environ.get('TRACE_EXPLAIN_SAMPLE_RATE', '0'))
+TRACE_EXPLAIN_MIN_MS = float(os.environ.get('TRACE_EXPLAIN_MIN_MS', '200'))
+MAX_TRACED_QUERIES = 50
+
+current_trace = ContextVar('current_trace', default=None)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r'\s+')
+_READ_ONLY = re.compile(r'^(?:SELECT|WITH)\b', re.I)
+_SIDE_EFFECTS = re.compile(
+    r'\b(?:INSERT|UPDATE|DELETE|FOR\s+(?:KEY\s+)?SHARE'
+    r'|nextval|setval|set_config|pg_notify|pg_(?:try_)?advisory_\w+'
+    r'|ensure_messages_partitions|create_messages_partition|record_message_id_months)\b',
+    re.I
+)
+
+
+def fingerprint(sql) -> str:
+    """Запрос без литералов и лишних пробелов: одинаков для всех вызовов одного места"""
+    if isinstance(sql, bytes):
+        sql = sql.decode(errors='replace')
+    elif not isinstance(sql, str):
+        sql = str(sql)
+    sql = _SPACES.sub(' ', _LITERALS.sub('?', sql)).strip()
+    # Многострочные VALUES от execute_values сворачиваются в один кортеж
+    return re.sub(r'(\(\?(?:, \?)*\))(?:, \(\?(?:, \?)*\))+', r'\1, ...', sql)
+
+
+def is_read_only(sql: str) -> bool:
+    """SELECT без записи, блокировок строк и вызовов с побочными эффектами: его можно повторить"""
+    return bool(_READ_ONLY.match(sql)) and not _SIDE_EFFECTS.search(sql)
+
+
+class Trace:
+    """Собранные за запрос этапы и SQL-запросы"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.queries = []
+        self.query_count = 0
+        self.query_ms = 0.0
+        self.slowest_select = None
+
+    def add_span(self, name: str, ms: float):
+        self.spans[name] = self.spans.get(name, 0.0) + ms
+
+    @contextmanager
+    def span(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, (time.perf_counter() - started) * 1000)
+
+    def add_query(self, sql, params, ms: float, rows: int):
+        self.query_count += 1
+        self.query_ms += ms
+        text = fingerprint(sql)
+        if len(self.queries) < MAX_TRACED_QUERIES:
+            self.queries.append({
+                'sql': text[:300],
+                'id': hashlib.md5(text.encode()).hexdigest()[:8],
+                'ms': round(ms, 3),
+                'rows': rows,
+            })
+        if is_read_only(text) and (self.slowest_select is None or ms > self.slowest_select[2]):
+            self.slowest_select = (sql, params, ms)
+
+    def explain(self, cur) -> dict:
+        """EXPLAIN (ANALYZE) самого медленного SELECT, если он попал в выборку"""
+        if self.slowest_select is None:
+            return None
+        sql, params, ms = self.slowest_select
+        if ms < TRACE_EXPLAIN_MIN_MS or random.random() >= TRACE_EXPLAIN_SAMPLE_RATE:
+            return None
+        if isinstance(sql, bytes):
+            sql = sql.decode()
+        # Запись, пропущенная проверкой SQL, упадёт, а не выполнится повторно
+        cur.execute('SET TRANSACTION READ ONLY')
+        cur.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql, params)
+        plan = cur.fetchone()[0][0]
+        return {
+            'sql': fingerprint(sql)[:300],
+            'planning_ms': plan.get('Planning Time'),
+            'execution_ms': plan.get('Execution Time'),
+            'plan': plan.get('Plan'),
+        }
+
+    @property
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self) -> str:
+        parts = [f'{name};dur={ms:.1f}' for name, ms in self.spans.items()]
+        parts.append(f'db;dur={self.query_ms:.1f};desc="{self.query_count} queries"')
+        parts.append(f'total;dur={self.total_ms:.1f}')
+        return ', '.join(parts)
+
+    def log(self, **fields):
+        """Одна JSON-строка на запрос"""
+        record = {
+            'trace': True,
+            **fields,
+            'total_ms': round(self.total_ms, 3),
+            'spans': {name: round(ms, 3) for name, ms in self.spans.items()},
+            'query_count': self.query_count,
+            'query_ms': round(self.query_ms, 3),
+            'queries': self.queries,
+        }
+        sys.stdout.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        sys.stdout.flush()
+
+
+class TracingCursor:
+    """Обёртка курсора psycopg2, которая пишет каждый execute в Trace"""
+
+    def __init__(self, cursor, trace: Trace):
+        self._cursor = cursor
+        self._trace = trace
+
+    def execute(self, sql, params=None):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, params)
+        finally:
+            self._trace.add_query(sql, params, (time.perf_counter() - started) * 1000, self._cursor.rowcount)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+@contextmanager
+def span(name: str):
+    """Этап текущего запроса; вне запроса ничего не пишет"""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
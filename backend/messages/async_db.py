@@ -0,0 +1,95 @@
+"""Асинхронный доступ к PostgreSQL на asyncpg для async_handler.
+
+Запросы пишутся в том же стиле psycopg2 (%s и %(name)s), что и в синхронном
+коде, и переводятся в $1, $2... при первом использовании. Пул создаётся
+на цикл событий при первом запросе; независимые запросы выполняются
+параллельно на разных соединениях пула. asyncpg импортируется лениво и
+нужен только асинхронной точке входа.
+"""
+import asyncio
+import os
+import re
+import time
+from functools import lru_cache
+from presence import presence
+from tracing import current_trace
+
+ASYNC_POOL_MAX_SIZE = int(os.environ.get('ASYNC_DB_POOL_MAX_SIZE', '10'))
+
+_PLACEHOLDER = re.compile(r'%\((\w+)\)s|%s|%%')
+_pools = {}
+
+
+@lru_cache(maxsize=256)
+def convert(sql: str) -> tuple:
+    """SQL с $n и порядок параметров: индексы для %s или имена для %(name)s"""
+    keys = []
+
+    def replace(match):
+        if match.group(0) == '%%':
+            return '%'
+        key = match.group(1) if match.group(1) else sum(1 for k in keys if isinstance(k, int))
+        if key in keys and not isinstance(key, int):
+            return f'${keys.index(key) + 1}'
+        keys.append(key)
+        return f'${len(keys)}'
+
+    return _PLACEHOLDER.sub(replace, sql), tuple(keys)
+
+
+async def create_pool():
+    import asyncpg
+    # asyncpg.create_pool возвращает awaitable пул, а не корутину: задаче нужна корутина
+    return await asyncpg.create_pool(os.environ['DATABASE_URL'], min_size=1, max_size=ASYNC_POOL_MAX_SIZE)
+
+
+async def get_pool():
+    loop = asyncio.get_running_loop()
+    if loop not in _pools:
+        _pools[loop] = loop.create_task(create_pool())
+    task = _pools[loop]
+    try:
+        return await task
+    except Exception:
+        # Неудачное создание не кэшируется: следующий запрос попробует снова
+        if _pools.get(loop) is task:
+            del _pools[loop]
+        raise
+
+
+async def fetch(sql: str, params=()) -> list:
+    """Строки запроса; asyncpg.Record индексируется как кортеж psycopg2"""
+    query, keys = convert(sql)
+    args = [params[key] for key in keys]
+    pool = await get_pool()
+    started = time.perf_counter()
+    rows = await pool.fetch(query, *args)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_query(sql, params, (time.perf_counter() - started) * 1000, len(rows))
+    return rows
+
+
+async def fetchrow(sql: str, params=()):
+    rows = await fetch(sql, params)
+    return rows[0] if rows else None
+
+
+async def flush_presence(force: bool = False) -> int:
+    """Асинхронный аналог presence.flush: отметки пишутся одним UPDATE по unnest"""
+    pending = presence.take_due(force)
+    if not pending:
+        return 0
+    now = time.time()
+    try:
+        pool = await get_pool()
+        await pool.execute("""
+            UPDATE users u SET last_seen = LOCALTIMESTAMP - v.age * INTERVAL '1 second'
+            FROM unnest($1::integer[], $2::float8[]) AS v(id, age)
+            WHERE u.id = v.id AND u.last_seen < LOCALTIMESTAMP - v.age * INTERVAL '1 second'
+        """, list(pending), [now - seen for seen in pending.values()])
+    except Exception:
+        presence.restore(pending)
+        return 0
+    presence.mark_flushed(pending, now)
+    return len(pending)
@@ -0,0 +1,109 @@
+"""Кеш профилей и списков контактов со сбросом при записи.
+
+По умолчанию хранилище — LRU в памяти процесса с TTL на запись. Хранилищем
+может быть любой объект с подмножеством интерфейса Redis: get(key),
+set(key, value, ex=seconds), delete(*keys). CACHE_URL=redis://... включает
+Redis (нужен пакет redis), без него кеш живёт в памяти.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_TTL = int(os.environ.get('CACHE_TTL', '60'))
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '10000'))
+
+
+class MemoryBackend:
+    """LRU-хранилище в памяти с интерфейсом get/set/delete как у Redis"""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ex: int = None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ex if ex else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+
+class Cache:
+    """Сериализация в JSON, TTL и счётчики попаданий поверх хранилища"""
+
+    def __init__(self, backend, ttl: int = CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._stats = {'hits': 0, 'misses': 0, 'sets': 0, 'invalidations': 0}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: list) -> dict:
+        """Значения найденных ключей; промахи в результат не попадают"""
+        found = {}
+        for key in keys:
+            raw = self.backend.get(key)
+            if raw is not None:
+                found[key] = json.loads(raw)
+        self._count('hits', len(found))
+        self._count('misses', len(keys) - len(found))
+        return found
+
+    def get(self, key: str):
+        return self.get_many([key]).get(key)
+
+    def set(self, key: str, value):
+        self.backend.set(key, json.dumps(value), ex=self.ttl)
+        self._count('sets', 1)
+
+    def invalidate(self, *keys: str):
+        self.backend.delete(*keys)
+        self._count('invalidations', len(keys))
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _count(self, name: str, value: int):
+        with self._lock:
+            self._stats[name] += value
+
+
+def create_backend(url: str):
+    """Хранилище по CACHE_URL: memory:// или redis://"""
+    if url.startswith(('redis://', 'rediss://')):
+        import redis
+        return redis.Redis.from_url(url)
+    return MemoryBackend()
+
+
+cache = Cache(create_backend(os.environ.get('CACHE_URL', 'memory://')))
+
+
+def profile_key(user_id: int) -> str:
+    return f'profile:{user_id}'
+
+
+def contacts_key(user_id: int) -> str:
+    return f'contacts:{user_id}'
@@ -0,0 +1,163 @@
+"""Пул соединений с PostgreSQL, переживающий тёплые вызовы функции.
+
+Не больше DB_POOL_MAX_SIZE соединений на процесс; соединение, простоявшее
+дольше DB_POOL_HEALTH_CHECK_AFTER секунд, проверяется перед выдачей и при
+обрыве заменяется новым. Если свободного нет DB_POOL_TIMEOUT секунд,
+acquire бросает PoolTimeout.
+"""
+import os
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+HEALTH_CHECK_AFTER = float(os.environ.get('DB_POOL_HEALTH_CHECK_AFTER', '30'))
+
+
+class PoolTimeout(Exception):
+    """Свободное соединение не появилось за отведённое время"""
+
+
+class ConnectionPool:
+    """Ограниченный пул соединений с проверкой при выдаче и переподключением"""
+
+    def __init__(self, dsn: str, max_size: int = POOL_MAX_SIZE, timeout: float = POOL_TIMEOUT,
+                 health_check_after: float = HEALTH_CHECK_AFTER):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self._idle = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'reconnects': 0,
+            'timeouts': 0,
+            'wait_ms_total': 0.0,
+            'wait_ms_max': 0.0,
+        }
+
+    def acquire(self):
+        """Выдача соединения: из пула, новое или после ожидания освобождения"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        conn = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, released_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f'No free database connection after {self.timeout}s')
+                self._cond.wait(remaining)
+
+        if conn is not None and self._is_healthy(conn, released_at):
+            self._record_wait(started, hit=True)
+            return conn
+
+        if conn is not None:
+            self._stats['reconnects'] += 1
+            self._close_quietly(conn)
+
+        try:
+            conn = psycopg2.connect(self.dsn)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        self._record_wait(started, hit=False)
+        return conn
+
+    def release(self, conn, discard: bool = False):
+        """Возврат соединения; незавершённая транзакция откатывается"""
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        with self._cond:
+            if discard or conn.closed:
+                self._size -= 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        """Счётчики пула: попадания, промахи, переподключения и время ожидания"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+        checkouts = stats['hits'] + stats['misses']
+        stats['wait_ms_avg'] = stats['wait_ms_total'] / checkouts if checkouts else 0.0
+        return stats
+
+    def _is_healthy(self, conn, released_at: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - released_at < self.health_check_after:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _record_wait(self, started: float, hit: bool):
+        wait_ms = (time.monotonic() - started) * 1000
+        with self._cond:
+            self._stats['hits' if hit else 'misses'] += 1
+            self._stats['wait_ms_total'] += wait_ms
+            self._stats['wait_ms_max'] = max(self._stats['wait_ms_max'], wait_ms)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Пул уровня модуля, создаётся при первом обращении"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ['DATABASE_URL'])
+    return _pool
+
+
+def get_db_connection():
+    """Подключение к базе данных из пула"""
+    return get_pool().acquire()
+
+
+def release_db_connection(conn, discard: bool = False):
+    """Возврат подключения в пул"""
+    get_pool().release(conn, discard)
+
+
+def pool_stats() -> dict:
+    """Статистика пула текущего процесса"""
+    return get_pool().stats()
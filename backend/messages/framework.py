@@ -0,0 +1,393 @@
+"""Маршрутизация действий и JSON-ответы облачной функции.
+
+Действие выбирается по таблице (метод, action) вместо цепочки if/elif.
+Подключение к базе берётся лениво при первом обращении к request.cur,
+поэтому OPTIONS и ответы на невалидные запросы не импортируют psycopg2.
+Если установлен orjson, ответы сериализуются им. Каждый запрос трассируется
+(см. tracing.py): SQL, этапы, строка лога и, с TRACE_SERVER_TIMING=1,
+заголовок Server-Timing.
+Ответы от COMPRESS_MIN_BYTES сжимаются brotli (если установлен пакет brotli)
+или gzip по Accept-Encoding; ETag и If-None-Match — make_etag() и
+Request.not_modified().
+
+dispatch_async — асинхронная точка входа с тем же контрактом event/ответ:
+действия, для которых зарегистрирован async-обработчик, выполняются в цикле
+событий, остальные — синхронным dispatch в пуле потоков.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import os
+import traceback
+from tracing import TRACE_LOG, TRACE_SERVER_TIMING, Trace, TracingCursor, current_trace, span
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+def dumps(data) -> str:
+    """Сериализация тела ответа"""
+    with span('encode'):
+        if orjson is not None:
+            return orjson.dumps(data).decode()
+        return json.dumps(data)
+
+
+def json_response(data, status: int = 200, headers: dict = None) -> dict:
+    """JSON-ответ облачной функции"""
+    return {
+        'statusCode': status,
+        'headers': {**JSON_HEADERS, **headers} if headers else JSON_HEADERS,
+        'body': dumps(data)
+    }
+
+
+def error(message: str, status: int = 400) -> dict:
+    """Ответ с ошибкой"""
+    return json_response({'error': message}, status)
+
+
+def make_etag(*parts) -> str:
+    """Слабый ETag из версии данных: представление одно, кодировки сжатия разные"""
+    digest = hashlib.sha1(':'.join(map(str, parts)).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_headers(etag: str) -> dict:
+    # no-cache: браузер хранит ответ, но каждый раз перепроверяет его по ETag
+    return {'ETag': etag, 'Cache-Control': 'private, no-cache', 'Access-Control-Expose-Headers': 'ETag'}
+
+
+def not_modified(etag: str) -> dict:
+    return {
+        'statusCode': 304,
+        'headers': {'Access-Control-Allow-Origin': '*', **etag_headers(etag)},
+        'body': ''
+    }
+
+
+def accepted_encodings(header: str) -> set:
+    """Кодировки из Accept-Encoding без явно запрещённых (q=0)"""
+    encodings = set()
+    for part in header.lower().split(','):
+        name, _, params = part.strip().partition(';')
+        quality = params.strip().replace(' ', '')
+        if quality.startswith('q=') and not quality[2:].strip('0.'):
+            continue
+        if name:
+            encodings.add(name.strip())
+    return encodings
+
+
+def compress(response: dict, accept_encoding: str) -> dict:
+    """Сжатие тела ответа, если клиент принимает br или gzip и тело достаточно большое.
+
+    Vary: Accept-Encoding получает любой текстовый ответ, в том числе несжатый
+    и 304: иначе кэш по пути отдаст сохранённый вариант клиенту с другим
+    Accept-Encoding, а тело того же адреса может перерасти порог сжатия.
+    """
+    if response.get('isBase64Encoded'):
+        return response
+    body = response.get('body') or ''
+    headers = {**response['headers'], 'Vary': 'Accept-Encoding'}
+    encodings = accepted_encodings(accept_encoding) if len(body) >= COMPRESS_MIN_BYTES else set()
+    if brotli is not None and 'br' in encodings:
+        encoding, payload = 'br', brotli.compress(body.encode(), quality=5)
+    elif 'gzip' in encodings:
+        encoding, payload = 'gzip', gzip.compress(body.encode(), compresslevel=6)
+    else:
+        return {**response, 'headers': headers}
+    return {
+        **response,
+        'headers': {**headers, 'Content-Encoding': encoding},
+        'body': base64.b64encode(payload).decode(),
+        'isBase64Encoded': True
+    }
+
+
+class HttpError(Exception):
+    """Ошибка запроса, которую роутер превращает в ответ со статусом status"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class Request:
+    """Запрос: разобранные параметры и ленивое подключение к базе"""
+
+    def __init__(self, event: dict, context):
+        self.event = event
+        self.context = context
+        self.method = event.get('httpMethod', 'GET')
+        self.headers = event.get('headers') or {}
+        self.params = event.get('queryStringParameters') or {}
+        self.user_id = None
+        self.claims = None
+        self.trace = Trace()
+        self._body = None
+        self._conn = None
+        self._cur = None
+
+    @property
+    def body(self) -> dict:
+        if self._body is None:
+            try:
+                body = json.loads(self.event.get('body') or '{}')
+            except ValueError:
+                raise HttpError('Invalid JSON body')
+            self._body = body if isinstance(body, dict) else {}
+        return self._body
+
+    @property
+    def raw_body(self) -> bytes:
+        """Тело запроса как есть, например кусок загружаемого файла"""
+        body = self.event.get('body') or ''
+        if self.event.get('isBase64Encoded'):
+            return base64.b64decode(body)
+        return body.encode()
+
+    @property
+    def action(self) -> str:
+        # Действие с двоичным телом передаётся в строке запроса
+        if self.method == 'GET' or 'action' in self.params:
+            return self.params.get('action', '')
+        return self.body.get('action') or ''
+
+    def header(self, name: str) -> str:
+        return self.headers.get(name.lower()) or self.headers.get(name) or ''
+
+    def not_modified(self, etag: str) -> bool:
+        """Совпадает ли etag с одним из If-None-Match"""
+        header = self.header('If-None-Match')
+        if not header:
+            return False
+        tags = {tag.strip() for tag in header.split(',')}
+        return '*' in tags or etag in tags or etag[2:] in tags
+
+    @property
+    def has_connection(self) -> bool:
+        return self._conn is not None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            from db import get_db_connection
+            with self.trace.span('acquire'):
+                self._conn = get_db_connection()
+        return self._conn
+
+    @property
+    def cur(self):
+        if self._cur is None:
+            self._cur = TracingCursor(self.conn.cursor(), self.trace)
+        return self._cur
+
+    def explain(self) -> dict:
+        """План самого медленного SELECT запроса, если он попал в выборку"""
+        if self._conn is None or self.trace.slowest_select is None:
+            return None
+        try:
+            self._conn.rollback()
+            cur = self._conn.cursor()
+            try:
+                return self.trace.explain(cur)
+            finally:
+                cur.close()
+                self._conn.rollback()
+        except Exception as e:
+            return {'error': str(e)}
+
+    def close(self):
+        if self._cur is not None:
+            self._cur.close()
+        if self._conn is not None:
+            from db import release_db_connection
+            release_db_connection(self._conn)
+        self._cur = self._conn = None
+
+
+class Router:
+    """Таблица действий функции с общими хуками до и после обработки"""
+
+    def __init__(self, allow_headers: str = 'Content-Type', unknown_action: str = 'Unknown action'):
+        self.allow_headers = allow_headers
+        self.unknown_action = unknown_action
+        self.routes = {}
+        self.async_routes = {}
+        self.before_hooks = []
+        self.teardown_hooks = []
+        self.async_before_hooks = []
+        self.async_teardown_hooks = []
+
+    def route(self, method: str, action: str):
+        """Регистрация обработчика действия"""
+        def register(func):
+            self.routes[(method, action)] = func
+            return func
+        return register
+
+    def route_async(self, method: str, action: str):
+        """Регистрация async-обработчика действия; синхронный обработчик тоже нужен"""
+        def register(func):
+            self.async_routes[(method, action)] = func
+            return func
+        return register
+
+    def before(self, func):
+        """Хук до обработчика; непустой результат сразу становится ответом"""
+        self.before_hooks.append(func)
+        return func
+
+    def teardown(self, func):
+        """Хук после обработки, до возврата подключения в пул"""
+        self.teardown_hooks.append(func)
+        return func
+
+    def before_async(self, func):
+        """Хук до async-обработчика, аналог before"""
+        self.async_before_hooks.append(func)
+        return func
+
+    def teardown_async(self, func):
+        """Хук после async-обработчика, аналог teardown"""
+        self.async_teardown_hooks.append(func)
+        return func
+
+    @property
+    def methods(self) -> list:
+        return sorted({method for method, _ in self.routes})
+
+    def preflight(self) -> dict:
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': ', '.join(self.methods + ['OPTIONS']),
+                'Access-Control-Allow-Headers': self.allow_headers
+            },
+            'body': ''
+        }
+
+    def dispatch(self, event: dict, context) -> dict:
+        """Обработка события облачной функции"""
+        request = Request(event, context)
+        if request.method == 'OPTIONS':
+            return self.preflight()
+        if request.method not in self.methods:
+            return error('Method not allowed', 405)
+
+        trace = request.trace
+        token = current_trace.set(trace)
+        failure = None
+        explain = None
+        try:
+            with trace.span('handler'):
+                response = self.handle(request)
+        except HttpError as e:
+            failure = {'error': e.message}
+            response = error(e.message, e.status)
+        except Exception as e:
+            failure = {'error': repr(e), 'traceback': traceback.format_exc()}
+            response = error(f'Server error: {str(e)}', 500)
+        finally:
+            try:
+                for hook in self.teardown_hooks:
+                    hook(request)
+                explain = request.explain()
+            finally:
+                request.close()
+                current_trace.reset(token)
+
+        return self.finish(request, response, failure, explain)
+
+    async def dispatch_async(self, event: dict, context) -> dict:
+        """Обработка события в цикле событий"""
+        request = Request(event, context)
+        if request.method == 'OPTIONS':
+            return self.preflight()
+        func = self.async_routes.get((request.method, self.action_name(request)))
+        if func is None:
+            # asyncio нужен только асинхронной точке входа и не входит в холодный старт handler()
+            import asyncio
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self.dispatch, event, context)
+
+        trace = request.trace
+        token = current_trace.set(trace)
+        failure = None
+        try:
+            with trace.span('handler'):
+                response = await self.handle_async(request, func)
+        except HttpError as e:
+            failure = {'error': e.message}
+            response = error(e.message, e.status)
+        except Exception as e:
+            failure = {'error': repr(e), 'traceback': traceback.format_exc()}
+            response = error(f'Server error: {str(e)}', 500)
+        finally:
+            try:
+                for hook in self.async_teardown_hooks:
+                    await hook(request)
+            finally:
+                current_trace.reset(token)
+
+        return self.finish(request, response, failure, None)
+
+    async def handle_async(self, request: Request, func) -> dict:
+        for hook in self.async_before_hooks:
+            response = await hook(request)
+            if response is not None:
+                return response
+        return await func(request)
+
+    def finish(self, request: Request, response: dict, failure: dict, explain: dict) -> dict:
+        """Сжатие, Server-Timing и строка лога для готового ответа"""
+        trace = request.trace
+        with trace.span('compress'):
+            response = compress(response, request.header('Accept-Encoding'))
+        if TRACE_SERVER_TIMING:
+            response['headers'] = {
+                **response['headers'],
+                'Server-Timing': trace.server_timing(),
+                'Timing-Allow-Origin': '*'
+            }
+        if TRACE_LOG:
+            trace.log(
+                method=request.method,
+                action=self.action_name(request),
+                status=response['statusCode'],
+                user_id=request.user_id,
+                **(failure or {}),
+                **({'explain': explain} if explain else {})
+            )
+        return response
+
+    def handle(self, request: Request) -> dict:
+        for hook in self.before_hooks:
+            response = hook(request)
+            if response is not None:
+                return response
+        func = self.routes.get((request.method, request.action))
+        if func is None:
+            return error(self.unknown_action)
+        return func(request)
+
+    @staticmethod
+    def action_name(request: Request) -> str:
+        try:
+            return request.action
+        except HttpError:
+            return None
@@ -1,347 +1,1986 @@
+import base64
+import hashlib
+import io
 import json
 import os
-import psycopg2
-from datetime import datetime
+import re
+import select
+import sys
+import time
+import uuid
+from decimal import Decimal
+from urllib.parse import quote
+from cache import cache, contacts_key, profile_key
+from framework import Router, HttpError, error, etag_headers, json_response, make_etag, not_modified
+from presence import presence
+from storage import StorageNotConfigured, get_storage
+from tokens import REVOKED_JTIS_QUERY, verify_token, revocations
 
-def parse_token(token: str) -> int:
-    """Извлечение user_id из токена"""
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_POLL_TIMEOUT = 25
+SEARCH_PAGE_SIZE = 20
+MAX_BATCH_SENDS = 100
+MAX_BATCH_FETCH = 50
+MEMBER_PREVIEW_SIZE = 3
+MAX_GROUP_MEMBERS = 5000
+MAX_MEMBERS_PER_REQUEST = 200
+ETAG_PRESENCE_BUCKET = 60
+MAX_ATTACHMENTS_PER_MESSAGE = 10
+MAX_ATTACHMENT_SIZE = 100 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_CHUNK = 4 * 1024 * 1024
+UPLOAD_TTL = 24 * 3600
+DOWNLOAD_CHUNK_SIZE = 2 * 1024 * 1024
+THUMBNAIL_SIZE = 320
+INLINE_CONTENT_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp'}
+MAX_THUMBNAIL_PIXELS = 50_000_000
+PARTITION_MONTHS_AHEAD = 2
+PARTITION_CHECK_INTERVAL = 24 * 3600
+PARTITION_RETRY_INTERVAL = 5 * 60
+SNAPSHOT_PATTERN = re.compile(r'^\d+:\d+:[\d,]*$')
+
+partitions_check_due = None
+
+def parse_int(value) -> int:
+    """Разбор целочисленного параметра запроса"""
     try:
-        user_id = int(token.split(':')[0])
-        return user_id
-    except:
+        return int(value)
+    except (TypeError, ValueError):
         return None
 
-def get_db_connection():
-    """Подключение к базе данных"""
-    dsn = os.environ['DATABASE_URL']
-    return psycopg2.connect(dsn)
+def profile_from_row(row) -> dict:
+    """Профиль для кеша из строки (id, username, display_name, avatar_url, bio, возраст last_seen)"""
+    return {
+        'id': row[0],
+        'username': row[1],
+        'name': row[2],
+        'avatar': row[3] or '',
+        'bio': row[4] or '',
+        'last_seen_at': time.time() - float(row[5]) if row[5] is not None else None
+    }
 
-def handler(event: dict, context) -> dict:
-    """API для работы с сообщениями, чатами и контактами"""
+PROFILES_QUERY = """
+    SELECT id, username, display_name, avatar_url, bio,
+           EXTRACT(EPOCH FROM LOCALTIMESTAMP - last_seen) as last_seen_age
+    FROM users
+    WHERE id = ANY(%s)
+"""
+
+def cached_profiles(user_ids: list) -> tuple:
+    """Профили из кеша и id, которых в нём нет"""
+    keys = {user_id: profile_key(user_id) for user_id in set(user_ids)}
+    cached = cache.get_many(list(keys.values()))
+    profiles = {user_id: cached[key] for user_id, key in keys.items() if key in cached}
+    return profiles, [user_id for user_id in keys if user_id not in profiles]
+
+def store_profiles(profiles: dict, rows: list):
+    for row in rows:
+        profiles[row[0]] = profile_from_row(row)
+        cache.set(profile_key(row[0]), profiles[row[0]])
+
+def load_profiles(cur, user_ids: list) -> dict:
+    """Профили по id: из кеша, промахи одним запросом к users"""
+    profiles, missing = cached_profiles(user_ids)
+    if missing:
+        cur.execute(PROFILES_QUERY, (missing,))
+        store_profiles(profiles, cur.fetchall())
+    return profiles
+
+async def load_profiles_async(user_ids: list) -> dict:
+    """Асинхронный аналог load_profiles"""
+    import async_db
+    profiles, missing = cached_profiles(user_ids)
+    if missing:
+        store_profiles(profiles, await async_db.fetch(PROFILES_QUERY, (missing,)))
+    return profiles
+
+def is_online(profile: dict) -> bool:
+    """Флаг «в сети» по кешированному last_seen и трекеру присутствия"""
+    last_seen_at = profile.get('last_seen_at')
+    return presence.is_online(profile['id'], time.time() - last_seen_at if last_seen_at else None)
+
+# Из участников берётся не больше MEMBER_PREVIEW_SIZE по индексу (chat_id, user_id):
+# для личного чата это собеседник, для группы — превью, сколько бы в ней ни было людей
+CHATS_QUERY = """
+    SELECT cm.chat_id, c.is_group, c.title, c.avatar_url, COALESCE(s.member_count, 0),
+           p.member_ids,
+           s.last_message_text as last_message,
+           TO_CHAR(s.last_message_at, 'HH24:MI') as last_time,
+           GREATEST(COALESCE(s.message_count, 0) - cm.read_count, 0) as unread,
+           cm.id, cm.read_count, COALESCE(s.version, 0)
+    FROM chat_members cm
+    JOIN chats c ON c.id = cm.chat_id
+    LEFT JOIN chat_summaries s ON s.chat_id = cm.chat_id
+    CROSS JOIN LATERAL (
+        SELECT array_agg(preview.user_id ORDER BY preview.user_id) as member_ids
+        FROM (
+            SELECT cm2.user_id FROM chat_members cm2
+            WHERE cm2.chat_id = cm.chat_id AND cm2.user_id != cm.user_id
+            ORDER BY cm2.user_id
+            LIMIT %s
+        ) preview
+    ) p
+    WHERE cm.user_id = %s AND (%s::integer[] IS NULL OR cm.chat_id = ANY(%s))
+    ORDER BY s.last_message_at DESC NULLS LAST
+"""
+
+def fetch_chats(cur, user_id: int, chat_ids: list = None) -> list:
+    """Список чатов пользователя; chat_ids ограничивает выборку конкретными чатами"""
+    cur.execute(CHATS_QUERY, (MEMBER_PREVIEW_SIZE, user_id, chat_ids, chat_ids))
+    rows = cur.fetchall()
+    return build_chats(rows, load_profiles(cur, chat_member_ids(rows)))
+
+def chat_member_ids(rows: list) -> list:
+    return list({member_id for row in rows for member_id in row[5] or []})
+
+def build_chats(rows: list, profiles: dict) -> list:
+    """Ответ списка чатов из строк CHATS_QUERY и профилей участников"""
+    chats = []
+    for row in rows:
+        chat = {
+            'id': row[0],
+            'isGroup': row[1],
+            'lastMessage': row[6] or '',
+            'time': row[7] or '',
+            'unread': row[8] or 0
+        }
+        if row[1]:
+            members = [profiles[member_id] for member_id in row[5] or [] if member_id in profiles]
+            chat.update({
+                'title': row[2],
+                'avatar': row[3] or '',
+                'memberCount': row[4],
+                'members': [
+                    {'id': member['id'], 'name': member['name'], 'avatar': member['avatar']}
+                    for member in members
+                ],
+                # Клиенты без поддержки групп показывают чат по полю user
+                'user': {'id': None, 'username': '', 'name': row[2], 'avatar': row[3] or '', 'online': False}
+            })
+        else:
+            profile = profiles.get((row[5] or [None])[0])
+            if profile is None:
+                continue
+            chat['user'] = {
+                'id': profile['id'],
+                'username': profile['username'],
+                'name': profile['name'],
+                'avatar': profile['avatar'],
+                'online': is_online(profile)
+            }
+        chats.append(chat)
+    return chats
+
+def presence_bucket() -> int:
+    """Интервал, в котором ETag списков не меняется из-за статусов «в сети» и профилей"""
+    return int(time.time() // ETAG_PRESENCE_BUCKET)
+
+CHATS_VERSION_QUERY = """
+    SELECT COUNT(*), COALESCE(MAX(cm.id), 0), COALESCE(SUM(cm.read_count), 0), COALESCE(SUM(s.version), 0)
+    FROM chat_members cm
+    LEFT JOIN chat_summaries s ON s.chat_id = cm.chat_id
+    WHERE cm.user_id = %s
+"""
+
+def chats_version(cur, user_id: int) -> tuple:
+    """Версия списка чатов: состав чатов, версии их сводок и прочтения пользователя"""
+    cur.execute(CHATS_VERSION_QUERY, (user_id,))
+    return cur.fetchone()
+
+def chats_version_from_rows(rows: list) -> tuple:
+    """Та же версия, посчитанная по строкам CHATS_QUERY без отдельного запроса"""
+    return (
+        len(rows),
+        max((row[9] for row in rows), default=0),
+        sum(row[10] for row in rows),
+        sum(row[11] for row in rows)
+    )
+
+CONTACTS_VERSION_QUERY = "SELECT COUNT(*), COALESCE(MAX(id), 0) FROM contacts WHERE user_id = %s"
+
+def contacts_version(cur, user_id: int) -> tuple:
+    """Версия списка контактов: контакты только добавляются"""
+    cur.execute(CONTACTS_VERSION_QUERY, (user_id,))
+    return cur.fetchone()
+
+CONTACTS_QUERY = """
+    SELECT u.id, u.username, u.display_name, u.avatar_url, u.bio,
+           EXTRACT(EPOCH FROM LOCALTIMESTAMP - u.last_seen) as last_seen_age
+    FROM contacts c
+    JOIN users u ON c.contact_user_id = u.id
+    WHERE c.user_id = %s
+    ORDER BY u.display_name
+"""
+
+def store_contacts(user_id: int, rows: list) -> tuple:
+    """Профили и упорядоченные id контактов из строк CONTACTS_QUERY с записью в кеш"""
+    profiles = {}
+    store_profiles(profiles, rows)
+    contact_ids = [row[0] for row in rows]
+    cache.set(contacts_key(user_id), contact_ids)
+    return profiles, contact_ids
+
+def build_contacts(contact_ids: list, profiles: dict) -> list:
+    contacts = []
+    for contact_id in contact_ids:
+        profile = profiles.get(contact_id)
+        if profile is None:
+            continue
+        contacts.append({
+            'id': profile['id'],
+            'username': profile['username'],
+            'name': profile['name'],
+            'avatar': profile['avatar'],
+            'bio': profile['bio'],
+            'online': is_online(profile)
+        })
+    return contacts
+
+def group_role(cur, chat_id: int, user_id: int, roles: tuple = ('owner', 'admin', 'member')) -> str:
+    """Роль пользователя в группе; HttpError, если это не его группа или роль не подходит"""
+    cur.execute("""
+        SELECT c.is_group, cm.role
+        FROM chat_members cm
+        JOIN chats c ON c.id = cm.chat_id
+        WHERE cm.chat_id = %s AND cm.user_id = %s
+    """, (chat_id, user_id))
+    row = cur.fetchone()
+    if not row:
+        raise HttpError('Chat not found', 404)
+    if not row[0]:
+        raise HttpError('Not a group chat')
+    if row[1] not in roles:
+        raise HttpError('Forbidden', 403)
+    return row[1]
+
+def add_group_members(cur, chat_id: int, user_ids: list) -> list:
+    """Добавление участников; новые видят историю прочитанной. Возвращает id добавленных"""
+    # Блокировка строки чата упорядочивает параллельные добавления для проверки лимита
+    cur.execute("""
+        SELECT COALESCE(s.member_count, 0)
+        FROM chats c
+        LEFT JOIN chat_summaries s ON s.chat_id = c.id
+        WHERE c.id = %s
+        FOR UPDATE OF c
+    """, (chat_id,))
+    if cur.fetchone()[0] + len(user_ids) > MAX_GROUP_MEMBERS:
+        raise HttpError(f'A group can have at most {MAX_GROUP_MEMBERS} members')
+    
+    cur.execute("""
+        INSERT INTO chat_members (chat_id, user_id, role, read_count, last_read_message_id)
+        SELECT %(chat_id)s, u.id, 'member', COALESCE(s.message_count, 0), s.last_message_id
+        FROM users u
+        LEFT JOIN chat_summaries s ON s.chat_id = %(chat_id)s
+        WHERE u.id = ANY(%(user_ids)s::integer[])
+        ON CONFLICT (chat_id, user_id) DO NOTHING
+        RETURNING user_id
+    """, {'chat_id': chat_id, 'user_ids': user_ids})
+    return sorted(row[0] for row in cur.fetchall())
+
+def parse_user_ids(value) -> list:
+    """Список id пользователей из тела запроса; None, если формат неверный"""
+    if not isinstance(value, list) or len(value) > MAX_MEMBERS_PER_REQUEST:
+        return None
+    user_ids = [parse_int(item) for item in value]
+    if not all(user_ids):
+        return None
+    return sorted(set(user_ids))
+
+def encode_sync_cursor(message_id: int, snapshot: str, timestamp: float, upto_id: int = None) -> str:
+    """Курсор синхронизации: выданный id, снимок базы pg_snapshot, серверное время
+    и, пока выдача не закончена, её верхняя граница id"""
+    parts = [str(message_id), snapshot or '', f'{timestamp:.3f}']
+    if upto_id is not None:
+        parts.append(str(upto_id))
+    return '/'.join(parts)
+
+def decode_sync_cursor(cursor: str) -> tuple:
+    """(id, снимок или None, время, граница или None); None для невалидного курсора"""
+    try:
+        if '/' not in cursor:
+            # Курсор прежнего формата id:время, без снимка
+            message_id, timestamp = cursor.split(':')
+            return int(message_id), None, float(timestamp), None
+        parts = cursor.split('/')
+        if len(parts) not in (3, 4) or (parts[1] and not SNAPSHOT_PATTERN.match(parts[1])):
+            return None
+        upto_id = int(parts[3]) if len(parts) == 4 else None
+        return int(parts[0]), parts[1] or None, float(parts[2]), upto_id
+    except (AttributeError, ValueError):
+        return None
+
+def escape_like(value: str) -> str:
+    """Экранирование спецсимволов шаблона LIKE"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def decode_search_cursor(cursor: str) -> tuple:
+    """Курсор поиска: (совпадение по префиксу, оценка похожести, id); None для невалидного"""
+    try:
+        prefix_match, score, user_id = cursor.split(':')
+        score = Decimal(score)
+        if not score.is_finite():
+            return None
+        return int(prefix_match), score, int(user_id)
+    except (AttributeError, ValueError, ArithmeticError):
+        return None
+
+# Совпадения по префиксу идут первыми, внутри — по убыванию триграммной похожести.
+# condition дополнительно ограничивает выборку: асинхронный поиск делит её на
+# префиксную часть и остальные совпадения и выполняет их параллельно
+SEARCH_QUERY = """
+    SELECT r.id, r.username, r.display_name, r.avatar_url, r.bio,
+           EXISTS(SELECT 1 FROM contacts WHERE user_id = %(user_id)s AND contact_user_id = r.id) as is_contact,
+           r.prefix_match, r.score
+    FROM (
+        SELECT u.id, u.username, u.display_name, u.avatar_url, u.bio,
+               (lower(u.username) LIKE %(prefix)s OR lower(u.display_name) LIKE %(prefix)s)::int as prefix_match,
+               ROUND(GREATEST(similarity(lower(u.username), %(query)s),
+                              similarity(lower(u.display_name), %(query)s))::numeric, 4) as score
+        FROM users u
+        WHERE u.id != %(user_id)s
+          AND (lower(u.username) LIKE %(match)s OR lower(u.display_name) LIKE %(match)s)
+          AND {condition}
+    ) r
+    WHERE %(cursor_id)s::integer IS NULL
+       OR (r.prefix_match, r.score, -r.id) < (%(cursor_prefix)s::integer, %(cursor_score)s::numeric, -%(cursor_id)s::integer)
+    ORDER BY r.prefix_match DESC, r.score DESC, r.id ASC
+    LIMIT %(limit)s
+"""
+SEARCH_PREFIX_CONDITION = "(lower(u.username) LIKE %(prefix)s OR lower(u.display_name) LIKE %(prefix)s)"
+
+def parse_search(request) -> dict:
+    """Параметры SEARCH_QUERY из запроса; None для пустого запроса"""
+    params = request.params
+    query = params.get('query', '').strip().lower()
+    limit = parse_int(params.get('limit')) or SEARCH_PAGE_SIZE
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    if not query:
+        return None
+
+    cursor = decode_search_cursor(params.get('cursor'))
+    prefix_pattern = escape_like(query) + '%'
+    # Триграммный индекс помогает только с запросами от трёх символов,
+    # короче ищем по префиксу через индекс text_pattern_ops
+    match_pattern = '%' + prefix_pattern if len(query) >= 3 else prefix_pattern
+
+    return {
+        'user_id': request.user_id,
+        'query': query,
+        'prefix': prefix_pattern,
+        'match': match_pattern,
+        'cursor_prefix': cursor[0] if cursor else None,
+        'cursor_score': cursor[1] if cursor else None,
+        'cursor_id': cursor[2] if cursor else None,
+        'limit': limit + 1
+    }
+
+def search_page(rows: list, limit: int) -> dict:
+    """Ответ поиска: limit строк и курсор, если была лишняя строка"""
+    users = []
+    for row in rows[:limit]:
+        users.append({
+            'id': row[0],
+            'username': row[1],
+            'name': row[2],
+            'avatar': row[3] or '',
+            'bio': row[4] or '',
+            'isContact': row[5]
+        })
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = f"{last[6]}:{last[7]}:{last[0]}"
+
+    return {'users': users, 'next_cursor': next_cursor}
+
+def decode_rank_cursor(cursor: str) -> tuple:
+    """Курсор полнотекстового поиска: (ранг, id сообщения); None для невалидного"""
+    try:
+        rank, message_id = cursor.split(':')
+        if not Decimal(rank).is_finite():
+            return None
+        return rank, int(message_id)
+    except (AttributeError, ValueError, ArithmeticError):
+        return None
+
+def attachment_from_row(row) -> dict:
+    """Вложение из строки (id, filename, content_type, size, width, height, есть ли превью)"""
+    return {
+        'id': row[0],
+        'filename': row[1],
+        'content_type': row[2],
+        'size': row[3],
+        'width': row[4],
+        'height': row[5],
+        'thumbnail': row[6]
+    }
+
+ATTACHMENTS_QUERY = """
+    SELECT a.id, a.filename, b.content_type, b.size, b.width, b.height, b.thumbnail_key IS NOT NULL
+    FROM attachments a
+    JOIN blobs b ON b.sha256 = a.sha256
+    WHERE a.id = %s
+"""
+
+def fill_attachments(cur, messages: list) -> list:
+    """Вложения сообщений с пустым списком attachments (has_attachments) одним запросом"""
+    pending = {message['id']: message for message in messages if message.get('attachments') == []}
+    if not pending:
+        return messages
+    cur.execute("""
+        SELECT ma.message_id, a.id, a.filename, b.content_type, b.size, b.width, b.height,
+               b.thumbnail_key IS NOT NULL
+        FROM message_attachments ma
+        JOIN attachments a ON a.id = ma.attachment_id
+        JOIN blobs b ON b.sha256 = a.sha256
+        WHERE ma.message_id = ANY(%s)
+        ORDER BY ma.message_id, ma.position
+    """, (list(pending),))
+    for row in cur.fetchall():
+        pending[row[0]]['attachments'].append(attachment_from_row(row[1:]))
+    return messages
+
+def parse_attachment_ids(value) -> list:
+    """id вложений сообщения в исходном порядке; None, если формат неверный"""
+    if value is None:
+        return []
+    if not isinstance(value, list) or len(value) > MAX_ATTACHMENTS_PER_MESSAGE:
+        return None
+    attachment_ids = [parse_int(item) for item in value]
+    if not all(attachment_ids):
+        return None
+    return list(dict.fromkeys(attachment_ids))
+
+def check_attachments(cur, user_id: int, attachment_ids: list):
+    """HttpError, если среди вложений есть чужие или несуществующие"""
+    attachment_ids = sorted(set(attachment_ids))
+    if not attachment_ids:
+        return
+    cur.execute("SELECT COUNT(*) FROM attachments WHERE id = ANY(%s) AND uploaded_by = %s", (attachment_ids, user_id))
+    if cur.fetchone()[0] != len(attachment_ids):
+        raise HttpError('Attachment not found', 404)
+
+def link_attachments(cur, links: list):
+    """Привязка вложений к только что вставленным сообщениям; links — [(строка сообщения, id вложений)]"""
+    message_ids, chat_ids, positions, attachment_ids = [], [], [], []
+    linked = set()
+    for row, ids in links:
+        if row[0] in linked:
+            continue
+        linked.add(row[0])
+        for position, attachment_id in enumerate(ids):
+            message_ids.append(row[0])
+            chat_ids.append(row[1])
+            positions.append(position)
+            attachment_ids.append(attachment_id)
+    if not message_ids:
+        return
+    cur.execute("""
+        INSERT INTO message_attachments (message_id, chat_id, position, attachment_id)
+        SELECT * FROM unnest(%s::integer[], %s::integer[], %s::smallint[], %s::integer[])
+    """, (message_ids, chat_ids, positions, attachment_ids))
+
+def parse_content_type(value) -> str:
+    value = str(value or '').strip().lower()
+    return value if re.match(r'^[\w.+-]+/[\w.+-]+$', value) and len(value) <= 100 else 'application/octet-stream'
+
+def storage_key(kind: str, sha256: str) -> str:
+    """Ключ содержимого в хранилище; первые два символа хеша делят каталог"""
+    return f'{kind}/{sha256[:2]}/{sha256}'
+
+def attachment_storage():
+    """Хранилище вложений; 503, пока STORAGE_URL не задан"""
+    try:
+        return get_storage()
+    except StorageNotConfigured:
+        raise HttpError('Attachment storage is not configured', 503)
+
+def make_thumbnail(storage, blob_key: str, sha256: str, content_type: str) -> tuple:
+    """Превью JPEG и размеры изображения: (ключ превью, ширина, высота) или None.
+    
+    Pillow импортируется только для изображений, чтобы не замедлять холодный
+    старт; если пакета нет, вложения сохраняются без превью.
+    """
+    if not content_type.startswith('image/'):
+        return None
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+
+    output = io.BytesIO()
+    try:
+        with storage.open(blob_key) as source, Image.open(source) as image:
+            width, height = image.size
+            # Размер известен по заголовку, пиксели ещё не декодированы
+            if width * height > MAX_THUMBNAIL_PIXELS:
+                return None
+            # Для JPEG декодер сразу уменьшает изображение в 2–8 раз
+            # Снимки с телефона повёрнуты тегом EXIF Orientation, клиенту нужны размеры после поворота
+            if image.getexif().get(0x0112) in (5, 6, 7, 8):
+                width, height = height, width
+            image.draft('RGB', (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            thumbnail = ImageOps.exif_transpose(image)
+            thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            if thumbnail.mode not in ('RGB', 'L'):
+                thumbnail = thumbnail.convert('RGB')
+            thumbnail.save(output, 'JPEG', quality=80, optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+    key = storage_key('thumbnails', sha256) + '.jpg'
+    storage.put(key, output.getvalue())
+    return key, width, height
+
+def create_attachment(cur, user_id: int, sha256: str, filename: str) -> dict:
+    cur.execute("""
+        INSERT INTO attachments (uploaded_by, sha256, filename) VALUES (%s, %s, %s) RETURNING id
+    """, (user_id, sha256, filename))
+    cur.execute(ATTACHMENTS_QUERY, (cur.fetchone()[0],))
+    return attachment_from_row(cur.fetchone())
+
+def complete_upload(request, upload_id: str, upload: tuple) -> dict:
+    """Проверка хеша, дедупликация по sha256 и превью для полностью принятой загрузки"""
+    cur = request.cur
+    storage = attachment_storage()
+    size, filename, content_type, expected_sha256, key = upload
+
+    # Хеш считается потоково по хранилищу: файл целиком в память не читается
+    digest = hashlib.sha256()
+    for block in storage.read_range(key):
+        digest.update(block)
+    sha256 = digest.hexdigest()
+
+    if expected_sha256 and expected_sha256 != sha256:
+        cur.execute("DELETE FROM uploads WHERE id = %s", (upload_id,))
+        request.conn.commit()
+        storage.delete(key)
+        raise HttpError('Checksum mismatch', 422)
+
+    # Параллельная загрузка того же содержимого ждёт здесь коммита первой
+    blob_key = storage_key('blobs', sha256)
+    cur.execute("""
+        INSERT INTO blobs (sha256, size, content_type, storage_key) VALUES (%s, %s, %s, %s)
+        ON CONFLICT (sha256) DO NOTHING
+        RETURNING sha256
+    """, (sha256, size, content_type, blob_key))
+    if cur.fetchone():
+        storage.move(key, blob_key)
+        thumbnail = make_thumbnail(storage, blob_key, sha256, content_type)
+        if thumbnail:
+            cur.execute("""
+                UPDATE blobs SET thumbnail_key = %s, width = %s, height = %s WHERE sha256 = %s
+            """, (*thumbnail, sha256))
+    else:
+        storage.delete(key)
+
+    cur.execute("DELETE FROM uploads WHERE id = %s", (upload_id,))
+    return create_attachment(cur, request.user_id, sha256, filename)
+
+def parse_range(header: str, size: int) -> tuple:
+    """Первый диапазон Range: (начало, конец включительно); None без заголовка.
+    
+    Для невыполнимого диапазона — ValueError.
+    """
+    match = re.match(r'^bytes=(\d*)-(\d*)', header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    else:
+        start = max(size - int(match.group(2)), 0)
+        end = size - 1
+    if start >= size or start > end:
+        raise ValueError('Range not satisfiable')
+    return start, end
+
+def fetch_new_messages(cur, user_id: int, since_id: int, upto_id: int = None, limit: int = DEFAULT_PAGE_SIZE,
+                       snapshot: str = None, since_snapshot: str = None, since_ts: float = None) -> list:
+    """Сообщения во всех чатах пользователя с id больше since_id (и не больше upto_id).
     
-    method = event.get('httpMethod', 'GET')
+    snapshot оставляет только сообщения, видимые в этом снимке. since_snapshot
+    добавляет сообщения с id не больше since_id, которых не было в прошлом
+    снимке: id выдаётся до коммита, и транзакция с меньшим id может
+    закоммититься позже транзакции с большим. Такие транзакции шли во время
+    прошлой выдачи since_ts, по нему и ограничивается created_at.
+    """
+    cur.execute("""
+        SELECT m.id, m.chat_id, m.text, m.sender_id, TO_CHAR(m.created_at, 'HH24:MI') as time, m.has_attachments
+        FROM chat_members cm
+        JOIN messages m ON m.chat_id = cm.chat_id AND (
+            m.id > %(since_id)s AND (%(upto_id)s::integer IS NULL OR m.id <= %(upto_id)s)
+            OR m.id <= %(since_id)s
+               AND m.xid >= pg_snapshot_xmin(%(since_snapshot)s::pg_snapshot)
+               AND NOT pg_visible_in_snapshot(m.xid, %(since_snapshot)s::pg_snapshot)
+        )
+        WHERE cm.user_id = %(user_id)s
+          AND m.created_at >= LEAST(
+              messages_time_floor(%(since_id)s),
+              CASE WHEN %(since_snapshot)s::pg_snapshot IS NOT NULL
+                   THEN TO_TIMESTAMP(%(since_ts)s) AT TIME ZONE 'UTC' - INTERVAL '1 day'
+                   ELSE 'infinity'::timestamp END
+          )
+          AND (%(snapshot)s::pg_snapshot IS NULL OR m.xid IS NULL
+               OR pg_visible_in_snapshot(m.xid, %(snapshot)s::pg_snapshot))
+        ORDER BY m.id ASC
+        LIMIT %(limit)s
+    """, {
+        'user_id': user_id,
+        'since_id': since_id,
+        'upto_id': upto_id,
+        'snapshot': snapshot,
+        'since_snapshot': since_snapshot,
+        'since_ts': since_ts,
+        'limit': limit
+    })
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, Authorization'
-            },
-            'body': ''
+    messages = []
+    for row in cur.fetchall():
+        message = {
+            'id': row[0],
+            'chat_id': row[1],
+            'text': row[2],
+            'sender': 'me' if row[3] == user_id else 'other',
+            'sender_id': row[3],
+            'time': row[4]
         }
+        if row[5]:
+            message['attachments'] = []
+        messages.append(message)
+    return fill_attachments(cur, messages)
+
+def sync_state(cur) -> tuple:
+    """Текущая граница: (максимальный id, снимок pg_snapshot, время) одним оператором"""
+    cur.execute("""
+        SELECT COALESCE(MAX(id), 0), pg_current_snapshot()::text, EXTRACT(EPOCH FROM LOCALTIMESTAMP)
+        FROM messages
+    """)
+    high_id, snapshot, now_ts = cur.fetchone()
+    return high_id, snapshot, float(now_ts)
+
+def fetch_sync_page(cur, user_id: int, cursor: tuple, limit: int) -> tuple:
+    """Страница сообщений после курсора: (сообщения, has_more, следующий курсор).
     
+    Курсор без границы — конец прошлой выдачи: граница и снимок берутся
+    текущие, а сообщения, не видимые в прошлом снимке, досылаются. Курсор с
+    границей продолжает выдачу в её снимке.
+    """
+    since_id, since_snapshot, since_ts, upto_id = cursor
+    if upto_id is None:
+        upto_id, snapshot, now_ts = sync_state(cur)
+    else:
+        snapshot, now_ts, since_snapshot = since_snapshot, since_ts, None
+
+    messages = fetch_new_messages(cur, user_id, since_id, upto_id, limit + 1, snapshot, since_snapshot, since_ts)
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    # Сообщения, закоммиченные после снимка, не видны в нём и придут
+    # в следующий раз как досылаемые
+    if has_more:
+        next_cursor = encode_sync_cursor(messages[-1]['id'], snapshot, now_ts, upto_id)
+    else:
+        next_cursor = encode_sync_cursor(max(upto_id, since_id), snapshot, now_ts)
+    return messages, has_more, next_cursor
+
+def listen_chats(conn, user_id: int, chat_ids: list):
+    """Подписка соединения на новые сообщения в чатах и на канал пользователя
+    (его добавили в чат) одним обращением к базе"""
+    channels = [f'chat_{int(chat_id)}' for chat_id in chat_ids] + [f'user_{int(user_id)}']
+    cur = conn.cursor()
     try:
-        headers = event.get('headers', {})
-        auth_header = headers.get('authorization', '') or headers.get('Authorization', '')
-        token = auth_header.replace('Bearer ', '').strip() if auth_header else ''
-        user_id = parse_token(token)
-        
-        if not user_id:
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Unauthorized', 'debug': f'Token: {token[:20] if token else "empty"}'})
-            }
-        
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        if method == 'GET':
-            action = event.get('queryStringParameters', {}).get('action', '')
-            
-            if action == 'chats':
-                cur.execute("""
-                    SELECT DISTINCT c.id, 
-                           u.id, u.username, u.display_name, u.avatar_url, 
-                           (SELECT last_seen > NOW() - INTERVAL '5 minutes' FROM users WHERE id = u.id) as online,
-                           m.text as last_message,
-                           TO_CHAR(m.created_at, 'HH24:MI') as last_time,
-                           (SELECT COUNT(*) FROM messages WHERE chat_id = c.id AND sender_id != %s 
-                            AND created_at > COALESCE((SELECT last_seen FROM users WHERE id = %s), '1970-01-01')) as unread
-                    FROM chats c
-                    JOIN chat_members cm ON c.id = cm.chat_id
-                    JOIN chat_members cm2 ON c.id = cm2.chat_id AND cm2.user_id != cm.user_id
-                    JOIN users u ON cm2.user_id = u.id
-                    LEFT JOIN LATERAL (
-                        SELECT text, created_at 
-                        FROM messages 
-                        WHERE chat_id = c.id 
-                        ORDER BY created_at DESC 
-                        LIMIT 1
-                    ) m ON true
-                    WHERE cm.user_id = %s
-                    ORDER BY m.created_at DESC NULLS LAST
-                """, (user_id, user_id, user_id))
-                
-                chats = []
-                for row in cur.fetchall():
-                    chats.append({
-                        'id': row[0],
-                        'user': {
-                            'id': row[1],
-                            'username': row[2],
-                            'name': row[3],
-                            'avatar': row[4] or '',
-                            'online': row[5] or False
-                        },
-                        'lastMessage': row[6] or '',
-                        'time': row[7] or '',
-                        'unread': row[8] or 0
-                    })
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'chats': chats})
-                }
-            
-            elif action == 'contacts':
-                cur.execute("""
-                    SELECT u.id, u.username, u.display_name, u.avatar_url, u.bio,
-                           (SELECT last_seen > NOW() - INTERVAL '5 minutes' FROM users WHERE id = u.id) as online
-                    FROM contacts c
-                    JOIN users u ON c.contact_user_id = u.id
-                    WHERE c.user_id = %s
-                    ORDER BY u.display_name
-                """, (user_id,))
-                
-                contacts = []
-                for row in cur.fetchall():
-                    contacts.append({
-                        'id': row[0],
-                        'username': row[1],
-                        'name': row[2],
-                        'avatar': row[3] or '',
-                        'bio': row[4] or '',
-                        'online': row[5] or False
-                    })
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'contacts': contacts})
-                }
-            
-            elif action == 'messages':
-                chat_id = event.get('queryStringParameters', {}).get('chat_id')
-                
-                if not chat_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'chat_id required'})
-                    }
-                
-                cur.execute("""
-                    SELECT m.id, m.text, m.sender_id, TO_CHAR(m.created_at, 'HH24:MI') as time
-                    FROM messages m
-                    WHERE m.chat_id = %s
-                    ORDER BY m.created_at ASC
-                """, (chat_id,))
-                
-                messages = []
-                for row in cur.fetchall():
-                    messages.append({
-                        'id': row[0],
-                        'text': row[1],
-                        'sender': 'me' if row[2] == user_id else 'other',
-                        'time': row[3]
-                    })
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'messages': messages})
-                }
-            
-            elif action == 'search':
-                query = event.get('queryStringParameters', {}).get('query', '').strip().lower()
-                
-                if not query:
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'users': []})
-                    }
-                
-                cur.execute("""
-                    SELECT u.id, u.username, u.display_name, u.avatar_url, u.bio,
-                           EXISTS(SELECT 1 FROM contacts WHERE user_id = %s AND contact_user_id = u.id) as is_contact
-                    FROM users u
-                    WHERE u.id != %s AND (u.username LIKE %s OR u.display_name LIKE %s)
-                    LIMIT 20
-                """, (user_id, user_id, f'%{query}%', f'%{query}%'))
-                
-                users = []
-                for row in cur.fetchall():
-                    users.append({
-                        'id': row[0],
-                        'username': row[1],
-                        'name': row[2],
-                        'avatar': row[3] or '',
-                        'bio': row[4] or '',
-                        'isContact': row[5]
-                    })
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'users': users})
-                }
-            
-            else:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Unknown action'})
-                }
-        
-        elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
-            if action == 'send':
-                chat_id = body.get('chat_id')
-                text = body.get('text', '').strip()
-                
-                if not chat_id or not text:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'chat_id and text required'})
-                    }
-                
-                cur.execute("""
-                    INSERT INTO messages (chat_id, sender_id, text)
-                    VALUES (%s, %s, %s)
-                    RETURNING id, TO_CHAR(created_at, 'HH24:MI')
-                """, (chat_id, user_id, text))
-                
-                msg_id, time = cur.fetchone()
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'message': {
-                            'id': msg_id,
-                            'text': text,
-                            'sender': 'me',
-                            'time': time
-                        }
-                    })
-                }
-            
-            elif action == 'add_contact':
-                username = body.get('username', '').strip().lower()
-                
-                if not username:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'username required'})
-                    }
-                
-                cur.execute("SELECT id FROM users WHERE username = %s", (username,))
-                contact_user = cur.fetchone()
-                
-                if not contact_user:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Пользователь не найден'})
-                    }
-                
-                contact_id = contact_user[0]
-                
-                if contact_id == user_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Нельзя добавить себя в контакты'})
-                    }
-                
-                cur.execute("""
-                    INSERT INTO contacts (user_id, contact_user_id)
-                    VALUES (%s, %s)
-                    ON CONFLICT DO NOTHING
-                """, (user_id, contact_id))
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True})
-                }
-            
-            elif action == 'create_chat':
-                contact_id = body.get('contact_id')
-                
-                if not contact_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'contact_id required'})
-                    }
-                
-                cur.execute("""
-                    SELECT c.id FROM chats c
-                    JOIN chat_members cm1 ON c.id = cm1.chat_id AND cm1.user_id = %s
-                    JOIN chat_members cm2 ON c.id = cm2.chat_id AND cm2.user_id = %s
-                    LIMIT 1
-                """, (user_id, contact_id))
-                
-                existing_chat = cur.fetchone()
-                
-                if existing_chat:
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': True, 'chat_id': existing_chat[0]})
-                    }
-                
-                cur.execute("INSERT INTO chats DEFAULT VALUES RETURNING id")
-                chat_id = cur.fetchone()[0]
-                
-                cur.execute("""
-                    INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s), (%s, %s)
-                """, (chat_id, user_id, chat_id, contact_id))
-                
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'chat_id': chat_id})
-                }
-            
-            else:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Unknown action'})
-                }
-        
-        else:
-            return {
-                'statusCode': 405,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Method not allowed'})
-            }
+        cur.execute('; '.join(f'LISTEN {channel}' for channel in channels))
+        conn.commit()
+    finally:
+        cur.close()
+
+def unlisten_all(conn):
+    """Снятие всех подписок соединения"""
+    cur = conn.cursor()
+    try:
+        cur.execute("UNLISTEN *")
+        conn.commit()
+    finally:
+        cur.close()
+    del conn.notifies[:]
+
+def wait_for_notify(conn, timeout: float) -> set:
+    """Ожидание NOTIFY; каналы пришедших уведомлений, пустое множество по таймауту.
     
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Server error: {str(e)}'})
+    Запросов к базе нет. Id в уведомлении не сравнивается с курсором:
+    сообщение с меньшим id тоже может оказаться новым, это решает следующая выборка.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        conn.poll()
+        if conn.notifies:
+            channels = {notify.channel for notify in conn.notifies}
+            del conn.notifies[:]
+            return channels
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return set()
+        select.select([conn], [], [], remaining)
+
+def parse_client_id(value) -> str:
+    """Нормализация клиентского UUID сообщения; None для невалидного"""
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        return None
+
+def insert_messages(cur, user_id: int, items: list) -> list:
+    """Вставка сообщений одним запросом с дедупликацией по (sender_id, client_id).
+    
+    items — список {'chat_id', 'text', 'client_id', 'attachment_ids'}; вложения
+    должны быть заранее проверены check_attachments. Результат в порядке items:
+    сохранённое сообщение (при повторе client_id — исходное) или None, если
+    пользователь не участник чата.
+    """
+    if not items:
+        return []
+    
+    # Ключ сначала занимается в message_client_ids; сообщение вставляется только
+    # для занятых ключей, повторы потом находятся по (sender_id, client_id)
+    cur.execute("""
+        WITH input AS (
+            SELECT DISTINCT ON (t.client_id) t.chat_id, t.text, t.client_id, t.has_attachments, t.ord
+            FROM unnest(%(chat_ids)s::integer[], %(texts)s::text[], %(client_ids)s::uuid[], %(has_attachments)s::boolean[])
+                 WITH ORDINALITY AS t(chat_id, text, client_id, has_attachments, ord)
+            WHERE EXISTS (SELECT 1 FROM chat_members cm WHERE cm.chat_id = t.chat_id AND cm.user_id = %(user_id)s)
+            ORDER BY t.client_id, t.ord
+        ), claimed AS (
+            INSERT INTO message_client_ids (sender_id, client_id)
+            SELECT %(user_id)s, client_id FROM input
+            ON CONFLICT DO NOTHING
+            RETURNING client_id
+        )
+        INSERT INTO messages (chat_id, sender_id, text, client_id, has_attachments)
+        SELECT i.chat_id, %(user_id)s, i.text, i.client_id, i.has_attachments
+        FROM input i
+        JOIN claimed c ON c.client_id = i.client_id
+        ORDER BY i.ord
+        RETURNING id, chat_id, text, client_id, TO_CHAR(created_at, 'HH24:MI'), has_attachments
+    """, {
+        'user_id': user_id,
+        'chat_ids': [item['chat_id'] for item in items],
+        'texts': [item['text'] for item in items],
+        'client_ids': [item['client_id'] for item in items],
+        'has_attachments': [bool(item.get('attachment_ids')) for item in items]
+    })
+    rows = {str(row[3]): (row, False) for row in cur.fetchall()}
+    link_attachments(cur, [
+        (rows[item['client_id']][0], item['attachment_ids'])
+        for item in items if item.get('attachment_ids') and item['client_id'] in rows
+    ])
+    
+    missing = [item['client_id'] for item in items if item['client_id'] not in rows]
+    if missing:
+        cur.execute("""
+            SELECT id, chat_id, text, client_id, TO_CHAR(created_at, 'HH24:MI'), has_attachments
+            FROM messages
+            WHERE sender_id = %s AND client_id = ANY(%s::uuid[])
+        """, (user_id, missing))
+        for row in cur.fetchall():
+            rows[str(row[3])] = (row, True)
+    
+    messages = []
+    for item in items:
+        if item['client_id'] not in rows:
+            messages.append(None)
+            continue
+        row, duplicate = rows[item['client_id']]
+        message = {
+            'id': row[0],
+            'chat_id': row[1],
+            'client_id': str(row[3]),
+            'text': row[2],
+            'sender': 'me',
+            'sender_id': user_id,
+            'time': row[4],
+            'duplicate': duplicate
         }
+        if row[5]:
+            message['attachments'] = []
+        messages.append(message)
+    fill_attachments(cur, [message for message in messages if message is not None])
+    return messages
+
+def fetch_latest_messages(cur, user_id: int, chat_ids: list, after_ids: list, limit: int) -> list:
+    """Последние сообщения нескольких чатов одним запросом, не больше limit на чат"""
+    cur.execute("""
+        SELECT m.id, m.chat_id, m.text, m.sender_id, TO_CHAR(m.created_at, 'HH24:MI') as time, m.has_attachments
+        FROM unnest(%s::integer[], %s::integer[]) AS f(chat_id, after_id)
+        JOIN chat_members cm ON cm.chat_id = f.chat_id AND cm.user_id = %s
+        CROSS JOIN LATERAL (
+            SELECT id, chat_id, text, sender_id, created_at, has_attachments
+            FROM messages
+            WHERE chat_id = f.chat_id AND id > f.after_id AND created_at >= messages_time_floor(f.after_id)
+            ORDER BY id DESC
+            LIMIT %s
+        ) m
+        ORDER BY m.chat_id, m.id
+    """, (chat_ids, after_ids, user_id, limit + 1))
+    
+    pages = {chat_id: [] for chat_id in chat_ids}
+    for row in cur.fetchall():
+        message = {
+            'id': row[0],
+            'text': row[2],
+            'sender': 'me' if row[3] == user_id else 'other',
+            'sender_id': row[3],
+            'time': row[4]
+        }
+        if row[5]:
+            message['attachments'] = []
+        pages[row[1]].append(message)
+    fill_attachments(cur, [message for page in pages.values() for message in page])
+    
+    # Лишняя (самая старая) строка на чат только отмечает, что есть ещё сообщения
+    return [
+        {'chat_id': chat_id, 'messages': page[-limit:], 'has_more': len(page) > limit}
+        for chat_id, page in pages.items()
+    ]
+
+def ensure_partitions(request):
+    """Создание партиций messages на ближайшие месяцы, не чаще раза в сутки на процесс.
     
+    Ошибка не мешает записи: сообщение попадёт в существующую партицию или
+    в messages_default, а повтор будет не раньше PARTITION_RETRY_INTERVAL.
+    """
+    global partitions_check_due
+    if partitions_check_due and time.monotonic() < partitions_check_due:
+        return
+    conn = request.conn
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT ensure_messages_partitions(%s)", (PARTITION_MONTHS_AHEAD,))
+        conn.commit()
+        partitions_check_due = time.monotonic() + PARTITION_CHECK_INTERVAL
+    except Exception as e:
+        conn.rollback()
+        partitions_check_due = time.monotonic() + PARTITION_RETRY_INTERVAL
+        sys.stdout.write(json.dumps({'error': 'ensure_messages_partitions failed', 'detail': str(e)}) + '\n')
+        sys.stdout.flush()
     finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+        cur.close()
+
+
+router = Router(allow_headers='Content-Type, Authorization, If-None-Match, Range')
+
+
+@router.before
+def authenticate(request):
+    """Проверка access-токена; база нужна только для обновления списка отзыва"""
+    auth_header = request.header('Authorization')
+    token = auth_header.replace('Bearer ', '').strip() if auth_header else ''
+    claims = verify_token(token)
+    if not claims:
+        raise HttpError('Unauthorized', 401)
+
+    request.claims = claims
+    request.user_id = claims['sub']
+    presence.heartbeat(request.user_id)
+
+    if revocations.is_revoked(claims['jti'], lambda: request.cur):
+        raise HttpError('Unauthorized', 401)
+
+
+@router.before
+def prepare_write(request):
+    if request.method == 'POST':
+        ensure_partitions(request)
+
+
+@router.teardown
+def flush_presence(request):
+    # Отметки пишутся попутно, когда подключение к базе уже взято
+    if request.has_connection:
+        presence.flush(request.conn)
+
+
+@router.route('GET', 'chats')
+def chats(request) -> dict:
+    user_id = request.user_id
+    # Без If-None-Match версия считается по строкам списка, отдельный запрос не нужен
+    if request.header('If-None-Match'):
+        etag = make_etag('chats', user_id, *chats_version(request.cur, user_id), presence_bucket())
+        if request.not_modified(etag):
+            return not_modified(etag)
+
+    request.cur.execute(CHATS_QUERY, (MEMBER_PREVIEW_SIZE, user_id, None, None))
+    rows = request.cur.fetchall()
+    etag = make_etag('chats', user_id, *chats_version_from_rows(rows), presence_bucket())
+    chats = build_chats(rows, load_profiles(request.cur, chat_member_ids(rows)))
+
+    return json_response({'chats': chats}, headers=etag_headers(etag))
+
+
+@router.route('GET', 'contacts')
+def contacts(request) -> dict:
+    user_id = request.user_id
+    etag = make_etag('contacts', user_id, *contacts_version(request.cur, user_id), presence_bucket())
+    if request.not_modified(etag):
+        return not_modified(etag)
+
+    contact_ids = cache.get(contacts_key(user_id))
+
+    if contact_ids is None:
+        request.cur.execute(CONTACTS_QUERY, (user_id,))
+        profiles, contact_ids = store_contacts(user_id, request.cur.fetchall())
+    else:
+        profiles = load_profiles(request.cur, contact_ids)
+
+    return json_response({'contacts': build_contacts(contact_ids, profiles)}, headers=etag_headers(etag))
+
+
+@router.route('GET', 'messages')
+def messages(request) -> dict:
+    user_id = request.user_id
+    params = request.params
+    chat_id = parse_int(params.get('chat_id'))
+    before_id = parse_int(params.get('before_id'))
+    after_id = parse_int(params.get('after_id'))
+    limit = parse_int(params.get('limit')) or DEFAULT_PAGE_SIZE
+
+    if not chat_id:
+        return error('chat_id required')
+
+    if before_id and after_id:
+        return error('before_id and after_id are mutually exclusive')
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    # Сообщения только добавляются: страница старше before_id не меняется,
+    # остальные меняются только с последним сообщением чата
+    request.cur.execute("""
+        SELECT COALESCE(s.last_message_id, 0)
+        FROM chat_members cm
+        LEFT JOIN chat_summaries s ON s.chat_id = cm.chat_id
+        WHERE cm.chat_id = %s AND cm.user_id = %s
+    """, (chat_id, user_id))
+    version = request.cur.fetchone()
+    if not version:
+        return error('Chat not found', 404)
+
+    etag = make_etag('messages', user_id, chat_id, before_id, after_id, limit,
+                     'history' if before_id else version[0])
+    if request.not_modified(etag):
+        return not_modified(etag)
+
+    # Страница читается по индексу (chat_id, id): берём limit + 1 строку,
+    # лишняя строка только сообщает, что за страницей есть ещё сообщения.
+    # Граница created_at по курсору отсекает лишние партиции
+    if after_id:
+        request.cur.execute("""
+            SELECT m.id, m.text, m.sender_id, TO_CHAR(m.created_at, 'HH24:MI') as time, m.has_attachments
+            FROM messages m
+            WHERE m.chat_id = %s AND m.id > %s AND m.created_at >= messages_time_floor(%s)
+            ORDER BY m.id ASC
+            LIMIT %s
+        """, (chat_id, after_id, after_id, limit + 1))
+        rows = request.cur.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+    else:
+        request.cur.execute("""
+            SELECT m.id, m.text, m.sender_id, TO_CHAR(m.created_at, 'HH24:MI') as time, m.has_attachments
+            FROM messages m
+            WHERE m.chat_id = %s AND (%s::integer IS NULL OR m.id < %s AND m.created_at <= messages_time_ceiling(%s))
+            ORDER BY m.id DESC
+            LIMIT %s
+        """, (chat_id, before_id, before_id, before_id, limit + 1))
+        rows = request.cur.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit][::-1]
+
+    messages = []
+    for row in rows:
+        message = {
+            'id': row[0],
+            'text': row[1],
+            'sender': 'me' if row[2] == user_id else 'other',
+            'sender_id': row[2],
+            'time': row[3]
+        }
+        if row[4]:
+            message['attachments'] = []
+        messages.append(message)
+    fill_attachments(request.cur, messages)
+
+    next_cursor = None
+    if has_more and messages:
+        next_cursor = messages[-1]['id'] if after_id else messages[0]['id']
+
+    return json_response({
+        'messages': messages,
+        'has_more': has_more,
+        'next_cursor': next_cursor
+    }, headers=etag_headers(etag))
+
+
+@router.route('GET', 'members')
+def members(request) -> dict:
+    user_id = request.user_id
+    params = request.params
+    chat_id = parse_int(params.get('chat_id'))
+    after_id = parse_int(params.get('cursor')) or 0
+    limit = parse_int(params.get('limit')) or DEFAULT_PAGE_SIZE
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    if not chat_id:
+        return error('chat_id required')
+
+    group_role(request.cur, chat_id, user_id)
+    request.cur.execute("""
+        SELECT user_id, role FROM chat_members
+        WHERE chat_id = %s AND user_id > %s
+        ORDER BY user_id
+        LIMIT %s
+    """, (chat_id, after_id, limit + 1))
+    rows = request.cur.fetchall()
+    profiles = load_profiles(request.cur, [row[0] for row in rows[:limit]])
+
+    members = []
+    for member_id, role in rows[:limit]:
+        profile = profiles.get(member_id)
+        if profile is None:
+            continue
+        members.append({
+            'id': profile['id'],
+            'username': profile['username'],
+            'name': profile['name'],
+            'avatar': profile['avatar'],
+            'online': is_online(profile),
+            'role': role
+        })
+
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+
+    return json_response({'members': members, 'next_cursor': next_cursor})
+
+
+@router.route('GET', 'search')
+def search(request) -> dict:
+    search_params = parse_search(request)
+    if search_params is None:
+        return json_response({'users': [], 'next_cursor': None})
+
+    request.cur.execute(SEARCH_QUERY.format(condition='TRUE'), search_params)
+    return json_response(search_page(request.cur.fetchall(), search_params['limit'] - 1))
+
+
+@router.route('GET', 'search_messages')
+def search_messages(request) -> dict:
+    user_id = request.user_id
+    params = request.params
+    query = params.get('query', '').strip()
+    chat_id = parse_int(params.get('chat_id'))
+    limit = parse_int(params.get('limit')) or SEARCH_PAGE_SIZE
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    if not query:
+        return json_response({'results': [], 'next_cursor': None})
+
+    cursor = decode_rank_cursor(params.get('cursor'))
+
+    # Сниппеты строятся только для строк страницы, ts_headline заметно дороже ранжирования
+    request.cur.execute("""
+        WITH q AS (
+            SELECT websearch_to_tsquery('russian', %(query)s) || websearch_to_tsquery('english', %(query)s) as tsq
+        )
+        SELECT r.id, r.chat_id, r.sender_id, TO_CHAR(r.created_at, 'HH24:MI') as time, r.rank,
+               ts_headline('russian', r.text, q.tsq, 'MaxWords=20, MinWords=5, MaxFragments=2') as snippet
+        FROM (
+            SELECT m.id, m.chat_id, m.sender_id, m.created_at, m.text,
+                   ROUND(ts_rank(m.search_vector, q.tsq)::numeric, 6) as rank
+            FROM messages m, q
+            WHERE m.search_vector @@ q.tsq
+              AND m.chat_id IN (SELECT chat_id FROM chat_members WHERE user_id = %(user_id)s)
+              AND (%(chat_id)s::integer IS NULL OR m.chat_id = %(chat_id)s)
+        ) r, q
+        WHERE %(cursor_id)s::integer IS NULL
+           OR (r.rank, r.id) < (%(cursor_rank)s::numeric, %(cursor_id)s)
+        ORDER BY r.rank DESC, r.id DESC
+        LIMIT %(limit)s
+    """, {
+        'query': query,
+        'user_id': user_id,
+        'chat_id': chat_id,
+        'cursor_rank': cursor[0] if cursor else None,
+        'cursor_id': cursor[1] if cursor else None,
+        'limit': limit + 1
+    })
+    rows = request.cur.fetchall()
+
+    results = []
+    for row in rows[:limit]:
+        results.append({
+            'id': row[0],
+            'chat_id': row[1],
+            'sender': 'me' if row[2] == user_id else 'other',
+            'time': row[3],
+            'rank': float(row[4]),
+            'snippet': row[5]
+        })
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = f"{last[4]}:{last[0]}"
+
+    return json_response({'results': results, 'next_cursor': next_cursor})
+
+
+@router.route('GET', 'pool_stats')
+def show_pool_stats(request) -> dict:
+    from db import pool_stats
+    return json_response({'pool': pool_stats()})
+
+
+@router.route('GET', 'cache_stats')
+def show_cache_stats(request) -> dict:
+    return json_response({'cache': cache.stats()})
+
+
+@router.route('GET', 'sync')
+def sync(request) -> dict:
+    user_id = request.user_id
+    params = request.params
+    limit = parse_int(params.get('limit')) or DEFAULT_PAGE_SIZE
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    cursor = params.get('cursor')
+    if not cursor:
+        high_id, snapshot, now_ts = sync_state(request.cur)
+        return json_response({
+            'cursor': encode_sync_cursor(high_id, snapshot, now_ts),
+            'has_more': False,
+            'messages': [],
+            'chats': [],
+            'removed_chats': [],
+            'presence': []
+        })
+
+    since = decode_sync_cursor(cursor)
+    if not since:
+        return error('Invalid cursor')
+    since_snapshot, since_ts, continued = since[1], since[2], since[3] is not None
+
+    messages, has_more, next_cursor = fetch_sync_page(request.cur, user_id, since, limit)
+    changed_chat_ids = {message['chat_id'] for message in messages}
+
+    # Изменения чатов, выходы и статусы считаются относительно прошлой
+    # синхронизации один раз, на первой странице выдачи
+    removed_chat_ids = []
+    presence_changes = []
+    if not continued and since_snapshot:
+        # Вступление, прочтение с другого устройства, роль — строка участника;
+        # новые сообщения, состав, название — сводка чата
+        request.cur.execute("""
+            SELECT cm.chat_id
+            FROM chat_members cm
+            LEFT JOIN chat_summaries s ON s.chat_id = cm.chat_id
+            WHERE cm.user_id = %(user_id)s AND (
+                cm.changed_xid >= pg_snapshot_xmin(%(snapshot)s::pg_snapshot)
+                AND NOT pg_visible_in_snapshot(cm.changed_xid, %(snapshot)s::pg_snapshot)
+                OR s.changed_xid >= pg_snapshot_xmin(%(snapshot)s::pg_snapshot)
+                AND NOT pg_visible_in_snapshot(s.changed_xid, %(snapshot)s::pg_snapshot)
+            )
+        """, {'user_id': user_id, 'snapshot': since_snapshot})
+        changed_chat_ids.update(row[0] for row in request.cur.fetchall())
+
+        request.cur.execute("""
+            SELECT DISTINCT r.chat_id
+            FROM chat_removals r
+            WHERE r.user_id = %(user_id)s
+              AND r.xid >= pg_snapshot_xmin(%(snapshot)s::pg_snapshot)
+              AND NOT pg_visible_in_snapshot(r.xid, %(snapshot)s::pg_snapshot)
+              AND NOT EXISTS (SELECT 1 FROM chat_members cm WHERE cm.chat_id = r.chat_id AND cm.user_id = r.user_id)
+        """, {'user_id': user_id, 'snapshot': since_snapshot})
+        removed_chat_ids = sorted(row[0] for row in request.cur.fetchall())
+    elif not continued:
+        request.cur.execute("""
+            SELECT chat_id FROM chat_members
+            WHERE user_id = %s AND joined_at > TO_TIMESTAMP(%s) AT TIME ZONE 'UTC'
+        """, (user_id, since_ts))
+        changed_chat_ids.update(row[0] for row in request.cur.fetchall())
+
+    chats = fetch_chats(request.cur, user_id, sorted(changed_chat_ids)) if changed_chat_ids else []
+
+    if not continued:
+        # Статус «в сети» мог измениться только у тех, чей last_seen попадает
+        # в окно 5 минут до прошлой синхронизации или позже. Участники групп
+        # сюда не входят: их статус в списке чатов не показывается
+        request.cur.execute("""
+            SELECT u.id, EXTRACT(EPOCH FROM LOCALTIMESTAMP - u.last_seen) as last_seen_age
+            FROM users u
+            WHERE u.last_seen > TO_TIMESTAMP(%s) AT TIME ZONE 'UTC' - INTERVAL '5 minutes'
+              AND u.id IN (
+                  SELECT cm2.user_id FROM chat_members cm
+                  JOIN chats c ON c.id = cm.chat_id AND NOT c.is_group
+                  JOIN chat_members cm2 ON cm2.chat_id = cm.chat_id AND cm2.user_id != cm.user_id
+                  WHERE cm.user_id = %s
+                  UNION
+                  SELECT contact_user_id FROM contacts WHERE user_id = %s
+              )
+        """, (since_ts, user_id, user_id))
+        presence_changes = [
+            {'id': row[0], 'online': presence.is_online(row[0], row[1])}
+            for row in request.cur.fetchall()
+        ]
+
+    return json_response({
+        'cursor': next_cursor,
+        'has_more': has_more,
+        'messages': messages,
+        'chats': chats,
+        'removed_chats': removed_chat_ids,
+        'presence': presence_changes
+    })
+
+
+def poll_cursor(cur, params: dict) -> tuple:
+    """Курсор poll: из cursor (формат sync), из after_id без досылки или текущий"""
+    if params.get('cursor'):
+        cursor = decode_sync_cursor(params['cursor'])
+        if not cursor:
+            raise HttpError('Invalid cursor')
+        return cursor
+    after_id = parse_int(params.get('after_id'))
+    if after_id is None:
+        high_id, snapshot, now_ts = sync_state(cur)
+        return high_id, snapshot, now_ts, None
+    return after_id, None, time.time(), None
+
+
+@router.route('GET', 'poll')
+def poll(request) -> dict:
+    user_id = request.user_id
+    params = request.params
+    timeout = parse_int(params.get('timeout'))
+    timeout = MAX_POLL_TIMEOUT if timeout is None else max(0, min(timeout, MAX_POLL_TIMEOUT))
+
+    request.cur.execute("SELECT chat_id FROM chat_members WHERE user_id = %s", (user_id,))
+    chat_ids = [row[0] for row in request.cur.fetchall()]
+    cursor = poll_cursor(request.cur, params)
+
+    # Подписка оформляется до контрольного запроса, чтобы не потерять
+    # сообщение, закоммиченное между запросом и началом ожидания. Без чатов
+    # poll тоже ждёт: канал пользователя разбудит его, когда появится чат
+    listen_chats(request.conn, user_id, chat_ids)
+    try:
+        messages, has_more, next_cursor = fetch_sync_page(request.cur, user_id, cursor, MAX_PAGE_SIZE)
+        # Уведомления доставляются только вне транзакции
+        request.conn.commit()
+        if not messages and wait_for_notify(request.conn, timeout):
+            # Выборка идёт по текущему составу чатов, так что сообщения нового
+            # чата тоже попадут; подписка на него — со следующим poll
+            messages, has_more, next_cursor = fetch_sync_page(request.cur, user_id, cursor, MAX_PAGE_SIZE)
+    finally:
+        unlisten_all(request.conn)
+
+    return json_response({
+        'messages': messages,
+        'has_more': has_more,
+        'cursor': next_cursor
+    })
+
+
+@router.route('POST', 'send')
+def send(request) -> dict:
+    body = request.body
+    user_id = request.user_id
+    chat_id = parse_int(body.get('chat_id'))
+    text = body.get('text', '').strip()
+    client_id = body.get('client_id')
+    attachment_ids = parse_attachment_ids(body.get('attachment_ids'))
+
+    if attachment_ids is None:
+        return error(f'attachment_ids must be a list of up to {MAX_ATTACHMENTS_PER_MESSAGE} ids')
+
+    if not chat_id or not (text or attachment_ids):
+        return error('chat_id and text or attachment_ids required')
+
+    # Без client_id повтор запроса не распознать, поэтому ключ выдаёт сервер
+    client_id = parse_client_id(client_id) if client_id else str(uuid.uuid4())
+    if not client_id:
+        return error('client_id must be a UUID')
+
+    check_attachments(request.cur, user_id, attachment_ids)
+    message = insert_messages(request.cur, user_id, [{
+        'chat_id': chat_id,
+        'text': text,
+        'client_id': client_id,
+        'attachment_ids': attachment_ids
+    }])[0]
+    request.conn.commit()
+
+    if message is None:
+        return error('Chat not found', 404)
+
+    return json_response({
+        'success': True,
+        'message': message
+    })
+
+
+@router.route('POST', 'batch')
+def batch(request) -> dict:
+    body = request.body
+    user_id = request.user_id
+    sends = body.get('sends') or []
+    fetch = body.get('fetch') or []
+    limit = parse_int(body.get('limit')) or DEFAULT_PAGE_SIZE
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    if not isinstance(sends, list) or not isinstance(fetch, list) \
+            or len(sends) > MAX_BATCH_SENDS or len(fetch) > MAX_BATCH_FETCH:
+        return error(f'sends (up to {MAX_BATCH_SENDS}) and fetch (up to {MAX_BATCH_FETCH}) must be lists')
+
+    items = []
+    for send in sends:
+        send = send if isinstance(send, dict) else {}
+        item = {
+            'chat_id': parse_int(send.get('chat_id')),
+            'text': str(send.get('text') or '').strip(),
+            'client_id': parse_client_id(send.get('client_id')),
+            'attachment_ids': parse_attachment_ids(send.get('attachment_ids'))
+        }
+        if not item['chat_id'] or not (item['text'] or item['attachment_ids']) or not item['client_id'] \
+                or item['attachment_ids'] is None:
+            return error('Each send requires chat_id, text or attachment_ids and a UUID client_id')
+        items.append(item)
+
+    fetch_chat_ids = []
+    fetch_after_ids = []
+    for entry in fetch:
+        entry = entry if isinstance(entry, dict) else {'chat_id': entry}
+        chat_id = parse_int(entry.get('chat_id'))
+        if not chat_id:
+            return error('Each fetch entry requires chat_id')
+        if chat_id not in fetch_chat_ids:
+            fetch_chat_ids.append(chat_id)
+            fetch_after_ids.append(parse_int(entry.get('after_id')) or 0)
+
+    check_attachments(request.cur, user_id, [attachment_id for item in items for attachment_id in item['attachment_ids']])
+
+    # Отправка и выборка идут в одной транзакции: выборка уже видит
+    # только что вставленные сообщения
+    sent = insert_messages(request.cur, user_id, items)
+    chats = fetch_latest_messages(request.cur, user_id, fetch_chat_ids, fetch_after_ids, limit) if fetch_chat_ids else []
+    request.conn.commit()
+
+    results = []
+    for item, message in zip(items, sent):
+        if message is None:
+            results.append({'client_id': item['client_id'], 'error': 'Chat not found'})
+        else:
+            results.append(message)
+
+    return json_response({'success': True, 'sent': results, 'chats': chats})
+
+
+@router.route('POST', 'mark_read')
+def mark_read(request) -> dict:
+    body = request.body
+    user_id = request.user_id
+    chat_id = parse_int(body.get('chat_id'))
+    message_id = parse_int(body.get('message_id'))
+
+    if not chat_id:
+        return error('chat_id required')
+
+    # Без message_id чат читается до последнего сообщения. Курсор только
+    # растёт, а пересчёт read_count касается лишь хвоста после него
+    request.cur.execute("""
+        UPDATE chat_members cm
+        SET last_read_message_id = LEAST(%s, s.last_message_id),
+            read_count = s.message_count - (
+                SELECT COUNT(*) FROM messages m
+                WHERE m.chat_id = cm.chat_id AND m.id > LEAST(%s, s.last_message_id)
+                  AND m.created_at >= messages_time_floor(LEAST(%s, s.last_message_id))
+            )
+        FROM chat_summaries s
+        WHERE s.chat_id = cm.chat_id AND cm.chat_id = %s AND cm.user_id = %s
+          AND COALESCE(cm.last_read_message_id, 0) < LEAST(%s, s.last_message_id)
+    """, (message_id, message_id, message_id, chat_id, user_id, message_id))
+    request.conn.commit()
+
+    return json_response({'success': True})
+
+
+@router.route('POST', 'add_contact')
+def add_contact(request) -> dict:
+    body = request.body
+    user_id = request.user_id
+    username = body.get('username', '').strip().lower()
+
+    if not username:
+        return error('username required')
+
+    request.cur.execute("SELECT id FROM users WHERE username = %s", (username,))
+    contact_user = request.cur.fetchone()
+
+    if not contact_user:
+        return error('Пользователь не найден', 404)
+
+    contact_id = contact_user[0]
+
+    if contact_id == user_id:
+        return error('Нельзя добавить себя в контакты')
+
+    request.cur.execute("""
+        INSERT INTO contacts (user_id, contact_user_id)
+        VALUES (%s, %s)
+        ON CONFLICT DO NOTHING
+    """, (user_id, contact_id))
+    request.conn.commit()
+    cache.invalidate(contacts_key(user_id))
+
+    return json_response({'success': True})
+
+
+@router.route('POST', 'update_profile')
+def update_profile(request) -> dict:
+    body = request.body
+    user_id = request.user_id
+    fields = {}
+    if 'display_name' in body:
+        fields['display_name'] = str(body.get('display_name') or '').strip()
+        if not fields['display_name']:
+            return error('Имя не может быть пустым')
+    if 'avatar_url' in body:
+        fields['avatar_url'] = str(body.get('avatar_url') or '').strip() or None
+    if 'bio' in body:
+        fields['bio'] = str(body.get('bio') or '').strip() or None
+
+    if not fields:
+        return error('display_name, avatar_url or bio required')
+
+    assignments = ', '.join(f'{column} = %({column})s' for column in fields)
+    request.cur.execute(f"""
+        UPDATE users SET {assignments}
+        WHERE id = %(user_id)s
+        RETURNING id, username, display_name, avatar_url, bio
+    """, {**fields, 'user_id': user_id})
+    user = request.cur.fetchone()
+    request.conn.commit()
+    cache.invalidate(profile_key(user_id))
+
+    return json_response({
+        'success': True,
+        'user': {
+            'id': user[0],
+            'username': user[1],
+            'display_name': user[2],
+            'avatar_url': user[3],
+            'bio': user[4]
+        }
+    })
+
+
+@router.route('POST', 'create_chat')
+def create_chat(request) -> dict:
+    body = request.body
+    user_id = request.user_id
+    contact_id = parse_int(body.get('contact_id'))
+
+    if not contact_id:
+        return error('contact_id required')
+
+    if contact_id == user_id:
+        return error('Cannot create a chat with yourself')
+
+    pair = {'low': min(user_id, contact_id), 'high': max(user_id, contact_id)}
+
+    # Открытие существующего чата — одна проба по первичному ключу пары
+    request.cur.execute(
+        "SELECT chat_id FROM direct_chats WHERE user_low = %(low)s AND user_high = %(high)s",
+        pair
+    )
+    existing_chat = request.cur.fetchone()
+
+    if existing_chat:
+        return json_response({'success': True, 'chat_id': existing_chat[0]})
+
+    # Пара занимается до создания чата: параллельный вызов ждёт на уникальном
+    # ключе и после коммита получает тот же chat_id
+    request.cur.execute("""
+        INSERT INTO direct_chats (user_low, user_high, chat_id)
+        SELECT %(low)s, %(high)s, nextval(pg_get_serial_sequence('chats', 'id'))
+        WHERE EXISTS (SELECT 1 FROM users WHERE id = %(contact_id)s)
+        ON CONFLICT (user_low, user_high) DO NOTHING
+        RETURNING chat_id
+    """, {**pair, 'contact_id': contact_id})
+    created = request.cur.fetchone()
+
+    if created:
+        chat_id = created[0]
+        request.cur.execute("INSERT INTO chats (id) VALUES (%s)", (chat_id,))
+        request.cur.execute("""
+            INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s), (%s, %s)
+        """, (chat_id, user_id, chat_id, contact_id))
+    else:
+        request.cur.execute(
+            "SELECT chat_id FROM direct_chats WHERE user_low = %(low)s AND user_high = %(high)s",
+            pair
+        )
+        existing_chat = request.cur.fetchone()
+        if not existing_chat:
+            request.conn.rollback()
+            return error('User not found', 404)
+        chat_id = existing_chat[0]
+
+    request.conn.commit()
+
+    return json_response({'success': True, 'chat_id': chat_id})
+
+
+@router.route('POST', 'create_group')
+def create_group(request) -> dict:
+    body = request.body
+    user_id = request.user_id
+    title = str(body.get('title') or '').strip()
+    member_ids = parse_user_ids(body.get('member_ids', []))
+
+    if not title or len(title) > 100:
+        return error('title required (up to 100 characters)')
+    if member_ids is None:
+        return error(f'member_ids must be a list of up to {MAX_MEMBERS_PER_REQUEST} user ids')
+
+    request.cur.execute("""
+        INSERT INTO chats (is_group, title, avatar_url, created_by)
+        VALUES (TRUE, %s, %s, %s)
+        RETURNING id
+    """, (title, str(body.get('avatar_url') or '').strip() or None, user_id))
+    chat_id = request.cur.fetchone()[0]
+
+    request.cur.execute("""
+        INSERT INTO chat_members (chat_id, user_id, role) VALUES (%s, %s, 'owner')
+    """, (chat_id, user_id))
+    added = add_group_members(request.cur, chat_id, [member_id for member_id in member_ids if member_id != user_id])
+    request.conn.commit()
+
+    return json_response({'success': True, 'chat_id': chat_id, 'added': added})
+
+
+@router.route('POST', 'update_group')
+def update_group(request) -> dict:
+    body = request.body
+    user_id = request.user_id
+    chat_id = parse_int(body.get('chat_id'))
+
+    if not chat_id:
+        return error('chat_id required')
+
+    fields = {}
+    if 'title' in body:
+        fields['title'] = str(body.get('title') or '').strip()
+        if not fields['title'] or len(fields['title']) > 100:
+            return error('title required (up to 100 characters)')
+    if 'avatar_url' in body:
+        fields['avatar_url'] = str(body.get('avatar_url') or '').strip() or None
+
+    if not fields:
+        return error('title or avatar_url required')
+
+    group_role(request.cur, chat_id, user_id, ('owner', 'admin'))
+    assignments = ', '.join(f'{column} = %({column})s' for column in fields)
+    request.cur.execute(f"UPDATE chats SET {assignments} WHERE id = %(chat_id)s", {**fields, 'chat_id': chat_id})
+    request.conn.commit()
+
+    return json_response({'success': True})
+
+
+@router.route('POST', 'add_members')
+def add_members(request) -> dict:
+    body = request.body
+    user_id = request.user_id
+    chat_id = parse_int(body.get('chat_id'))
+    member_ids = parse_user_ids(body.get('user_ids'))
+
+    if not chat_id or not member_ids:
+        return error(f'chat_id and user_ids (up to {MAX_MEMBERS_PER_REQUEST}) required')
+
+    group_role(request.cur, chat_id, user_id, ('owner', 'admin'))
+    added = add_group_members(request.cur, chat_id, member_ids)
+    request.conn.commit()
+
+    return json_response({'success': True, 'added': added})
+
+
+@router.route('POST', 'remove_member')
+def remove_member(request) -> dict:
+    body = request.body
+    user_id = request.user_id
+    chat_id = parse_int(body.get('chat_id'))
+    member_id = parse_int(body.get('user_id')) or user_id
+
+    if not chat_id:
+        return error('chat_id required')
+
+    # Выйти может любой участник, кроме владельца; исключать — владелец и админы,
+    # причём админа исключает только владелец
+    role = group_role(request.cur, chat_id, user_id)
+    if member_id == user_id:
+        if role == 'owner':
+            return error('The owner cannot leave the group')
+    else:
+        request.cur.execute(
+            "SELECT role FROM chat_members WHERE chat_id = %s AND user_id = %s",
+            (chat_id, member_id)
+        )
+        target = request.cur.fetchone()
+        if not target:
+            return error('Member not found', 404)
+        if role == 'member' or target[0] == 'owner' or (target[0] == 'admin' and role != 'owner'):
+            return error('Forbidden', 403)
+
+    request.cur.execute("DELETE FROM chat_members WHERE chat_id = %s AND user_id = %s", (chat_id, member_id))
+    request.conn.commit()
+
+    return json_response({'success': True})
+
+
+@router.route('POST', 'set_member_role')
+def set_member_role(request) -> dict:
+    body = request.body
+    user_id = request.user_id
+    chat_id = parse_int(body.get('chat_id'))
+    member_id = parse_int(body.get('user_id'))
+    role = body.get('role')
+
+    if not chat_id or not member_id or role not in ('admin', 'member'):
+        return error("chat_id, user_id and role ('admin' or 'member') required")
+    if member_id == user_id:
+        return error('The owner role cannot be changed')
+
+    group_role(request.cur, chat_id, user_id, ('owner',))
+    request.cur.execute(
+        "UPDATE chat_members SET role = %s WHERE chat_id = %s AND user_id = %s",
+        (role, chat_id, member_id)
+    )
+    if not request.cur.rowcount:
+        return error('Member not found', 404)
+    request.conn.commit()
+
+    return json_response({'success': True})
+
+
+@router.before_async
+async def authenticate_async(request):
+    """Асинхронный аналог authenticate"""
+    auth_header = request.header('Authorization')
+    token = auth_header.replace('Bearer ', '').strip() if auth_header else ''
+    claims = verify_token(token)
+    if not claims:
+        raise HttpError('Unauthorized', 401)
+
+    request.claims = claims
+    request.user_id = claims['sub']
+    presence.heartbeat(request.user_id)
+
+    if revocations.is_stale():
+        import async_db
+        rows = await async_db.fetch(REVOKED_JTIS_QUERY, (int(time.time()),))
+        revocations.replace({row[0] for row in rows})
+    if claims['jti'] in revocations:
+        raise HttpError('Unauthorized', 401)
+
+
+@router.teardown_async
+async def flush_presence_async(request):
+    import async_db
+    await async_db.flush_presence()
+
+
+@router.route_async('GET', 'chats')
+async def chats_async(request) -> dict:
+    import async_db
+    user_id = request.user_id
+    # Без If-None-Match версия считается по строкам списка, отдельный запрос не нужен
+    if request.header('If-None-Match'):
+        version = await async_db.fetchrow(CHATS_VERSION_QUERY, (user_id,))
+        etag = make_etag('chats', user_id, *version, presence_bucket())
+        if request.not_modified(etag):
+            return not_modified(etag)
+
+    rows = await async_db.fetch(CHATS_QUERY, (MEMBER_PREVIEW_SIZE, user_id, None, None))
+    etag = make_etag('chats', user_id, *chats_version_from_rows(rows), presence_bucket())
+    chats = build_chats(rows, await load_profiles_async(chat_member_ids(rows)))
+
+    return json_response({'chats': chats}, headers=etag_headers(etag))
+
+
+@router.route_async('GET', 'contacts')
+async def contacts_async(request) -> dict:
+    import asyncio
+    import async_db
+    user_id = request.user_id
+    contact_ids = cache.get(contacts_key(user_id))
+    if contact_ids is None:
+        load = async_db.fetch(CONTACTS_QUERY, (user_id,))
+    else:
+        load = load_profiles_async(contact_ids)
+
+    # С If-None-Match сначала сверяется версия: при совпадении список не нужен.
+    # Без него версия и список читаются параллельно
+    if request.header('If-None-Match'):
+        version = await async_db.fetchrow(CONTACTS_VERSION_QUERY, (user_id,))
+        etag = make_etag('contacts', user_id, *version, presence_bucket())
+        if request.not_modified(etag):
+            load.close()
+            return not_modified(etag)
+        result = await load
+    else:
+        version, result = await asyncio.gather(async_db.fetchrow(CONTACTS_VERSION_QUERY, (user_id,)), load)
+        etag = make_etag('contacts', user_id, *version, presence_bucket())
+
+    if contact_ids is None:
+        profiles, contact_ids = store_contacts(user_id, result)
+    else:
+        profiles = result
+
+    return json_response({'contacts': build_contacts(contact_ids, profiles)}, headers=etag_headers(etag))
+
+
+@router.route_async('GET', 'search')
+async def search_async(request) -> dict:
+    import asyncio
+    import async_db
+    search_params = parse_search(request)
+    if search_params is None:
+        return json_response({'users': [], 'next_cursor': None})
+
+    # Префиксные совпадения и остальные ищутся параллельно на разных соединениях;
+    # первые в выдаче всегда выше, поэтому страница — их конкатенация
+    parts = []
+    if search_params['cursor_prefix'] != 0:
+        parts.append(SEARCH_QUERY.format(condition=SEARCH_PREFIX_CONDITION))
+    if search_params['match'] != search_params['prefix']:
+        parts.append(SEARCH_QUERY.format(condition='NOT ' + SEARCH_PREFIX_CONDITION))
+
+    results = await asyncio.gather(*(async_db.fetch(sql, search_params) for sql in parts))
+    rows = [row for part in results for row in part][:search_params['limit']]
+    return json_response(search_page(rows, search_params['limit'] - 1))
+
+
+@router.route('POST', 'upload_start')
+def upload_start(request) -> dict:
+    storage = attachment_storage()
+    body = request.body
+    user_id = request.user_id
+    filename = os.path.basename(str(body.get('filename') or '').replace('\\', '/')).strip()[:255]
+    content_type = parse_content_type(body.get('content_type'))
+    size = parse_int(body.get('size'))
+    sha256 = str(body.get('sha256') or '').lower() or None
+
+    if not filename or not size or size <= 0:
+        return error('filename and size required')
+
+    if size > MAX_ATTACHMENT_SIZE:
+        return error(f'Attachments are limited to {MAX_ATTACHMENT_SIZE} bytes', 413)
+
+    if sha256 and not re.match(r'^[0-9a-f]{64}$', sha256):
+        return error('sha256 must be a hex digest')
+
+    # Загрузка без передачи данных — только для содержимого, которое пользователь
+    # уже загружал сам: иначе по хешу можно было бы получить чужой файл
+    if sha256:
+        request.cur.execute("""
+            SELECT 1 FROM attachments WHERE sha256 = %s AND uploaded_by = %s LIMIT 1
+        """, (sha256, user_id))
+        if request.cur.fetchone():
+            attachment = create_attachment(request.cur, user_id, sha256, filename)
+            request.conn.commit()
+            return json_response({'complete': True, 'attachment': attachment})
+
+    # Брошенные загрузки пользователя убираются при следующей
+    request.cur.execute("""
+        DELETE FROM uploads
+        WHERE user_id = %s AND created_at < LOCALTIMESTAMP - %s * INTERVAL '1 second'
+        RETURNING storage_key
+    """, (user_id, UPLOAD_TTL))
+    stale_keys = [row[0] for row in request.cur.fetchall()]
+
+    upload_id = str(uuid.uuid4())
+    request.cur.execute("""
+        INSERT INTO uploads (id, user_id, filename, content_type, size, sha256, storage_key)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """, (upload_id, user_id, filename, content_type, size, sha256, f'uploads/{upload_id}'))
+    request.conn.commit()
+
+    for key in stale_keys:
+        storage.delete(key)
+
+    return json_response({
+        'complete': False,
+        'upload_id': upload_id,
+        'received': 0,
+        'chunk_size': UPLOAD_CHUNK_SIZE
+    })
+
+
+@router.route('GET', 'upload_status')
+def upload_status(request) -> dict:
+    upload_id = parse_client_id(request.params.get('upload_id'))
+    if not upload_id:
+        return error('upload_id required')
+
+    request.cur.execute("SELECT size, received FROM uploads WHERE id = %s AND user_id = %s", (upload_id, request.user_id))
+    row = request.cur.fetchone()
+    if not row:
+        return error('Upload not found', 404)
+
+    return json_response({'upload_id': upload_id, 'size': row[0], 'received': row[1], 'chunk_size': UPLOAD_CHUNK_SIZE})
+
+
+@router.route('POST', 'upload_chunk')
+def upload_chunk(request) -> dict:
+    """Кусок файла в теле запроса; upload_id и offset — в строке запроса"""
+    storage = attachment_storage()
+    params = request.params
+    upload_id = parse_client_id(params.get('upload_id'))
+    offset = parse_int(params.get('offset'))
+
+    if not upload_id or offset is None:
+        return error('upload_id and offset required')
+
+    data = request.raw_body
+    if not data:
+        return error('Empty chunk')
+    if len(data) > MAX_UPLOAD_CHUNK:
+        return error(f'Chunks are limited to {MAX_UPLOAD_CHUNK} bytes', 413)
+
+    # Блокировка строки упорядочивает повторы одного куска
+    request.cur.execute("""
+        SELECT size, received, filename, content_type, sha256, storage_key
+        FROM uploads
+        WHERE id = %s AND user_id = %s
+        FOR UPDATE
+    """, (upload_id, request.user_id))
+    row = request.cur.fetchone()
+    if not row:
+        return error('Upload not found', 404)
+    size, received = row[0], row[1]
+
+    # Куски пишутся строго по порядку; после обрыва клиент продолжает с received
+    if offset != received:
+        return json_response({'error': 'Unexpected offset', 'received': received}, 409)
+    if offset + len(data) > size:
+        return error('Chunk exceeds declared size')
+
+    storage.write_at(row[5], offset, data)
+    received += len(data)
+    request.cur.execute("UPDATE uploads SET received = %s WHERE id = %s", (received, upload_id))
+
+    if received < size:
+        request.conn.commit()
+        return json_response({'complete': False, 'upload_id': upload_id, 'received': received})
+
+    attachment = complete_upload(request, upload_id, (size, row[2], row[3], row[4], row[5]))
+    request.conn.commit()
+
+    return json_response({'complete': True, 'upload_id': upload_id, 'received': received, 'attachment': attachment})
+
+
+@router.route('GET', 'download')
+def download(request) -> dict:
+    """Содержимое вложения или его превью; отдаётся частями не больше DOWNLOAD_CHUNK_SIZE"""
+    storage = attachment_storage()
+    user_id = request.user_id
+    attachment_id = parse_int(request.params.get('id'))
+    want_thumbnail = request.params.get('thumbnail') == '1'
+
+    if not attachment_id:
+        return error('id required')
+
+    # Файл доступен загрузившему и участникам чатов, где он отправлен
+    request.cur.execute("""
+        SELECT b.sha256, b.storage_key, b.size, b.content_type, b.thumbnail_key, a.filename
+        FROM attachments a
+        JOIN blobs b ON b.sha256 = a.sha256
+        WHERE a.id = %s AND (
+            a.uploaded_by = %s OR EXISTS (
+                SELECT 1 FROM message_attachments ma
+                JOIN chat_members cm ON cm.chat_id = ma.chat_id AND cm.user_id = %s
+                WHERE ma.attachment_id = a.id
+            )
+        )
+    """, (attachment_id, user_id, user_id))
+    row = request.cur.fetchone()
+    if not row:
+        return error('Attachment not found', 404)
+    sha256, key, size, content_type, thumbnail_key, filename = row
+
+    if want_thumbnail:
+        if not thumbnail_key:
+            return error('Thumbnail not found', 404)
+        key, content_type = thumbnail_key, 'image/jpeg'
+        size = storage.size(key) or 0
+        sha256 += '-thumbnail'
+
+    # Содержимое по хешу не меняется, поэтому ETag сильный и кешируется надолго
+    etag = f'"{sha256}"'
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag, Content-Range, Accept-Ranges, Content-Disposition',
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, max-age=31536000, immutable',
+        'X-Content-Type-Options': 'nosniff',
+        'ETag': etag
+    }
+    if request.not_modified(etag):
+        return {'statusCode': 304, 'headers': headers, 'body': ''}
+
+    try:
+        byte_range = parse_range(request.header('Range'), size)
+    except ValueError:
+        return {'statusCode': 416, 'headers': {**headers, 'Content-Range': f'bytes */{size}'}, 'body': ''}
+
+    # Ответ функции буферизуется целиком, поэтому без Range большой файл
+    # тоже отдаётся первой частью, а клиент догружает остальное по Content-Range
+    start, end = byte_range or (0, size - 1)
+    end = min(end, start + DOWNLOAD_CHUNK_SIZE - 1)
+    data = b''.join(storage.read_range(key, start, end - start + 1))
+    status = 206 if (start, end) != (0, size - 1) else 200
+
+    # Content-Type задаёт загрузивший, поэтому встраивается только растровая
+    # картинка: HTML или SVG, открытые inline, выполнились бы в нашем origin
+    disposition = 'inline' if content_type in INLINE_CONTENT_TYPES else 'attachment'
+    headers['Content-Type'] = content_type
+    headers['Content-Disposition'] = f"{disposition}; filename*=UTF-8''{quote(filename)}"
+    if status == 206:
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    return {
+        'statusCode': status,
+        'headers': headers,
+        'body': base64.b64encode(data).decode(),
+        'isBase64Encoded': True
+    }
+
+
+def handler(event: dict, context) -> dict:
+    """API для работы с сообщениями, чатами и контактами"""
+    return router.dispatch(event, context)
+
+
+async def async_handler(event: dict, context) -> dict:
+    """Асинхронная точка входа: списки и поиск читаются через asyncpg, остальное — в пуле потоков.
+    
+    asyncio и async_db импортируются в асинхронных обработчиках, чтобы не
+    удлинять холодный старт синхронного handler().
+    """
+    return await router.dispatch_async(event, context)
+
+
+async def async_shutdown():
+    """Запись накопленных отметок присутствия перед остановкой процесса"""
+    import async_db
+    await async_db.flush_presence(force=True)
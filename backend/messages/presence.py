@@ -0,0 +1,107 @@
+"""Присутствие пользователей с отложенной записью last_seen.
+
+Отметки активности копятся в памяти процесса и пишутся в users одним
+многострочным UPDATE не чаще раза в PRESENCE_FLUSH_INTERVAL секунд.
+Пользователь, которого процесс ещё не записывал в пределах окна «в сети»,
+сбрасывается сразу, чтобы другие увидели его онлайн без задержки.
+"""
+import os
+import threading
+import time
+
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get('PRESENCE_FLUSH_INTERVAL', '30'))
+ONLINE_WINDOW = 300
+
+
+class PresenceTracker:
+    """Буфер отметок активности и источник флага «в сети»"""
+
+    def __init__(self, flush_interval: float = PRESENCE_FLUSH_INTERVAL, online_window: float = ONLINE_WINDOW):
+        self.flush_interval = flush_interval
+        self.online_window = online_window
+        self._pending = {}
+        self._flushed = {}
+        self._urgent = False
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def heartbeat(self, user_id: int):
+        """Отметка активности пользователя, без обращения к базе"""
+        now = time.time()
+        with self._lock:
+            self._pending[user_id] = now
+            if now - self._flushed.get(user_id, 0) > self.online_window - self.flush_interval:
+                self._urgent = True
+
+    def is_online(self, user_id: int, last_seen_age: float = None) -> bool:
+        """Онлайн по last_seen из базы (возраст в секундах) или по отметкам этого процесса"""
+        ages = [] if last_seen_age is None else [float(last_seen_age)]
+        now = time.time()
+        with self._lock:
+            for seen in (self._pending.get(user_id), self._flushed.get(user_id)):
+                if seen is not None:
+                    ages.append(now - seen)
+        return bool(ages) and min(ages) < self.online_window
+
+    def flush(self, conn, force: bool = False) -> int:
+        """Запись накопленных отметок одним UPDATE, если подошёл срок; возвращает число строк"""
+        pending = self.take_due(force)
+        if not pending:
+            return 0
+
+        # psycopg2 импортируется только когда есть что писать: холодный старт
+        # функции и ответы без базы обходятся без него
+        import psycopg2
+        import psycopg2.extensions
+        from psycopg2.extras import execute_values
+
+        now = time.time()
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            cur = conn.cursor()
+            # Время считается на стороне базы от LOCALTIMESTAMP, как и CURRENT_TIMESTAMP
+            # при вставке, поэтому часовой пояс сессии не влияет на last_seen
+            execute_values(cur, """
+                UPDATE users u SET last_seen = LOCALTIMESTAMP - v.age * INTERVAL '1 second'
+                FROM (VALUES %s) AS v(id, age)
+                WHERE u.id = v.id AND u.last_seen < LOCALTIMESTAMP - v.age * INTERVAL '1 second'
+            """, [(user_id, now - seen) for user_id, seen in pending.items()], template='(%s, %s::float8)')
+            cur.close()
+            conn.commit()
+        except psycopg2.Error:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+            self.restore(pending)
+            return 0
+
+        self.mark_flushed(pending, now)
+        return len(pending)
+
+    def take_due(self, force: bool = False) -> dict:
+        """Отметки к записи {user_id: время}, если подошёл срок; иначе пустой словарь"""
+        with self._lock:
+            due = force or self._urgent or time.monotonic() - self._last_flush >= self.flush_interval
+            if not due or not self._pending:
+                return {}
+            pending, self._pending = self._pending, {}
+            self._urgent = False
+            self._last_flush = time.monotonic()
+        return pending
+
+    def restore(self, pending: dict):
+        """Возврат отметок в буфер после неудачной записи"""
+        with self._lock:
+            for user_id, seen in pending.items():
+                self._pending[user_id] = max(seen, self._pending.get(user_id, 0))
+
+    def mark_flushed(self, pending: dict, now: float):
+        with self._lock:
+            for user_id, seen in pending.items():
+                self._flushed[user_id] = max(seen, self._flushed.get(user_id, 0))
+            cutoff = now - self.online_window
+            self._flushed = {user_id: seen for user_id, seen in self._flushed.items() if seen > cutoff}
+
+presence = PresenceTracker()
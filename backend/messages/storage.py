@@ -0,0 +1,118 @@
+"""Хранилище содержимого вложений.
+
+Хранилищем может быть любой объект с интерфейсом LocalStorage: write_at
+(запись куска загрузки по смещению), put, read_range (чтение диапазона
+блоками), open, size, exists, move и delete. Ключи — относительные пути
+вида blobs/ab/<sha256>; их строит только сервер.
+
+Хранилище создаётся по STORAGE_URL при первом обращении get_storage(): без
+него функция работает, отказывают только действия с вложениями. Сейчас
+поддерживается только file:///path — каталог локальной файловой системы.
+Куски одной загрузки пишутся по смещению в один файл, поэтому такой каталог
+годится только для разработки и одного экземпляра функции (или каталога,
+общего для всех экземпляров): куски, принятые разными экземплярами, иначе
+окажутся в разных файлах. Для нескольких экземпляров нужен общий объектный
+backend, который подключается в create_storage.
+"""
+import os
+import re
+import threading
+
+STORAGE_READ_BLOCK = 256 * 1024
+
+_KEY = re.compile(r'^[\w-]+(?:/[\w.-]+)*$')
+
+
+class LocalStorage:
+    """Файлы в каталоге root; кусок загрузки пишется сразу на место по смещению"""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def path(self, key: str) -> str:
+        if not _KEY.match(key) or '..' in key:
+            raise ValueError(f'Invalid storage key: {key}')
+        return os.path.join(self.root, *key.split('/'))
+
+    def write_at(self, key: str, offset: int, data: bytes):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, data, offset)
+        finally:
+            os.close(fd)
+
+    def put(self, key: str, data: bytes):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def read_range(self, key: str, start: int = 0, length: int = None, block_size: int = STORAGE_READ_BLOCK):
+        """Блоки не больше block_size из диапазона [start, start + length)"""
+        with open(self.path(key), 'rb') as f:
+            f.seek(start)
+            remaining = length
+            while remaining is None or remaining > 0:
+                block = f.read(block_size if remaining is None else min(block_size, remaining))
+                if not block:
+                    return
+                if remaining is not None:
+                    remaining -= len(block)
+                yield block
+
+    def open(self, key: str):
+        """Файловый объект для чтения с seek, например для Pillow"""
+        return open(self.path(key), 'rb')
+
+    def size(self, key: str) -> int:
+        try:
+            return os.path.getsize(self.path(key))
+        except FileNotFoundError:
+            return None
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def move(self, src: str, dst: str):
+        dst_path = self.path(dst)
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        os.replace(self.path(src), dst_path)
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+class StorageNotConfigured(RuntimeError):
+    """STORAGE_URL не задан"""
+
+
+def create_storage(url: str):
+    """Хранилище по STORAGE_URL"""
+    if not url:
+        # Временный каталог функции теряется при перезапуске вместе с файлами,
+        # поэтому молча на него не переключаемся
+        raise StorageNotConfigured('STORAGE_URL is not set, e.g. file:///var/lib/messenger/storage')
+    if url.startswith('file://'):
+        return LocalStorage(url[len('file://'):])
+    raise ValueError(f'Unsupported STORAGE_URL: {url}')
+
+
+_storage = None
+_lock = threading.Lock()
+
+
+def get_storage():
+    """Хранилище процесса; StorageNotConfigured, если STORAGE_URL не задан"""
+    global _storage
+    if _storage is None:
+        with _lock:
+            if _storage is None:
+                _storage = create_storage(os.environ.get('STORAGE_URL'))
+    return _storage
@@ -0,0 +1,5 @@
+-- Составной индекс для постраничной загрузки истории чата по курсору (chat_id, id)
+CREATE INDEX IF NOT EXISTS idx_messages_chat_id_id ON messages(chat_id, id);
+
+-- Одиночный индекс по chat_id покрывается составным
+DROP INDEX IF EXISTS idx_messages_chat_id;
@@ -0,0 +1,12 @@
+-- Уведомление слушателей канала chat_<id> о новом сообщении после коммита
+CREATE OR REPLACE FUNCTION notify_new_message() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('chat_' || NEW.chat_id, NEW.id::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_messages_notify ON messages;
+CREATE TRIGGER trg_messages_notify
+    AFTER INSERT ON messages
+    FOR EACH ROW EXECUTE FUNCTION notify_new_message();
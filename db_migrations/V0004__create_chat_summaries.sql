@@ -0,0 +1,57 @@
+-- Сводка по чату: последнее сообщение и общее число сообщений
+CREATE TABLE IF NOT EXISTS chat_summaries (
+    chat_id INTEGER PRIMARY KEY REFERENCES chats(id),
+    last_message_id INTEGER,
+    last_message_text TEXT,
+    last_message_at TIMESTAMP,
+    last_sender_id INTEGER,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+
+-- Сколько сообщений чата участник уже прочитал; непрочитанные = message_count - read_count
+ALTER TABLE chat_members ADD COLUMN IF NOT EXISTS read_count INTEGER NOT NULL DEFAULT 0;
+
+-- Сводка обновляется в той же транзакции, что и вставка сообщения
+CREATE OR REPLACE FUNCTION update_chat_summary() RETURNS trigger AS $$
+DECLARE
+    new_count INTEGER;
+BEGIN
+    INSERT INTO chat_summaries AS s (chat_id, last_message_id, last_message_text, last_message_at, last_sender_id, message_count)
+    VALUES (NEW.chat_id, NEW.id, NEW.text, NEW.created_at, NEW.sender_id, 1)
+    ON CONFLICT (chat_id) DO UPDATE SET
+        last_message_id = GREATEST(s.last_message_id, EXCLUDED.last_message_id),
+        last_message_text = CASE WHEN EXCLUDED.last_message_id > s.last_message_id THEN EXCLUDED.last_message_text ELSE s.last_message_text END,
+        last_message_at = CASE WHEN EXCLUDED.last_message_id > s.last_message_id THEN EXCLUDED.last_message_at ELSE s.last_message_at END,
+        last_sender_id = CASE WHEN EXCLUDED.last_message_id > s.last_message_id THEN EXCLUDED.last_sender_id ELSE s.last_sender_id END,
+        message_count = s.message_count + 1
+    RETURNING message_count INTO new_count;
+
+    -- Отправитель видел всё, что было в чате на момент отправки
+    UPDATE chat_members SET read_count = new_count
+    WHERE chat_id = NEW.chat_id AND user_id = NEW.sender_id;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_messages_chat_summary ON messages;
+CREATE TRIGGER trg_messages_chat_summary
+    AFTER INSERT ON messages
+    FOR EACH ROW EXECUTE FUNCTION update_chat_summary();
+
+-- Заполнение сводок для существующих сообщений
+INSERT INTO chat_summaries (chat_id, last_message_id, last_message_text, last_message_at, last_sender_id, message_count)
+SELECT DISTINCT ON (chat_id) chat_id, id, text, created_at, sender_id, COUNT(*) OVER (PARTITION BY chat_id)
+FROM messages
+ORDER BY chat_id, id DESC
+ON CONFLICT (chat_id) DO NOTHING;
+
+-- Непрочитанными остаются чужие сообщения после last_seen участника, как и раньше
+UPDATE chat_members cm
+SET read_count = s.message_count - (
+    SELECT COUNT(*) FROM messages m
+    JOIN users u ON u.id = cm.user_id
+    WHERE m.chat_id = cm.chat_id AND m.sender_id != cm.user_id AND m.created_at > u.last_seen
+)
+FROM chat_summaries s
+WHERE s.chat_id = cm.chat_id;
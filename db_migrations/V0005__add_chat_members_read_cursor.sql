@@ -0,0 +1,36 @@
+-- Курсор прочтения участника: id последнего прочитанного сообщения
+ALTER TABLE chat_members ADD COLUMN IF NOT EXISTS last_read_message_id INTEGER;
+
+UPDATE chat_members cm
+SET last_read_message_id = (
+    SELECT m.id FROM messages m
+    WHERE m.chat_id = cm.chat_id
+    ORDER BY m.id
+    OFFSET cm.read_count - 1
+    LIMIT 1
+)
+WHERE cm.read_count > 0;
+
+-- Отправитель сдвигает свой курсор прочтения на собственное сообщение
+CREATE OR REPLACE FUNCTION update_chat_summary() RETURNS trigger AS $$
+DECLARE
+    new_count INTEGER;
+BEGIN
+    INSERT INTO chat_summaries AS s (chat_id, last_message_id, last_message_text, last_message_at, last_sender_id, message_count)
+    VALUES (NEW.chat_id, NEW.id, NEW.text, NEW.created_at, NEW.sender_id, 1)
+    ON CONFLICT (chat_id) DO UPDATE SET
+        last_message_id = GREATEST(s.last_message_id, EXCLUDED.last_message_id),
+        last_message_text = CASE WHEN EXCLUDED.last_message_id > s.last_message_id THEN EXCLUDED.last_message_text ELSE s.last_message_text END,
+        last_message_at = CASE WHEN EXCLUDED.last_message_id > s.last_message_id THEN EXCLUDED.last_message_at ELSE s.last_message_at END,
+        last_sender_id = CASE WHEN EXCLUDED.last_message_id > s.last_message_id THEN EXCLUDED.last_sender_id ELSE s.last_sender_id END,
+        message_count = s.message_count + 1
+    RETURNING message_count INTO new_count;
+
+    UPDATE chat_members
+    SET read_count = new_count,
+        last_read_message_id = GREATEST(last_read_message_id, NEW.id)
+    WHERE chat_id = NEW.chat_id AND user_id = NEW.sender_id;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
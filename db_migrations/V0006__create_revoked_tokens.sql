@@ -0,0 +1,9 @@
+-- Отозванные токены (выход, ротация refresh-токенов); хранятся до истечения срока
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    jti VARCHAR(64) PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id),
+    expires_at BIGINT NOT NULL,
+    revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires_at ON revoked_tokens(expires_at);
@@ -0,0 +1,7 @@
+-- Поиск пользователей без учёта регистра: триграммы для подстрок, text_pattern_ops для префиксов
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_users_username_trgm ON users USING GIN (lower(username) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_users_display_name_trgm ON users USING GIN (lower(display_name) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_users_username_prefix ON users (lower(username) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_users_display_name_prefix ON users (lower(display_name) text_pattern_ops);
@@ -0,0 +1,7 @@
+-- Полнотекстовый поиск по сообщениям: русская и английская морфология в одном векторе
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('russian'::regconfig, text) || to_tsvector('english'::regconfig, text)
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_messages_search_vector ON messages USING GIN (search_vector);
@@ -0,0 +1,4 @@
+-- Клиентский идентификатор сообщения для идемпотентной отправки
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS client_id UUID;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_sender_client_id ON messages(sender_id, client_id);
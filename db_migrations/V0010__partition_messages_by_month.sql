@@ -0,0 +1,99 @@
+-- Секционирование сообщений по месяцам created_at
+
+-- Партиция на месяц, начинающийся с month_start
+CREATE OR REPLACE FUNCTION create_messages_partition(month_start DATE) RETURNS BOOLEAN AS $$
+DECLARE
+    partition_name TEXT := 'messages_' || to_char(month_start, 'YYYY_MM');
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+    EXECUTE format(
+        'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+        partition_name, month_start, (month_start + INTERVAL '1 month')::date
+    );
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Партиции на текущий и months_ahead следующих месяцев; возвращает число созданных
+CREATE OR REPLACE FUNCTION ensure_messages_partitions(months_ahead INTEGER DEFAULT 2) RETURNS INTEGER AS $$
+DECLARE
+    created INTEGER := 0;
+BEGIN
+    FOR i IN 0..months_ahead LOOP
+        IF create_messages_partition((date_trunc('month', LOCALTIMESTAMP) + make_interval(months => i))::date) THEN
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Старая таблица удаляется в конце, последовательность id переходит к новой
+ALTER SEQUENCE messages_id_seq OWNED BY NONE;
+ALTER TABLE messages RENAME TO messages_unpartitioned;
+
+CREATE TABLE messages (
+    id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+    chat_id INTEGER REFERENCES chats(id),
+    sender_id INTEGER REFERENCES users(id),
+    text TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    client_id UUID,
+    search_vector tsvector GENERATED ALWAYS AS (
+        to_tsvector('russian'::regconfig, text) || to_tsvector('english'::regconfig, text)
+    ) STORED
+) PARTITION BY RANGE (created_at);
+
+-- Страховка на случай, если партиция месяца не создана заранее
+CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+
+DO $$
+DECLARE
+    month_start DATE;
+BEGIN
+    SELECT date_trunc('month', MIN(created_at))::date INTO month_start FROM messages_unpartitioned;
+    WHILE month_start IS NOT NULL AND month_start < date_trunc('month', LOCALTIMESTAMP) LOOP
+        PERFORM create_messages_partition(month_start);
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+    PERFORM ensure_messages_partitions(2);
+END;
+$$;
+
+INSERT INTO messages (id, chat_id, sender_id, text, created_at, client_id)
+SELECT id, chat_id, sender_id, text, COALESCE(created_at, CURRENT_TIMESTAMP), client_id
+FROM messages_unpartitioned;
+
+-- Уникальность client_id на секционированной таблице потребовала бы created_at в ключе,
+-- поэтому ключи идемпотентности занимаются в отдельной таблице
+CREATE TABLE IF NOT EXISTS message_client_ids (
+    sender_id INTEGER NOT NULL,
+    client_id UUID NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sender_id, client_id)
+);
+
+INSERT INTO message_client_ids (sender_id, client_id, created_at)
+SELECT sender_id, client_id, COALESCE(created_at, CURRENT_TIMESTAMP)
+FROM messages_unpartitioned
+WHERE client_id IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+DROP TABLE messages_unpartitioned;
+ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+
+ALTER TABLE messages ADD PRIMARY KEY (id, created_at);
+CREATE INDEX IF NOT EXISTS idx_messages_chat_id_id ON messages(chat_id, id);
+CREATE INDEX IF NOT EXISTS idx_messages_sender_client_id ON messages(sender_id, client_id);
+CREATE INDEX IF NOT EXISTS idx_messages_search_vector ON messages USING GIN (search_vector);
+
+-- Триггеры создаются после переноса, чтобы перенос не задел сводки и уведомления
+CREATE TRIGGER trg_messages_notify
+    AFTER INSERT ON messages
+    FOR EACH ROW EXECUTE FUNCTION notify_new_message();
+
+CREATE TRIGGER trg_messages_chat_summary
+    AFTER INSERT ON messages
+    FOR EACH ROW EXECUTE FUNCTION update_chat_summary();
@@ -0,0 +1,68 @@
+-- Групповые чаты: название, создатель и роли участников
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS is_group BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS title VARCHAR(100);
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS avatar_url TEXT;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS created_by INTEGER REFERENCES users(id);
+
+ALTER TABLE chat_members ADD COLUMN IF NOT EXISTS role VARCHAR(10) NOT NULL DEFAULT 'member'
+    CHECK (role IN ('owner', 'admin', 'member'));
+
+-- Число участников хранится в сводке, чтобы список чатов не считал их по chat_members
+ALTER TABLE chat_summaries ADD COLUMN IF NOT EXISTS member_count INTEGER NOT NULL DEFAULT 0;
+
+INSERT INTO chat_summaries (chat_id, member_count)
+SELECT chat_id, COUNT(*) FROM chat_members GROUP BY chat_id
+ON CONFLICT (chat_id) DO UPDATE SET member_count = EXCLUDED.member_count;
+
+-- Сводка может появиться раньше первого сообщения (при добавлении участников),
+-- поэтому пустой last_message_id тоже заменяется
+CREATE OR REPLACE FUNCTION update_chat_summary() RETURNS trigger AS $$
+DECLARE
+    new_count INTEGER;
+BEGIN
+    INSERT INTO chat_summaries AS s (chat_id, last_message_id, last_message_text, last_message_at, last_sender_id, message_count)
+    VALUES (NEW.chat_id, NEW.id, NEW.text, NEW.created_at, NEW.sender_id, 1)
+    ON CONFLICT (chat_id) DO UPDATE SET
+        last_message_id = GREATEST(s.last_message_id, EXCLUDED.last_message_id),
+        last_message_text = CASE WHEN EXCLUDED.last_message_id > COALESCE(s.last_message_id, 0) THEN EXCLUDED.last_message_text ELSE s.last_message_text END,
+        last_message_at = CASE WHEN EXCLUDED.last_message_id > COALESCE(s.last_message_id, 0) THEN EXCLUDED.last_message_at ELSE s.last_message_at END,
+        last_sender_id = CASE WHEN EXCLUDED.last_message_id > COALESCE(s.last_message_id, 0) THEN EXCLUDED.last_sender_id ELSE s.last_sender_id END,
+        message_count = s.message_count + 1
+    RETURNING message_count INTO new_count;
+
+    UPDATE chat_members
+    SET read_count = new_count,
+        last_read_message_id = GREATEST(last_read_message_id, NEW.id)
+    WHERE chat_id = NEW.chat_id AND user_id = NEW.sender_id;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Счётчик участников меняется одним UPDATE на чат за оператор, а не на каждую строку
+CREATE OR REPLACE FUNCTION update_chat_member_count() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO chat_summaries AS s (chat_id, member_count)
+        SELECT chat_id, COUNT(*) FROM changed_members GROUP BY chat_id
+        ON CONFLICT (chat_id) DO UPDATE SET member_count = s.member_count + EXCLUDED.member_count;
+    ELSE
+        UPDATE chat_summaries s SET member_count = GREATEST(s.member_count - d.removed, 0)
+        FROM (SELECT chat_id, COUNT(*) AS removed FROM changed_members GROUP BY chat_id) d
+        WHERE s.chat_id = d.chat_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chat_members_count_insert ON chat_members;
+CREATE TRIGGER trg_chat_members_count_insert
+    AFTER INSERT ON chat_members
+    REFERENCING NEW TABLE AS changed_members
+    FOR EACH STATEMENT EXECUTE FUNCTION update_chat_member_count();
+
+DROP TRIGGER IF EXISTS trg_chat_members_count_delete ON chat_members;
+CREATE TRIGGER trg_chat_members_count_delete
+    AFTER DELETE ON chat_members
+    REFERENCING OLD TABLE AS changed_members
+    FOR EACH STATEMENT EXECUTE FUNCTION update_chat_member_count();
@@ -0,0 +1,71 @@
+-- Канонический личный чат для пары пользователей: (user_low, user_high) -> chat_id
+CREATE TABLE IF NOT EXISTS direct_chats (
+    user_low INTEGER NOT NULL REFERENCES users(id),
+    user_high INTEGER NOT NULL REFERENCES users(id),
+    -- Проверка ссылки откладывается до коммита: строка пары вставляется
+    -- первой и сама выделяет id чата
+    chat_id INTEGER NOT NULL UNIQUE REFERENCES chats(id) DEFERRABLE INITIALLY DEFERRED,
+    PRIMARY KEY (user_low, user_high),
+    CHECK (user_low < user_high)
+);
+
+-- Личные чаты, созданные до этой миграции
+CREATE TEMP TABLE direct_pairs AS
+SELECT cm.chat_id, MIN(cm.user_id) AS user_low, MAX(cm.user_id) AS user_high
+FROM chat_members cm
+JOIN chats c ON c.id = cm.chat_id AND NOT c.is_group
+GROUP BY cm.chat_id
+HAVING COUNT(*) = 2;
+
+INSERT INTO direct_chats (user_low, user_high, chat_id)
+SELECT user_low, user_high, MIN(chat_id)
+FROM direct_pairs
+GROUP BY user_low, user_high
+ON CONFLICT DO NOTHING;
+
+-- Дубликаты, созданные гонкой create_chat, сливаются в канонический чат
+CREATE TEMP TABLE duplicate_chats AS
+SELECT p.chat_id, d.chat_id AS canonical_id
+FROM direct_pairs p
+JOIN direct_chats d ON d.user_low = p.user_low AND d.user_high = p.user_high
+WHERE p.chat_id != d.chat_id;
+
+UPDATE chat_members cm
+SET last_read_message_id = GREATEST(cm.last_read_message_id, dup.last_read_message_id)
+FROM (
+    SELECT dc.canonical_id, m.user_id, MAX(m.last_read_message_id) AS last_read_message_id
+    FROM duplicate_chats dc
+    JOIN chat_members m ON m.chat_id = dc.chat_id
+    GROUP BY dc.canonical_id, m.user_id
+) dup
+WHERE cm.chat_id = dup.canonical_id AND cm.user_id = dup.user_id;
+
+UPDATE messages m SET chat_id = dc.canonical_id
+FROM duplicate_chats dc
+WHERE m.chat_id = dc.chat_id;
+
+DELETE FROM chat_members WHERE chat_id IN (SELECT chat_id FROM duplicate_chats);
+DELETE FROM chat_summaries WHERE chat_id IN (SELECT chat_id FROM duplicate_chats);
+DELETE FROM chats WHERE id IN (SELECT chat_id FROM duplicate_chats);
+
+-- Сводки и счётчики прочтения канонических чатов пересчитываются по слитой истории
+INSERT INTO chat_summaries AS s (chat_id, last_message_id, last_message_text, last_message_at, last_sender_id, message_count)
+SELECT DISTINCT ON (chat_id) chat_id, id, text, created_at, sender_id, COUNT(*) OVER (PARTITION BY chat_id)
+FROM messages
+WHERE chat_id IN (SELECT canonical_id FROM duplicate_chats)
+ORDER BY chat_id, id DESC
+ON CONFLICT (chat_id) DO UPDATE SET
+    last_message_id = EXCLUDED.last_message_id,
+    last_message_text = EXCLUDED.last_message_text,
+    last_message_at = EXCLUDED.last_message_at,
+    last_sender_id = EXCLUDED.last_sender_id,
+    message_count = EXCLUDED.message_count;
+
+UPDATE chat_members cm
+SET read_count = (
+    SELECT COUNT(*) FROM messages m
+    WHERE m.chat_id = cm.chat_id AND m.id <= COALESCE(cm.last_read_message_id, 0)
+)
+WHERE cm.chat_id IN (SELECT canonical_id FROM duplicate_chats);
+
+DROP TABLE direct_pairs, duplicate_chats;
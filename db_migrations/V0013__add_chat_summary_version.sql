@@ -0,0 +1,62 @@
+-- Версия чата растёт при любом изменении, видимом в списке чатов:
+-- новое сообщение, состав участников, название или аватар группы
+ALTER TABLE chat_summaries ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+
+UPDATE chat_summaries SET version = message_count + member_count;
+
+CREATE OR REPLACE FUNCTION update_chat_summary() RETURNS trigger AS $$
+DECLARE
+    new_count INTEGER;
+BEGIN
+    INSERT INTO chat_summaries AS s (chat_id, last_message_id, last_message_text, last_message_at, last_sender_id, message_count, version)
+    VALUES (NEW.chat_id, NEW.id, NEW.text, NEW.created_at, NEW.sender_id, 1, 1)
+    ON CONFLICT (chat_id) DO UPDATE SET
+        last_message_id = GREATEST(s.last_message_id, EXCLUDED.last_message_id),
+        last_message_text = CASE WHEN EXCLUDED.last_message_id > COALESCE(s.last_message_id, 0) THEN EXCLUDED.last_message_text ELSE s.last_message_text END,
+        last_message_at = CASE WHEN EXCLUDED.last_message_id > COALESCE(s.last_message_id, 0) THEN EXCLUDED.last_message_at ELSE s.last_message_at END,
+        last_sender_id = CASE WHEN EXCLUDED.last_message_id > COALESCE(s.last_message_id, 0) THEN EXCLUDED.last_sender_id ELSE s.last_sender_id END,
+        message_count = s.message_count + 1,
+        version = s.version + 1
+    RETURNING message_count INTO new_count;
+
+    UPDATE chat_members
+    SET read_count = new_count,
+        last_read_message_id = GREATEST(last_read_message_id, NEW.id)
+    WHERE chat_id = NEW.chat_id AND user_id = NEW.sender_id;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION update_chat_member_count() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO chat_summaries AS s (chat_id, member_count, version)
+        SELECT chat_id, COUNT(*), 1 FROM changed_members GROUP BY chat_id
+        ON CONFLICT (chat_id) DO UPDATE SET
+            member_count = s.member_count + EXCLUDED.member_count,
+            version = s.version + 1;
+    ELSE
+        UPDATE chat_summaries s SET
+            member_count = GREATEST(s.member_count - d.removed, 0),
+            version = s.version + 1
+        FROM (SELECT chat_id, COUNT(*) AS removed FROM changed_members GROUP BY chat_id) d
+        WHERE s.chat_id = d.chat_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bump_chat_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE chat_summaries SET version = version + 1 WHERE chat_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chats_version ON chats;
+CREATE TRIGGER trg_chats_version
+    AFTER UPDATE OF title, avatar_url ON chats
+    FOR EACH ROW
+    WHEN (OLD.title IS DISTINCT FROM NEW.title OR OLD.avatar_url IS DISTINCT FROM NEW.avatar_url)
+    EXECUTE FUNCTION bump_chat_version();
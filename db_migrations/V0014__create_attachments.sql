@@ -0,0 +1,50 @@
+-- Содержимое файла хранится один раз на sha256, сколько бы раз его ни загрузили
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    size BIGINT NOT NULL,
+    content_type VARCHAR(100) NOT NULL,
+    storage_key TEXT NOT NULL,
+    thumbnail_key TEXT,
+    width INTEGER,
+    height INTEGER,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Незавершённая загрузка: received — сколько байт уже записано в хранилище
+CREATE TABLE IF NOT EXISTS uploads (
+    id UUID PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    filename VARCHAR(255) NOT NULL,
+    content_type VARCHAR(100) NOT NULL,
+    size BIGINT NOT NULL CHECK (size > 0),
+    received BIGINT NOT NULL DEFAULT 0,
+    sha256 CHAR(64),
+    storage_key TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_uploads_created_at ON uploads(created_at);
+
+CREATE TABLE IF NOT EXISTS attachments (
+    id SERIAL PRIMARY KEY,
+    uploaded_by INTEGER NOT NULL REFERENCES users(id),
+    sha256 CHAR(64) NOT NULL REFERENCES blobs(sha256),
+    filename VARCHAR(255) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- messages секционирована, поэтому ссылка на сообщение без внешнего ключа;
+-- chat_id хранится для проверки доступа к файлу без обращения к messages
+CREATE TABLE IF NOT EXISTS message_attachments (
+    message_id INTEGER NOT NULL,
+    position SMALLINT NOT NULL,
+    chat_id INTEGER NOT NULL REFERENCES chats(id),
+    attachment_id INTEGER NOT NULL REFERENCES attachments(id),
+    PRIMARY KEY (message_id, position)
+);
+
+CREATE INDEX IF NOT EXISTS idx_message_attachments_attachment ON message_attachments(attachment_id, chat_id);
+
+-- Флаг избавляет выдачу сообщений без вложений от запроса к message_attachments.
+-- Столбец с константным DEFAULT добавляется без перезаписи партиций
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS has_attachments BOOLEAN NOT NULL DEFAULT FALSE;
@@ -0,0 +1,58 @@
+-- Изменения для синхронизации отмечаются транзакцией, которая их сделала.
+-- Курсор sync хранит снимок pg_current_snapshot(): всё, что не видно в
+-- снимке прошлой синхронизации, считается новым, даже если id меньше
+-- выданного (последовательность выдаёт id до коммита, и коммиты идут не по порядку)
+
+-- Столбцы добавляются без значения по умолчанию, чтобы не переписывать
+-- партиции; у старых строк NULL, они видны в любом снимке
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS xid xid8;
+ALTER TABLE messages ALTER COLUMN xid SET DEFAULT pg_current_xact_id();
+CREATE INDEX IF NOT EXISTS idx_messages_chat_id_xid ON messages(chat_id, xid);
+
+ALTER TABLE chat_members ADD COLUMN IF NOT EXISTS changed_xid xid8;
+ALTER TABLE chat_summaries ADD COLUMN IF NOT EXISTS changed_xid xid8;
+
+CREATE OR REPLACE FUNCTION set_changed_xid() RETURNS trigger AS $$
+BEGIN
+    NEW.changed_xid := pg_current_xact_id();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Участник: вступление, прочтение (в том числе с другого устройства), смена роли
+DROP TRIGGER IF EXISTS trg_chat_members_changed ON chat_members;
+CREATE TRIGGER trg_chat_members_changed
+    BEFORE INSERT OR UPDATE ON chat_members
+    FOR EACH ROW EXECUTE FUNCTION set_changed_xid();
+
+-- Сводка: новое сообщение, состав участников, название и аватар (вместе с version)
+DROP TRIGGER IF EXISTS trg_chat_summaries_changed ON chat_summaries;
+CREATE TRIGGER trg_chat_summaries_changed
+    BEFORE INSERT OR UPDATE ON chat_summaries
+    FOR EACH ROW EXECUTE FUNCTION set_changed_xid();
+
+-- Выход и исключение из чата: строки участника больше нет, поэтому
+-- синхронизация узнаёт о них из этой таблицы
+CREATE TABLE IF NOT EXISTS chat_removals (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    xid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+    removed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_removals_user_xid ON chat_removals(user_id, xid);
+CREATE INDEX IF NOT EXISTS idx_chat_removals_removed_at ON chat_removals(removed_at);
+
+CREATE OR REPLACE FUNCTION record_chat_removals() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO chat_removals (chat_id, user_id)
+    SELECT chat_id, user_id FROM changed_members;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chat_members_removed ON chat_members;
+CREATE TRIGGER trg_chat_members_removed
+    AFTER DELETE ON chat_members
+    REFERENCING OLD TABLE AS changed_members
+    FOR EACH STATEMENT EXECUTE FUNCTION record_chat_removals();
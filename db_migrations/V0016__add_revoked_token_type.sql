@@ -0,0 +1,7 @@
+-- Тип отозванного токена: в памяти функций кешируются только access-токены,
+-- refresh-токены проверяются при обмене вставкой в таблицу. Старые строки
+-- считаются access-токенами, чтобы ни один отзыв не потерялся
+ALTER TABLE revoked_tokens ADD COLUMN IF NOT EXISTS token_type VARCHAR(10) NOT NULL DEFAULT 'access';
+
+CREATE INDEX IF NOT EXISTS idx_revoked_tokens_access_expires_at
+    ON revoked_tokens(expires_at) WHERE token_type = 'access';
@@ -0,0 +1,72 @@
+-- Запросы по курсору id не знают created_at, поэтому партиции messages не
+-- отсекаются. Для каждой месячной партиции запоминается её наименьший id и
+-- время этого сообщения: по ним id переводится в границу created_at.
+--
+-- id выдаётся внутри транзакции, а created_at — время её начала, поэтому
+-- сообщение с большим id не старше сообщения с меньшим больше чем на
+-- длительность транзакции. Запас в сутки эту длительность покрывает.
+CREATE TABLE IF NOT EXISTS message_id_months (
+    month DATE PRIMARY KEY,
+    first_id INTEGER NOT NULL,
+    first_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_message_id_months_first_id ON message_id_months(first_id);
+
+-- Отметки для партиций, у которых их ещё нет и в которых уже есть сообщения
+CREATE OR REPLACE FUNCTION record_message_id_months() RETURNS INTEGER AS $$
+DECLARE
+    partition RECORD;
+    inserted INTEGER;
+    recorded INTEGER := 0;
+BEGIN
+    FOR partition IN
+        SELECT c.relname, to_date(substr(c.relname, 10), 'YYYY_MM') AS month
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass AND c.relname ~ '^messages_\d{4}_\d{2}$'
+    LOOP
+        CONTINUE WHEN EXISTS (SELECT 1 FROM message_id_months WHERE month = partition.month);
+        EXECUTE format(
+            'INSERT INTO message_id_months (month, first_id, first_at)
+             SELECT %L, id, created_at FROM %I ORDER BY id LIMIT 1
+             ON CONFLICT (month) DO NOTHING',
+            partition.month, partition.relname
+        );
+        GET DIAGNOSTICS inserted = ROW_COUNT;
+        recorded := recorded + inserted;
+    END LOOP;
+    RETURN recorded;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Отметки обновляются вместе с ежедневной проверкой партиций
+CREATE OR REPLACE FUNCTION ensure_messages_partitions(months_ahead INTEGER DEFAULT 2) RETURNS INTEGER AS $$
+DECLARE
+    created INTEGER := 0;
+BEGIN
+    FOR i IN 0..months_ahead LOOP
+        IF create_messages_partition((date_trunc('month', LOCALTIMESTAMP) + make_interval(months => i))::date) THEN
+            created := created + 1;
+        END IF;
+    END LOOP;
+    PERFORM record_message_id_months();
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Нижняя граница created_at для сообщений с id не меньше message_id
+CREATE OR REPLACE FUNCTION messages_time_floor(message_id INTEGER) RETURNS TIMESTAMP AS $$
+    SELECT COALESCE(MAX(first_at) - INTERVAL '1 day', '-infinity'::timestamp)
+    FROM message_id_months
+    WHERE first_id <= message_id
+$$ LANGUAGE sql STABLE;
+
+-- Верхняя граница created_at для сообщений с id не больше message_id
+CREATE OR REPLACE FUNCTION messages_time_ceiling(message_id INTEGER) RETURNS TIMESTAMP AS $$
+    SELECT COALESCE(MIN(first_at) + INTERVAL '1 day', 'infinity'::timestamp)
+    FROM message_id_months
+    WHERE first_id >= message_id
+$$ LANGUAGE sql STABLE;
+
+SELECT record_message_id_months();
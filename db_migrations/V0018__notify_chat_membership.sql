@@ -0,0 +1,14 @@
+-- Уведомление канала user_<id> о том, что пользователя добавили в чат
+-- (создание чата, добавление в группу): ожидающий poll подписан только на
+-- свои чаты на момент запроса и иначе не узнал бы о новом
+CREATE OR REPLACE FUNCTION notify_chat_member_added() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('user_' || NEW.user_id, NEW.chat_id::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chat_members_notify ON chat_members;
+CREATE TRIGGER trg_chat_members_notify
+    AFTER INSERT ON chat_members
+    FOR EACH ROW EXECUTE FUNCTION notify_chat_member_added();
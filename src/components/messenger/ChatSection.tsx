@@ -11,6 +11,9 @@ interface ChatSectionProps {
   chats: Chat[];
   activeChat: Chat | null;
   messages: Message[];
+  hasEarlierMessages: boolean;
+  isLoadingEarlier: boolean;
+  onLoadEarlier: () => void;
   onChatSelect: (chat: Chat) => void;
   onSendMessage: (text: string) => Promise<void>;
   getInitials: (name: string) => string;
@@ -20,6 +23,9 @@ export function ChatSection({
   chats,
   activeChat,
   messages,
+  hasEarlierMessages,
+  isLoadingEarlier,
+  onLoadEarlier,
   onChatSelect,
   onSendMessage,
   getInitials
@@ -140,6 +146,19 @@ export function ChatSection({
 
             <ScrollArea className="flex-1 p-6">
               <div className="space-y-4 max-w-4xl mx-auto">
+                {hasEarlierMessages && (
+                  <div className="flex justify-center">
+                    <Button
+                      variant="ghost"
+                      size="sm"
+                      className="rounded-xl text-muted-foreground"
+                      disabled={isLoadingEarlier}
+                      onClick={onLoadEarlier}
+                    >
+                      {isLoadingEarlier ? 'Загрузка...' : 'Показать ранние сообщения'}
+                    </Button>
+                  </div>
+                )}
                 {messages.map((msg) => (
                   <div
                     key={msg.id}
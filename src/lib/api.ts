@@ -2,6 +2,17 @@ const AUTH_API = 'https://functions.poehali.dev/4aa60634-47bb-4a9d-aa67-3ad18a68
 const MESSAGES_API = 'https://functions.poehali.dev/f2d7d71b-8934-4cf3-9855-84ac2ea6c73d';
 
 const TOKEN_KEY = 'messenger_auth_token';
+const REFRESH_TOKEN_KEY = 'messenger_refresh_token';
+
+const storeTokens = (data: { token?: string; refresh_token?: string }) => {
+  if (data.token) localStorage.setItem(TOKEN_KEY, data.token);
+  if (data.refresh_token) localStorage.setItem(REFRESH_TOKEN_KEY, data.refresh_token);
+};
+
+const clearTokens = () => {
+  localStorage.removeItem(TOKEN_KEY);
+  localStorage.removeItem(REFRESH_TOKEN_KEY);
+};
 
 export interface User {
   id: number;
@@ -14,8 +25,13 @@ export interface User {
 
 export interface Chat {
   id: number;
+  isGroup?: boolean;
+  title?: string;
+  avatar?: string;
+  memberCount?: number;
+  members?: { id: number; name: string; avatar: string }[];
   user: {
-    id: number;
+    id: number | null;
     username: string;
     name: string;
     avatar: string;
@@ -26,11 +42,34 @@ export interface Chat {
   unread: number;
 }
 
+export interface GroupMember {
+  id: number;
+  username: string;
+  name: string;
+  avatar: string;
+  online: boolean;
+  role: 'owner' | 'admin' | 'member';
+}
+
+export interface Attachment {
+  id: number;
+  filename: string;
+  content_type: string;
+  size: number;
+  width: number | null;
+  height: number | null;
+  thumbnail: boolean;
+}
+
 export interface Message {
   id: number;
   text: string;
   sender: 'me' | 'other';
+  sender_id?: number;
   time: string;
+  client_id?: string;
+  duplicate?: boolean;
+  attachments?: Attachment[];
 }
 
 export interface Contact {
@@ -51,6 +90,30 @@ export interface SearchUser {
   isContact: boolean;
 }
 
+export interface MessagePage {
+  messages: Message[];
+  has_more: boolean;
+  next_cursor: number | null;
+}
+
+export interface SyncResult {
+  cursor: string;
+  has_more: boolean;
+  messages: (Message & { chat_id: number })[];
+  chats: Chat[];
+  removed_chats: number[];
+  presence: { id: number; online: boolean }[];
+}
+
+export interface MessageSearchResult {
+  id: number;
+  chat_id: number;
+  sender: 'me' | 'other';
+  time: string;
+  rank: number;
+  snippet: string;
+}
+
 export const auth = {
   async register(username: string, email: string, password: string, display_name: string) {
     try {
@@ -61,7 +124,7 @@ export const auth = {
       });
       const data = await response.json();
       if (!response.ok) throw new Error(data.error || 'Registration failed');
-      if (data.token) localStorage.setItem(TOKEN_KEY, data.token);
+      storeTokens(data);
       return data;
     } catch (error: any) {
       if (error.message.includes('fetch')) {
@@ -80,7 +143,7 @@ export const auth = {
       });
       const data = await response.json();
       if (!response.ok) throw new Error(data.error || 'Login failed');
-      if (data.token) localStorage.setItem(TOKEN_KEY, data.token);
+      storeTokens(data);
       return data;
     } catch (error: any) {
       if (error.message.includes('fetch')) {
@@ -95,25 +158,52 @@ export const auth = {
     if (!token) throw new Error('No token');
     
     try {
-      const response = await fetch(AUTH_API, {
+      let response = await fetch(AUTH_API, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ action: 'verify', token })
       });
+      if (response.status === 401 && await auth.refresh()) {
+        response = await fetch(AUTH_API, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ action: 'verify', token: localStorage.getItem(TOKEN_KEY) })
+        });
+      }
       const data = await response.json();
       if (!response.ok) {
-        localStorage.removeItem(TOKEN_KEY);
+        clearTokens();
         throw new Error(data.error || 'Verification failed');
       }
       return data;
     } catch (error: any) {
-      localStorage.removeItem(TOKEN_KEY);
+      clearTokens();
       throw new Error('No token');
     }
   },
 
+  async refresh(): Promise<boolean> {
+    const refreshToken = localStorage.getItem(REFRESH_TOKEN_KEY);
+    if (!refreshToken) return false;
+    const response = await fetch(AUTH_API, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ action: 'refresh', refresh_token: refreshToken })
+    });
+    if (!response.ok) return false;
+    storeTokens(await response.json());
+    return true;
+  },
+
   logout() {
-    localStorage.removeItem(TOKEN_KEY);
+    const token = localStorage.getItem(TOKEN_KEY);
+    const refreshToken = localStorage.getItem(REFRESH_TOKEN_KEY);
+    clearTokens();
+    fetch(AUTH_API, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ action: 'logout', token, refresh_token: refreshToken })
+    }).catch(() => undefined);
   },
 
   getToken() {
@@ -138,23 +228,52 @@ export const messages = {
     }
   },
 
-  async getMessages(chatId: number): Promise<Message[]> {
+  async getMessages(chatId: number, beforeId?: number): Promise<MessagePage> {
+    const empty = { messages: [], has_more: false, next_cursor: null };
     try {
       const token = auth.getToken();
-      if (!token) return [];
-      const response = await fetch(`${MESSAGES_API}?action=messages&chat_id=${chatId}`, {
+      if (!token) return empty;
+      const cursor = beforeId ? `&before_id=${beforeId}` : '';
+      const response = await fetch(`${MESSAGES_API}?action=messages&chat_id=${chatId}${cursor}`, {
         headers: { 'Authorization': `Bearer ${token}` }
       });
       const data = await response.json();
       if (!response.ok) throw new Error(data.error || 'Failed to get messages');
-      return data.messages;
+      return data;
     } catch (error: any) {
       console.error('Get messages error:', error);
-      return [];
+      return empty;
     }
   },
 
-  async sendMessage(chatId: number, text: string): Promise<Message> {
+  async sync(cursor?: string): Promise<SyncResult> {
+    const token = auth.getToken();
+    const query = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+    const response = await fetch(`${MESSAGES_API}?action=sync${query}`, {
+      headers: { 'Authorization': `Bearer ${token}` }
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error || 'Failed to sync');
+    return data;
+  },
+
+  async poll(cursor?: string): Promise<{ messages: (Message & { chat_id: number })[]; has_more: boolean; cursor: string }> {
+    const token = auth.getToken();
+    const query = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+    const response = await fetch(`${MESSAGES_API}?action=poll${query}`, {
+      headers: { 'Authorization': `Bearer ${token}` }
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error || 'Failed to poll messages');
+    return data;
+  },
+
+  async sendMessage(
+    chatId: number,
+    text: string,
+    clientId: string = crypto.randomUUID(),
+    attachmentIds: number[] = []
+  ): Promise<Message> {
     const token = auth.getToken();
     const response = await fetch(MESSAGES_API, {
       method: 'POST',
@@ -162,13 +281,49 @@ export const messages = {
         'Content-Type': 'application/json',
         'Authorization': `Bearer ${token}`
       },
-      body: JSON.stringify({ action: 'send', chat_id: chatId, text })
+      body: JSON.stringify({ action: 'send', chat_id: chatId, text, client_id: clientId, attachment_ids: attachmentIds })
     });
     const data = await response.json();
     if (!response.ok) throw new Error(data.error || 'Failed to send message');
     return data.message;
   },
 
+  async markRead(chatId: number, messageId?: number) {
+    const token = auth.getToken();
+    const response = await fetch(MESSAGES_API, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${token}`
+      },
+      body: JSON.stringify({ action: 'mark_read', chat_id: chatId, message_id: messageId })
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error || 'Failed to mark chat as read');
+    return data;
+  },
+
+  async batch(
+    sends: { chat_id: number; text: string; client_id: string; attachment_ids?: number[] }[],
+    fetchChats: { chat_id: number; after_id?: number }[] = []
+  ) {
+    const token = auth.getToken();
+    const response = await fetch(MESSAGES_API, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${token}`
+      },
+      body: JSON.stringify({ action: 'batch', sends, fetch: fetchChats })
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error || 'Failed to run batch');
+    return data as {
+      sent: ((Message & { chat_id: number; client_id: string }) | { client_id: string; error: string })[];
+      chats: { chat_id: number; messages: Message[]; has_more: boolean }[];
+    };
+  },
+
   async getContacts(): Promise<Contact[]> {
     try {
       const token = auth.getToken();
@@ -208,6 +363,17 @@ export const messages = {
     }
   },
 
+  async searchMessages(query: string, cursor?: string): Promise<{ results: MessageSearchResult[]; next_cursor: string | null }> {
+    const token = auth.getToken();
+    const page = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+    const response = await fetch(`${MESSAGES_API}?action=search_messages&query=${encodeURIComponent(query)}${page}`, {
+      headers: { 'Authorization': `Bearer ${token}` }
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error || 'Failed to search messages');
+    return data;
+  },
+
   async addContact(username: string) {
     const token = auth.getToken();
     const response = await fetch(MESSAGES_API, {
@@ -223,6 +389,21 @@ export const messages = {
     return data;
   },
 
+  async updateProfile(fields: { display_name?: string; avatar_url?: string; bio?: string }): Promise<User> {
+    const token = auth.getToken();
+    const response = await fetch(MESSAGES_API, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${token}`
+      },
+      body: JSON.stringify({ action: 'update_profile', ...fields })
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error || 'Failed to update profile');
+    return data.user;
+  },
+
   async createChat(contactId: number): Promise<number> {
     const token = auth.getToken();
     const response = await fetch(MESSAGES_API, {
@@ -236,5 +417,125 @@ export const messages = {
     const data = await response.json();
     if (!response.ok) throw new Error(data.error || 'Failed to create chat');
     return data.chat_id;
+  },
+
+  async getMembers(chatId: number, cursor?: number): Promise<{ members: GroupMember[]; next_cursor: number | null }> {
+    const token = auth.getToken();
+    const params = new URLSearchParams({ action: 'members', chat_id: String(chatId) });
+    if (cursor) params.set('cursor', String(cursor));
+    const response = await fetch(`${MESSAGES_API}?${params}`, {
+      headers: { 'Authorization': `Bearer ${token}` }
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error || 'Failed to load members');
+    return data;
+  },
+
+  async groupAction(action: string, payload: Record<string, unknown>) {
+    const token = auth.getToken();
+    const response = await fetch(MESSAGES_API, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${token}`
+      },
+      body: JSON.stringify({ action, ...payload })
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error || `Failed to ${action}`);
+    return data;
+  },
+
+  async createGroup(title: string, memberIds: number[]): Promise<number> {
+    const data = await this.groupAction('create_group', { title, member_ids: memberIds });
+    return data.chat_id;
+  },
+
+  async updateGroup(chatId: number, fields: { title?: string; avatar_url?: string }) {
+    return this.groupAction('update_group', { chat_id: chatId, ...fields });
+  },
+
+  async addMembers(chatId: number, userIds: number[]): Promise<number[]> {
+    const data = await this.groupAction('add_members', { chat_id: chatId, user_ids: userIds });
+    return data.added;
+  },
+
+  async removeMember(chatId: number, userId?: number) {
+    return this.groupAction('remove_member', { chat_id: chatId, user_id: userId });
+  },
+
+  async setMemberRole(chatId: number, userId: number, role: 'admin' | 'member') {
+    return this.groupAction('set_member_role', { chat_id: chatId, user_id: userId, role });
+  }
+};
+
+const toHex = (buffer: ArrayBuffer) =>
+  Array.from(new Uint8Array(buffer), (byte) => byte.toString(16).padStart(2, '0')).join('');
+
+export const attachments = {
+  async upload(file: File, onProgress?: (received: number, size: number) => void): Promise<Attachment> {
+    const token = auth.getToken();
+    const sha256 = toHex(await crypto.subtle.digest('SHA-256', await file.arrayBuffer()));
+    const response = await fetch(MESSAGES_API, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${token}`
+      },
+      body: JSON.stringify({
+        action: 'upload_start',
+        filename: file.name,
+        content_type: file.type,
+        size: file.size,
+        sha256
+      })
+    });
+    let data = await response.json();
+    if (!response.ok) throw new Error(data.error || 'Failed to start upload');
+
+    // После обрыва сервер отвечает 409 с уже принятым смещением, с него и продолжаем
+    let received = 0;
+    while (!data.complete) {
+      const chunk = file.slice(received, received + data.chunk_size);
+      const params = new URLSearchParams({ action: 'upload_chunk', upload_id: data.upload_id, offset: String(received) });
+      const chunkResponse = await fetch(`${MESSAGES_API}?${params}`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/octet-stream',
+          'Authorization': `Bearer ${token}`
+        },
+        body: chunk
+      });
+      const chunkData = await chunkResponse.json();
+      if (chunkResponse.status !== 409 && !chunkResponse.ok) throw new Error(chunkData.error || 'Failed to upload chunk');
+      received = chunkData.received;
+      data = { ...data, ...chunkData, complete: chunkData.complete === true };
+      onProgress?.(received, file.size);
+    }
+    return data.attachment;
+  },
+
+  async download(attachmentId: number, thumbnail = false): Promise<Blob> {
+    const token = auth.getToken();
+    const params = new URLSearchParams({ action: 'download', id: String(attachmentId) });
+    if (thumbnail) params.set('thumbnail', '1');
+
+    // Функция отдаёт файл частями: следующая часть запрашивается с конца предыдущей
+    const parts: Blob[] = [];
+    let offset = 0;
+    let contentType = '';
+    for (;;) {
+      const response = await fetch(`${MESSAGES_API}?${params}`, {
+        headers: { 'Authorization': `Bearer ${token}`, 'Range': `bytes=${offset}-` }
+      });
+      if (!response.ok) throw new Error('Failed to download attachment');
+      const part = await response.blob();
+      parts.push(part);
+      contentType = response.headers.get('Content-Type') || contentType;
+      const total = Number(response.headers.get('Content-Range')?.split('/')[1] ?? part.size);
+      offset += part.size;
+      if (response.status !== 206 || offset >= total || part.size === 0) break;
+    }
+    return new Blob(parts, { type: contentType });
   }
-};
\ No newline at end of file
+};
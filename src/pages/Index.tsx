@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Button } from '@/components/ui/button';
 import { useToast } from '@/hooks/use-toast';
 import Icon from '@/components/ui/icon';
@@ -18,6 +18,9 @@ export default function Index() {
   const [contacts, setContacts] = useState<Contact[]>([]);
   const [activeChat, setActiveChat] = useState<Chat | null>(null);
   const [messages, setMessages] = useState<Message[]>([]);
+  const [earlierCursor, setEarlierCursor] = useState<number | null>(null);
+  const [isLoadingEarlier, setIsLoadingEarlier] = useState(false);
+  const activeChatId = useRef<number | null>(null);
   const [activeSection, setActiveSection] = useState<Section>('chats');
   
   const { toast } = useToast();
@@ -34,6 +37,7 @@ export default function Index() {
   }, [user]);
 
   useEffect(() => {
+    activeChatId.current = activeChat?.id ?? null;
     if (activeChat) {
       loadMessages(activeChat.id);
     }
@@ -77,6 +81,7 @@ export default function Index() {
     setContacts([]);
     setActiveChat(null);
     setMessages([]);
+    setEarlierCursor(null);
   };
 
   const loadChats = async () => {
@@ -90,8 +95,28 @@ export default function Index() {
   };
 
   const loadMessages = async (chatId: number) => {
-    const data = await messagesApi.getMessages(chatId);
-    setMessages(data);
+    const page = await messagesApi.getMessages(chatId);
+    setMessages(page.messages);
+    setEarlierCursor(page.has_more ? page.next_cursor : null);
+    if (page.messages.length > 0) {
+      await messagesApi.markRead(chatId, page.messages[page.messages.length - 1].id).catch(() => undefined);
+      loadChats();
+    }
+  };
+
+  const loadEarlierMessages = async () => {
+    if (!activeChat || earlierCursor === null || isLoadingEarlier) return;
+    const chatId = activeChat.id;
+    setIsLoadingEarlier(true);
+    try {
+      const page = await messagesApi.getMessages(chatId, earlierCursor);
+      // Пока страница грузилась, пользователь мог открыть другой чат
+      if (activeChatId.current !== chatId) return;
+      setMessages(current => [...page.messages, ...current]);
+      setEarlierCursor(page.has_more ? page.next_cursor : null);
+    } finally {
+      setIsLoadingEarlier(false);
+    }
   };
 
   const handleSendMessage = async (text: string) => {
@@ -205,6 +230,9 @@ export default function Index() {
           chats={chats}
           activeChat={activeChat}
           messages={messages}
+          hasEarlierMessages={earlierCursor !== null}
+          isLoadingEarlier={isLoadingEarlier}
+          onLoadEarlier={loadEarlierMessages}
           onChatSelect={setActiveChat}
           onSendMessage={handleSendMessage}
           getInitials={getInitials}
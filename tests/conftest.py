@@ -0,0 +1,13 @@
+"""Общая настройка тестов чистых функций backend/messages.
+
+Модули функции импортируются из её каталога, как при деплое. Ключ токенов
+задаётся до импорта.
+"""
+import os
+import sys
+from pathlib import Path
+
+MESSAGES_DIR = Path(__file__).resolve().parent.parent / 'backend' / 'messages'
+
+os.environ.setdefault('TOKEN_SECRET', 'test-secret')
+sys.path.insert(0, str(MESSAGES_DIR))
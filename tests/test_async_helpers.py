@@ -0,0 +1,55 @@
+import subprocess
+import sys
+import time
+
+from async_db import convert
+from conftest import MESSAGES_DIR
+from presence import PresenceTracker
+
+
+def test_convert_positional_placeholders():
+    assert convert('SELECT %s, %s') == ('SELECT $1, $2', (0, 1))
+
+
+def test_convert_named_placeholders_reuse_numbers():
+    sql, keys = convert('WHERE a = %(id)s OR b = %(id)s AND c = %(limit)s')
+    assert sql == 'WHERE a = $1 OR b = $1 AND c = $2'
+    assert keys == ('id', 'limit')
+
+
+def test_convert_unescapes_percent():
+    assert convert("SELECT 'x%%' LIKE %s") == ("SELECT 'x%' LIKE $1", (0,))
+
+
+def test_take_due_waits_for_interval():
+    tracker = PresenceTracker(flush_interval=60)
+    # Первая отметка пользователя срочная: его ещё не записывали
+    tracker.heartbeat(1)
+    pending = tracker.take_due()
+    assert set(pending) == {1}
+    tracker.mark_flushed(pending, time.time())
+
+    tracker.heartbeat(1)
+    assert tracker.take_due() == {}
+    assert set(tracker.take_due(force=True)) == {1}
+    assert tracker.take_due(force=True) == {}
+
+
+def test_restore_keeps_newest_mark():
+    tracker = PresenceTracker(flush_interval=60)
+    tracker.heartbeat(1)
+    pending = tracker.take_due(force=True)
+    tracker.heartbeat(1)
+    newer = tracker._pending[1]
+    tracker.restore({1: pending[1], 2: 5.0})
+    restored = tracker.take_due(force=True)
+    assert restored == {1: newer, 2: 5.0}
+
+
+def test_sync_entry_point_does_not_import_asyncio():
+    # Отдельный интерпретатор: в этом asyncio уже загружен тестами выше
+    probe = "import sys, index; print('asyncio' in sys.modules, 'async_db' in sys.modules)"
+    output = subprocess.run(
+        [sys.executable, '-c', probe], cwd=MESSAGES_DIR, check=True, capture_output=True, text=True
+    ).stdout
+    assert output.split() == ['False', 'False']
@@ -0,0 +1,49 @@
+import pytest
+
+import storage
+from framework import HttpError
+from index import attachment_storage, parse_range
+
+
+def test_no_range_header():
+    assert parse_range('', 100) is None
+    assert parse_range('items=0-10', 100) is None
+    assert parse_range('bytes=-', 100) is None
+
+
+def test_explicit_range():
+    assert parse_range('bytes=0-9', 100) == (0, 9)
+    assert parse_range('bytes=10-', 100) == (10, 99)
+
+
+def test_end_is_clamped_to_size():
+    assert parse_range('bytes=90-500', 100) == (90, 99)
+
+
+def test_suffix_range():
+    assert parse_range('bytes=-10', 100) == (90, 99)
+    assert parse_range('bytes=-500', 100) == (0, 99)
+
+
+def test_only_first_range_is_used():
+    assert parse_range('bytes=0-1, 5-6', 100) == (0, 1)
+
+
+@pytest.mark.parametrize('header', ['bytes=100-', 'bytes=200-300', 'bytes=10-5'])
+def test_unsatisfiable_range(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 100)
+
+
+def test_storage_is_required_only_for_attachments(monkeypatch):
+    monkeypatch.delenv('STORAGE_URL', raising=False)
+    monkeypatch.setattr(storage, '_storage', None)
+    with pytest.raises(HttpError) as raised:
+        attachment_storage()
+    assert raised.value.status == 503
+
+
+def test_storage_is_created_from_url(monkeypatch, tmp_path):
+    monkeypatch.setenv('STORAGE_URL', f'file://{tmp_path}')
+    monkeypatch.setattr(storage, '_storage', None)
+    assert attachment_storage().root == str(tmp_path)
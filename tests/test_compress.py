@@ -0,0 +1,49 @@
+import base64
+import gzip
+import json
+
+import framework
+from framework import accepted_encodings, compress
+
+
+def test_accepted_encodings_skips_q_zero():
+    assert accepted_encodings('gzip, deflate, br') == {'gzip', 'deflate', 'br'}
+    assert accepted_encodings('br;q=0, gzip;q=0.5') == {'gzip'}
+    assert accepted_encodings('GZIP; q=0.0') == set()
+    assert accepted_encodings('') == set()
+
+
+def response(body: str) -> dict:
+    return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': body}
+
+
+def test_small_body_is_not_compressed_but_varies():
+    result = compress(response('{}'), 'gzip')
+    assert result['body'] == '{}'
+    assert 'Content-Encoding' not in result['headers']
+    assert result['headers']['Vary'] == 'Accept-Encoding'
+
+
+def test_large_body_is_gzipped(monkeypatch):
+    monkeypatch.setattr(framework, 'brotli', None)
+    body = json.dumps({'items': list(range(1000))})
+    result = compress(response(body), 'gzip, br')
+    assert result['isBase64Encoded']
+    assert result['headers']['Content-Encoding'] == 'gzip'
+    assert result['headers']['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(base64.b64decode(result['body'])).decode() == body
+
+
+def test_unsupported_encoding_is_not_compressed_but_varies():
+    large = response('x' * (framework.COMPRESS_MIN_BYTES + 1))
+    for accept_encoding in ('deflate', 'gzip;q=0', ''):
+        result = compress(large, accept_encoding)
+        assert result['body'] == large['body']
+        assert not result.get('isBase64Encoded')
+        assert 'Content-Encoding' not in result['headers']
+        assert result['headers']['Vary'] == 'Accept-Encoding'
+
+
+def test_binary_body_is_not_compressed_again():
+    binary = {**response('x' * (framework.COMPRESS_MIN_BYTES + 1)), 'isBase64Encoded': True}
+    assert compress(binary, 'gzip') is binary
@@ -0,0 +1,87 @@
+import base64
+import json
+
+import tokens
+from tokens import RevocationList, issue_token, verify_token
+
+
+def forge(claims: dict, signature: str) -> str:
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).rstrip(b'=').decode()
+    return f'{payload}.{signature}'
+
+
+def test_issued_token_verifies():
+    token, claims = issue_token(42)
+    assert verify_token(token) == claims
+    assert claims['sub'] == 42 and claims['typ'] == 'access'
+
+
+def test_tampered_payload_is_rejected():
+    token, claims = issue_token(42)
+    signature = token.split('.')[1]
+    assert verify_token(forge({**claims, 'sub': 1}, signature)) is None
+
+
+def test_unknown_key_is_rejected():
+    token, claims = issue_token(42)
+    assert verify_token(forge({**claims, 'kid': 'other'}, token.split('.')[1])) is None
+
+
+def test_garbage_is_rejected():
+    for token in ('', 'abc', '1:test', 'a.b.c', None):
+        assert verify_token(token) is None
+
+
+def test_expired_token_is_rejected(monkeypatch):
+    token, claims = issue_token(42)
+    monkeypatch.setattr(tokens.time, 'time', lambda: claims['exp'] + 1)
+    assert verify_token(token) is None
+
+
+def test_wrong_type_is_rejected():
+    access, _ = issue_token(42, 'access')
+    refresh, _ = issue_token(42, 'refresh')
+    assert verify_token(refresh) is None
+    assert verify_token(access, 'refresh') is None
+    assert verify_token(refresh, 'refresh')['typ'] == 'refresh'
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+def test_revocation_list_reloads_only_when_stale():
+    revocations = RevocationList(refresh_interval=60)
+    cur = FakeCursor([('revoked',)])
+    assert revocations.is_revoked('revoked', cur)
+    assert not revocations.is_revoked('other', cur)
+    assert len(cur.executed) == 1
+    assert "token_type = 'access'" in cur.executed[0][0]
+
+
+def test_revocation_list_takes_cursor_factory_lazily():
+    revocations = RevocationList(refresh_interval=60)
+    revocations.replace(set())
+    assert not revocations.is_revoked('jti', lambda: (_ for _ in ()).throw(AssertionError('no query expected')))
+
+
+def test_revoking_refresh_token_is_not_cached():
+    revocations = RevocationList(refresh_interval=60)
+    revocations.replace(set())
+    _, access = issue_token(42, 'access')
+    _, refresh = issue_token(42, 'refresh')
+    assert revocations.revoke(FakeCursor([(access['jti'],)]), access)
+    assert not revocations.revoke(FakeCursor([]), refresh)
+    assert access['jti'] in revocations
+    assert refresh['jti'] not in revocations
@@ -0,0 +1,27 @@
+import pytest
+
+from tracing import fingerprint, is_read_only
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT id FROM users WHERE id = %s",
+    "WITH recent AS (SELECT id FROM messages) SELECT COUNT(*) FROM recent",
+    "SELECT updated_at FROM chats",
+])
+def test_plain_selects_are_read_only(sql):
+    assert is_read_only(fingerprint(sql))
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT id FROM chats WHERE id = %s FOR UPDATE",
+    "SELECT id FROM chats WHERE id = %s FOR NO KEY UPDATE",
+    "SELECT id FROM chats WHERE id = %s FOR KEY SHARE",
+    "SELECT ensure_messages_partitions(2)",
+    "SELECT nextval('messages_id_seq')",
+    "SELECT pg_notify('chat_1', '5')",
+    "SELECT pg_try_advisory_xact_lock(42)",
+    "WITH moved AS (DELETE FROM chat_removals RETURNING id) SELECT COUNT(*) FROM moved",
+    "UPDATE users SET last_seen = LOCALTIMESTAMP",
+])
+def test_side_effects_are_not_repeated(sql):
+    assert not is_read_only(fingerprint(sql))
@@ -0,0 +1,152 @@
+"""Архивация холодных партиций messages.
+
+archive — отсоединяет месячные партиции старше --keep-months, выгружает их
+в gzip CSV с манифестом и удаляет таблицы; заодно чистит ключи
+идемпотентности старше той же границы и создаёт партиции на будущие месяцы.
+restore — загружает архив в отдельную таблицу и присоединяет её обратно
+партицией; триггеры messages при этом не срабатывают, сводки чатов не меняются.
+
+    DATABASE_URL=postgresql://... python tools/archive_messages.py archive --keep-months 12 --out archive/
+    DATABASE_URL=postgresql://... python tools/archive_messages.py restore archive/messages_2023_01.csv.gz
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+from datetime import date
+from pathlib import Path
+
+import psycopg2
+from psycopg2 import sql
+
+COLUMNS = ('id', 'chat_id', 'sender_id', 'text', 'created_at', 'client_id', 'has_attachments')
+PARTITION_NAME = re.compile(r'^messages_(\d{4})_(\d{2})$')
+
+
+def month_start(value: date, shift: int = 0) -> date:
+    """Первое число месяца со сдвигом на shift месяцев"""
+    months = value.year * 12 + value.month - 1 + shift
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def list_partitions(cur) -> list:
+    """Месячные партиции messages: [(имя, начало месяца)] по возрастанию"""
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass
+    """)
+    partitions = []
+    for (name,) in cur.fetchall():
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda item: item[1])
+
+
+def archive(conn, keep_months: int, out_dir: Path):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cutoff = month_start(date.today(), -keep_months)
+    cur = conn.cursor()
+
+    cur.execute("SELECT ensure_messages_partitions(2)")
+    conn.commit()
+
+    for name, start in list_partitions(cur):
+        if start >= cutoff:
+            continue
+        path = out_dir / f'{name}.csv.gz'
+        table = sql.Identifier(name)
+
+        cur.execute(sql.SQL("ALTER TABLE messages DETACH PARTITION {}").format(table))
+        conn.commit()
+
+        # COPY пишет прямо в gzip-поток, партиция не загружается в память целиком
+        with gzip.open(path, 'wb') as archive_file:
+            cur.copy_expert(
+                sql.SQL("COPY (SELECT {} FROM {} ORDER BY id) TO STDOUT WITH (FORMAT csv)").format(
+                    sql.SQL(', ').join(map(sql.Identifier, COLUMNS)), table
+                ).as_string(conn),
+                archive_file
+            )
+        cur.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(table))
+        rows = cur.fetchone()[0]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as archive_file:
+            for block in iter(lambda: archive_file.read(1 << 20), b''):
+                digest.update(block)
+        manifest = {
+            'partition': name,
+            'from': start.isoformat(),
+            'to': month_start(start, 1).isoformat(),
+            'rows': rows,
+            'columns': COLUMNS,
+            'sha256': digest.hexdigest(),
+        }
+        path.with_suffix('').with_suffix('.json').write_text(json.dumps(manifest, indent=2))
+
+        cur.execute(sql.SQL("DROP TABLE {}").format(table))
+        conn.commit()
+        print(f'{name}: {rows} rows -> {path}')
+
+    cur.execute("DELETE FROM message_client_ids WHERE created_at < %s", (cutoff,))
+    print(f'message_client_ids: {cur.rowcount} keys older than {cutoff} removed')
+    cur.execute("DELETE FROM chat_removals WHERE removed_at < %s", (cutoff,))
+    print(f'chat_removals: {cur.rowcount} rows older than {cutoff} removed')
+    conn.commit()
+
+
+def restore(conn, path: Path):
+    manifest = json.loads(path.with_suffix('').with_suffix('.json').read_text())
+    name = manifest['partition']
+    table = sql.Identifier(name)
+    cur = conn.cursor()
+
+    # Таблица повторяет messages целиком (генерируемый search_vector, индексы),
+    # поэтому присоединяется без перестройки
+    cur.execute(sql.SQL("CREATE TABLE {} (LIKE messages INCLUDING ALL)").format(table))
+    # Без DEFAULT у xid восстановленные строки не выглядят для sync новыми
+    cur.execute(sql.SQL("ALTER TABLE {} ALTER COLUMN xid DROP DEFAULT").format(table))
+    with gzip.open(path, 'rb') as archive_file:
+        cur.copy_expert(
+            sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+                table, sql.SQL(', ').join(map(sql.Identifier, manifest['columns']))
+            ).as_string(conn),
+            archive_file
+        )
+    cur.execute(sql.SQL("ALTER TABLE {} ALTER COLUMN xid SET DEFAULT pg_current_xact_id()").format(table))
+    cur.execute(
+        sql.SQL("ALTER TABLE messages ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)").format(table),
+        (manifest['from'], manifest['to'])
+    )
+    conn.commit()
+    print(f"{name}: {manifest['rows']} rows restored")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    archive_parser = commands.add_parser('archive')
+    archive_parser.add_argument('--keep-months', type=int, default=12)
+    archive_parser.add_argument('--out', type=Path, default=Path('archive'))
+    restore_parser = commands.add_parser('restore')
+    restore_parser.add_argument('path', type=Path)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        if args.command == 'archive':
+            archive(conn, args.keep_months, args.out)
+        else:
+            restore(conn, args.path)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
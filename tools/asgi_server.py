@@ -0,0 +1,108 @@
+"""ASGI-приложение для облачных функций backend/ с асинхронной точкой входа.
+
+Запросы на /auth и /messages преобразуются в event облачной функции и
+передаются в async_handler() соответствующего модуля: действия с
+async-обработчиком выполняются в цикле событий на asyncpg, остальные — в
+пуле потоков через синхронный handler(). Нужны uvicorn и asyncpg; поток
+событий SSE остаётся в tools/local_server.py.
+
+    DATABASE_URL=postgresql://... STORAGE_URL=file:///path python tools/asgi_server.py --port 8000
+    DATABASE_URL=postgresql://... STORAGE_URL=file:///path uvicorn --app-dir tools asgi_server:app --workers 4
+"""
+import argparse
+import base64
+import importlib.util
+from pathlib import Path
+from urllib.parse import parse_qsl
+
+TOOLS_DIR = Path(__file__).resolve().parent
+
+
+def load_local_server():
+    spec = importlib.util.spec_from_file_location('local_server', TOOLS_DIR / 'local_server.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+local_server = load_local_server()
+
+
+async def read_body(receive) -> bytes:
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+def make_event(scope: dict, body: bytes) -> dict:
+    """event облачной функции из ASGI-запроса"""
+    headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+    body, is_base64 = local_server.event_body(body, headers.get('content-type', ''))
+    return {
+        'httpMethod': scope['method'],
+        'headers': headers,
+        'queryStringParameters': dict(parse_qsl(scope.get('query_string', b'').decode())),
+        'body': body,
+        'isBase64Encoded': is_base64,
+    }
+
+
+class FunctionApp:
+    def __init__(self, functions: dict):
+        self.functions = functions
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        parts = [part for part in scope['path'].split('/') if part]
+        if scope['type'] != 'http' or not parts or parts[0] not in self.functions:
+            await send({'type': 'http.response.start', 'status': 404, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        event = make_event(scope, await read_body(receive))
+        response = await self.functions[parts[0]].async_handler(event, None)
+
+        body = response.get('body') or ''
+        payload = base64.b64decode(body) if response.get('isBase64Encoded') else body.encode()
+        headers = [(key.lower().encode(), str(value).encode()) for key, value in (response.get('headers') or {}).items()]
+        headers.append((b'content-length', str(len(payload)).encode()))
+        await send({'type': 'http.response.start', 'status': response.get('statusCode', 200), 'headers': headers})
+        await send({'type': 'http.response.body', 'body': payload})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # Накопленные отметки присутствия дописываются перед остановкой
+                messages = self.functions.get('messages')
+                if messages is not None:
+                    await messages.async_shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = FunctionApp({name: local_server.load_function(name) for name in local_server.FUNCTIONS})
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    print(f'Serving {", ".join(local_server.FUNCTIONS)} on http://{args.host}:{args.port}')
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
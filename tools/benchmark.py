@@ -0,0 +1,545 @@
+"""Нагрузочные замеры облачных функций backend/ на локальном PostgreSQL.
+
+seed — пересоздаёт схему одноразовой базы по db_migrations и заполняет её
+синтетическими данными заданного масштаба. Триггеры на время заливки
+отключаются (session_replication_role = replica, нужен суперпользователь),
+сводки чатов и счётчики прочтения заполняются одним проходом после неё.
+run — гоняет действия auth и messages через handler() в процессе или через
+HTTP-шим tools/local_server.py (или через async_handler() в общем цикле
+событий в режиме async, нужен asyncpg) и сохраняет p50/p95/p99 и пропускную
+способность по каждому действию в benchmarks/results/. С --baseline
+сравнивает p95 с эталоном и завершается с кодом 1 при регрессии.
+compare — то же сравнение для двух сохранённых результатов.
+
+    DATABASE_URL=postgresql://localhost/bench python tools/benchmark.py seed --scale small
+    DATABASE_URL=postgresql://localhost/bench python tools/benchmark.py run --mode inprocess --save-baseline
+    DATABASE_URL=postgresql://localhost/bench python tools/benchmark.py run --mode http --baseline benchmarks/baseline-http.json
+    DATABASE_URL=postgresql://localhost/bench python tools/benchmark.py run --mode async --action chats --action search
+    python tools/benchmark.py compare benchmarks/baseline-inprocess.json benchmarks/results/<файл>.json
+
+Масштаб large (100k пользователей, 1M чатов, 50M сообщений) заливается
+десятки минут и занимает десятки гигабайт; для проверки запросов перед
+деплоем хватает medium.
+
+benchmarks/baseline-inprocess.json и baseline-http.json сняты на масштабе
+small со значениями run по умолчанию на одном ядре, PostgreSQL на той же
+машине; ревизия, версии Python и PostgreSQL записаны в meta. На другой
+машине эталон стоит снять заново (--save-baseline) перед сравнением.
+"""
+import argparse
+import asyncio
+import hashlib
+import http.client
+import importlib.util
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlencode
+
+import psycopg2
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+MIGRATIONS_DIR = ROOT_DIR / 'db_migrations'
+RESULTS_DIR = ROOT_DIR / 'benchmarks' / 'results'
+BASELINE_PATH = ROOT_DIR / 'benchmarks' / 'baseline-{mode}.json'
+
+SCALES = {
+    'small': {'users': 1_000, 'chats': 5_000, 'messages': 200_000},
+    'medium': {'users': 20_000, 'chats': 100_000, 'messages': 5_000_000},
+    'large': {'users': 100_000, 'chats': 1_000_000, 'messages': 50_000_000},
+}
+CONTACTS_PER_USER = 20
+HISTORY_MONTHS = 12
+SEED_BATCH = 500_000
+BENCH_PASSWORD = 'benchmark'
+FIRST_NAMES = ('Анна', 'Иван', 'Мария', 'Пётр', 'Ольга', 'Alex', 'Kate', 'John', 'Maria', 'Nikita')
+PHRASES = (
+    'привет, как дела', 'встречаемся завтра в офисе', 'скинь, пожалуйста, отчёт',
+    'посмотри новый релиз', 'звонок перенесли на пятницу', 'see you at the meeting',
+    'the build is green again', 'can you review my pull request', 'lunch at noon?',
+    'отправил документы на почту',
+)
+SEARCH_QUERIES = ('анна', 'иван', 'bench_1', 'kat', 'мар', 'john', 'ol')
+MESSAGE_QUERIES = ('отчёт', 'релиз', 'meeting', 'review', 'документы', 'пятницу')
+
+
+def connect():
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
+
+def apply_migrations(conn):
+    """Чистая схема public и все миграции по порядку версий"""
+    cur = conn.cursor()
+    cur.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public")
+    for path in sorted(MIGRATIONS_DIR.glob('V*.sql'), key=lambda p: int(p.name[1:].split('__')[0])):
+        cur.execute(path.read_text())
+        print(f'applied {path.name}')
+    conn.commit()
+
+
+def seed(conn, users: int, chats: int, messages: int):
+    cur = conn.cursor()
+    cur.execute("SET session_replication_role = replica")
+    cur.execute("SELECT setseed(0.42)")
+
+    started = time.perf_counter()
+    cur.execute("""
+        INSERT INTO users (id, username, email, password_hash, display_name, last_seen)
+        SELECT g, 'bench_' || g, 'bench_' || g || '@example.test', %(hash)s,
+               (%(names)s::text[])[1 + g %% %(name_count)s] || ' ' || g,
+               LOCALTIMESTAMP - (g %% 1440) * INTERVAL '1 minute'
+        FROM generate_series(1, %(users)s) g
+    """, {
+        'hash': hashlib.sha256(BENCH_PASSWORD.encode()).hexdigest(),
+        'names': list(FIRST_NAMES),
+        'name_count': len(FIRST_NAMES),
+        'users': users,
+    })
+    cur.execute("""
+        INSERT INTO contacts (user_id, contact_user_id)
+        SELECT u, 1 + (u - 1 + k * 7919) %% %(users)s
+        FROM generate_series(1, %(users)s) u, generate_series(1, %(per_user)s) k
+        WHERE 1 + (u - 1 + k * 7919) %% %(users)s != u
+        ON CONFLICT DO NOTHING
+    """, {'users': users, 'per_user': CONTACTS_PER_USER})
+    conn.commit()
+    print(f'users, contacts: {time.perf_counter() - started:.1f}s')
+
+    # Участники чата c: пользователь a(c) и пользователь со смещением от 1 до users - 1
+    # относительно него, поэтому пара никогда не совпадает
+    started = time.perf_counter()
+    cur.execute("""
+        INSERT INTO chats (id, created_at)
+        SELECT c, LOCALTIMESTAMP - %(months)s * INTERVAL '1 month'
+        FROM generate_series(1, %(chats)s) c
+    """, {'chats': chats, 'months': HISTORY_MONTHS})
+    cur.execute("""
+        INSERT INTO chat_members (chat_id, user_id, joined_at)
+        SELECT c, 1 + member, LOCALTIMESTAMP - %(months)s * INTERVAL '1 month'
+        FROM generate_series(1, %(chats)s) c,
+             LATERAL (VALUES ((c - 1) %% %(users)s),
+                             (((c - 1) %% %(users)s + 1 + (c * 31 + (c - 1) / %(users)s) %% (%(users)s - 1)) %% %(users)s)
+             ) AS v(member)
+    """, {'chats': chats, 'users': users, 'months': HISTORY_MONTHS})
+    cur.execute("""
+        INSERT INTO direct_chats (user_low, user_high, chat_id)
+        SELECT MIN(user_id), MAX(user_id), chat_id FROM chat_members GROUP BY chat_id
+        ON CONFLICT DO NOTHING
+    """)
+    cur.execute("SELECT create_messages_partition((date_trunc('month', LOCALTIMESTAMP) - make_interval(months => i))::date) "
+                "FROM generate_series(1, %s) i", (HISTORY_MONTHS,))
+    cur.execute("SELECT ensure_messages_partitions(2)")
+    conn.commit()
+    print(f'chats, members, partitions: {time.perf_counter() - started:.1f}s')
+
+    # Сообщения идут по времени вместе с id, часть чатов заметно активнее остальных
+    started = time.perf_counter()
+    for first in range(1, messages + 1, SEED_BATCH):
+        last = min(first + SEED_BATCH - 1, messages)
+        cur.execute("""
+            INSERT INTO messages (id, chat_id, sender_id, text, created_at)
+            SELECT m.g, m.chat_id,
+                   CASE WHEN m.g %% 2 = 0 THEN 1 + (m.chat_id - 1) %% %(users)s
+                        ELSE 1 + ((m.chat_id - 1) %% %(users)s + 1 + (m.chat_id * 31 + (m.chat_id - 1) / %(users)s) %% (%(users)s - 1)) %% %(users)s
+                   END,
+                   (%(phrases)s::text[])[1 + m.g %% %(phrase_count)s] || ' #' || m.g,
+                   LOCALTIMESTAMP - %(months)s * INTERVAL '1 month'
+                       + (m.g::float8 / %(messages)s) * %(months)s * INTERVAL '1 month' - INTERVAL '1 minute'
+            FROM (
+                SELECT g, 1 + floor(power(random(), 2) * %(chats)s)::int AS chat_id
+                FROM generate_series(%(first)s, %(last)s) g
+            ) m
+        """, {
+            'first': first, 'last': last, 'users': users, 'chats': chats, 'messages': messages,
+            'months': HISTORY_MONTHS, 'phrases': list(PHRASES), 'phrase_count': len(PHRASES),
+        })
+        conn.commit()
+        print(f'messages {last}/{messages}: {time.perf_counter() - started:.1f}s')
+
+    started = time.perf_counter()
+    cur.execute("""
+        INSERT INTO chat_summaries (chat_id, last_message_id, last_message_text, last_message_at, last_sender_id, message_count)
+        SELECT DISTINCT ON (chat_id) chat_id, id, text, created_at, sender_id, COUNT(*) OVER (PARTITION BY chat_id)
+        FROM messages
+        ORDER BY chat_id, id DESC
+    """)
+    cur.execute("""
+        INSERT INTO chat_summaries (chat_id, member_count)
+        SELECT chat_id, COUNT(*) FROM chat_members GROUP BY chat_id
+        ON CONFLICT (chat_id) DO UPDATE SET member_count = EXCLUDED.member_count
+    """)
+    # У каждого второго участника остаётся несколько непрочитанных
+    cur.execute("""
+        UPDATE chat_members cm
+        SET read_count = GREATEST(s.message_count - cm.id % 2 * (cm.chat_id % 5), 0),
+            last_read_message_id = s.last_message_id
+        FROM chat_summaries s
+        WHERE s.chat_id = cm.chat_id
+    """)
+    # Отметки id по месяцам пишутся только для непустых партиций, а на момент
+    # ensure_messages_partitions сообщений ещё не было
+    cur.execute("SELECT record_message_id_months()")
+    for table, column in (('users', 'id'), ('chats', 'id'), ('messages', 'id'), ('chat_members', 'id'), ('contacts', 'id')):
+        cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), (SELECT MAX({column}) FROM {table}))")
+    cur.execute("SET session_replication_role = DEFAULT")
+    conn.commit()
+    conn.autocommit = True
+    cur.execute("VACUUM ANALYZE")
+    conn.autocommit = False
+    print(f'summaries, analyze: {time.perf_counter() - started:.1f}s')
+
+
+def load_local_server():
+    spec = importlib.util.spec_from_file_location('local_server', ROOT_DIR / 'tools' / 'local_server.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Workload:
+    """Выборка участников чатов из базы и построение событий для каждого действия"""
+
+    def __init__(self, conn, issue_token, sample_size: int = 2000):
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT cm.chat_id, cm.user_id, COALESCE(s.last_message_id, 0)
+            FROM chat_members cm TABLESAMPLE SYSTEM (10)
+            LEFT JOIN chat_summaries s ON s.chat_id = cm.chat_id
+            LIMIT %s
+        """, (sample_size,))
+        self.members = cur.fetchall()
+        cur.execute("SELECT COALESCE(MAX(id), 0), pg_current_snapshot()::text FROM messages")
+        self.max_message_id, self.snapshot = cur.fetchone()
+        cur.close()
+        conn.rollback()
+        if not self.members:
+            raise SystemExit('database is empty, run "seed" first')
+        self.tokens = {}
+        self.issue_token = issue_token
+
+    def token(self, user_id: int) -> str:
+        if user_id not in self.tokens:
+            self.tokens[user_id] = self.issue_token(user_id, 'access')[0]
+        return self.tokens[user_id]
+
+    def event(self, action: str, rng: random.Random) -> tuple:
+        """(функция, event) для одного запроса действия"""
+        chat_id, user_id, last_message_id = rng.choice(self.members)
+        headers = {'authorization': f'Bearer {self.token(user_id)}', 'content-type': 'application/json'}
+
+        def get(**params):
+            return 'messages', {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': params, 'body': ''}
+
+        def post(function='messages', **body):
+            return function, {'httpMethod': 'POST', 'headers': headers, 'queryStringParameters': {}, 'body': json.dumps(body)}
+
+        if action == 'login':
+            return post('auth', action='login', username=f'bench_{user_id}', password=BENCH_PASSWORD)
+        if action == 'chats':
+            return get(action='chats')
+        if action == 'contacts':
+            return get(action='contacts')
+        if action == 'messages':
+            return get(action='messages', chat_id=str(chat_id))
+        if action == 'messages_older':
+            return get(action='messages', chat_id=str(chat_id), before_id=str(max(last_message_id // 2, 1)))
+        if action == 'messages_newer':
+            return get(action='messages', chat_id=str(chat_id), after_id=str(max(last_message_id - 5000, 0)))
+        if action == 'search':
+            return get(action='search', query=rng.choice(SEARCH_QUERIES))
+        if action == 'search_messages':
+            return get(action='search_messages', query=rng.choice(MESSAGE_QUERIES))
+        if action == 'sync':
+            # Курсор прежнего формата id:время, без снимка
+            cursor = f'{max(self.max_message_id - 5000, 0)}:{time.time() - 3600:.3f}'
+            return get(action='sync', cursor=cursor)
+        if action == 'sync_snapshot':
+            # Курсор id/снимок/время: изменения чатов и выходы ищутся по xid
+            cursor = f'{max(self.max_message_id - 5000, 0)}/{self.snapshot}/{time.time() - 3600:.3f}'
+            return get(action='sync', cursor=cursor)
+        if action == 'send':
+            return post(action='send', chat_id=chat_id, text=rng.choice(PHRASES))
+        if action == 'mark_read':
+            return post(action='mark_read', chat_id=chat_id)
+        raise ValueError(action)
+
+
+READ_ACTIONS = ('login', 'chats', 'contacts', 'messages', 'messages_older', 'messages_newer', 'search', 'search_messages',
+                'sync', 'sync_snapshot')
+WRITE_ACTIONS = ('send', 'mark_read')
+
+
+class InProcessClient:
+    def __init__(self, functions: dict):
+        self.functions = functions
+
+    def call(self, function: str, event: dict) -> int:
+        return self.functions[function].handler(event, None)['statusCode']
+
+    def close(self):
+        pass
+
+
+class AsyncClient:
+    """Запросы через async_handler() в одном цикле событий, как в tools/asgi_server.py"""
+
+    def __init__(self, functions: dict):
+        self.functions = functions
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def call(self, function: str, event: dict) -> int:
+        future = asyncio.run_coroutine_threadsafe(self.functions[function].async_handler(event, None), self.loop)
+        return future.result()['statusCode']
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+class HttpClient:
+    """Запросы к HTTP-шиму, запущенному в этом же процессе; соединение на поток"""
+
+    def __init__(self, local_server, functions: dict):
+        class QuietHandler(local_server.FunctionRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+        QuietHandler.functions = functions
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), QuietHandler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.local = threading.local()
+
+    def call(self, function: str, event: dict) -> int:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection('127.0.0.1', self.port)
+        path = f'/{function}'
+        if event['queryStringParameters']:
+            path += '?' + urlencode(event['queryStringParameters'])
+        body = event['body'] or None
+        try:
+            conn.request(event['httpMethod'], path, body=body, headers=event['headers'])
+            response = conn.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            self.local.conn = None
+            conn.close()
+            raise
+        return response.status
+
+    def close(self):
+        self.server.shutdown()
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """Перцентиль по ближайшему рангу"""
+    return sorted_values[max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)]
+
+
+def run_action(client, workload: Workload, action: str, requests: int, concurrency: int, warmup: int) -> dict:
+    def worker(seed_value: int, count: int) -> list:
+        rng = random.Random(seed_value)
+        samples = []
+        for _ in range(count):
+            function, event = workload.event(action, rng)
+            started = time.perf_counter()
+            try:
+                status = client.call(function, event)
+            except Exception:
+                status = 0
+            samples.append((time.perf_counter() - started, status))
+        return samples
+
+    worker(0, warmup)
+    shares = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        samples = [s for chunk in pool.map(worker, range(1, concurrency + 1), shares) for s in chunk]
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(duration * 1000 for duration, _ in samples)
+    return {
+        'count': len(samples),
+        'errors': sum(1 for _, status in samples if status != 200),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'rps': round(len(samples) / elapsed, 1),
+    }
+
+
+def database_scale(conn) -> dict:
+    cur = conn.cursor()
+    scale = {}
+    for table in ('users', 'chats', 'messages'):
+        cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", (table,))
+        estimate = cur.fetchone()[0]
+        if estimate <= 0:
+            cur.execute(f"SELECT COUNT(*) FROM {table}")
+            estimate = cur.fetchone()[0]
+        scale[table] = estimate
+    cur.close()
+    conn.rollback()
+    return scale
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True, capture_output=True,
+                              text=True, cwd=ROOT_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(baseline: dict, current: dict, threshold: float, min_delta_ms: float) -> list:
+    """Действия, у которых p95 вырос больше чем на threshold и на min_delta_ms"""
+    regressions = []
+    for action, stats in current['actions'].items():
+        reference = baseline['actions'].get(action)
+        if reference is None:
+            continue
+        before, after = reference['p95_ms'], stats['p95_ms']
+        if after > before * (1 + threshold) and after - before > min_delta_ms:
+            regressions.append(f'{action}: p95 {before:.1f} ms -> {after:.1f} ms')
+        if stats['errors'] > reference['errors']:
+            regressions.append(f"{action}: errors {reference['errors']} -> {stats['errors']}")
+    return regressions
+
+
+def print_table(result: dict):
+    print(f"{'action':<16}{'count':>7}{'errors':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rps':>9}")
+    for action, stats in result['actions'].items():
+        print(f"{action:<16}{stats['count']:>7}{stats['errors']:>7}{stats['p50_ms']:>10.2f}"
+              f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['rps']:>9.1f}")
+
+
+def run(args) -> int:
+    # Пул каждой функции должен вмещать все потоки, иначе замер покажет ожидание пула
+    os.environ.setdefault('DB_POOL_MAX_SIZE', str(args.concurrency))
+    os.environ.setdefault('ASYNC_DB_POOL_MAX_SIZE', str(args.concurrency))
+    os.environ.setdefault('TRACE_LOG', '0')
+    # Токены выпускаются и проверяются в этом же процессе, секрет любой
+    os.environ.setdefault('TOKEN_SECRET', 'benchmark')
+    local_server = load_local_server()
+    os.environ.setdefault('STORAGE_URL', f'file://{local_server.TEMP_STORAGE_DIR}')
+    functions = {name: local_server.load_function(name) for name in local_server.FUNCTIONS}
+    issue_token = functions['auth'].issue_token
+
+    conn = connect()
+    try:
+        workload = Workload(conn, issue_token)
+        scale = database_scale(conn)
+        server_version = conn.get_parameter_status('server_version')
+    finally:
+        conn.close()
+
+    if args.mode == 'async':
+        client = AsyncClient(functions)
+    elif args.mode == 'http':
+        client = HttpClient(local_server, functions)
+    else:
+        client = InProcessClient(functions)
+    actions = args.action or (READ_ACTIONS if args.read_only else READ_ACTIONS + WRITE_ACTIONS)
+    result = {
+        'meta': {
+            'revision': git_revision(),
+            'mode': args.mode,
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'scale': scale,
+            'python': platform.python_version(),
+            'postgres': server_version,
+        },
+        'actions': {},
+    }
+    try:
+        for action in actions:
+            result['actions'][action] = run_action(client, workload, action, args.requests, args.concurrency, args.warmup)
+    finally:
+        client.close()
+    print_table(result)
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    path = RESULTS_DIR / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{args.mode}.json"
+    path.write_text(json.dumps(result, indent=2))
+    print(f'saved {path.relative_to(ROOT_DIR)}')
+    if args.save_baseline:
+        baseline_path = Path(str(BASELINE_PATH).format(mode=args.mode))
+        baseline_path.write_text(json.dumps(result, indent=2))
+        print(f'saved {baseline_path.relative_to(ROOT_DIR)}')
+
+    if args.baseline:
+        return report_regressions(json.loads(args.baseline.read_text()), result, args)
+    return 0
+
+
+def report_regressions(baseline: dict, current: dict, args) -> int:
+    regressions = compare(baseline, current, args.threshold, args.min_delta_ms)
+    for line in regressions:
+        print(f'REGRESSION {line}')
+    if not regressions:
+        print(f"no regressions against {baseline['meta']['revision']}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed')
+    seed_parser.add_argument('--scale', choices=SCALES, default='small')
+    seed_parser.add_argument('--users', type=int)
+    seed_parser.add_argument('--chats', type=int)
+    seed_parser.add_argument('--messages', type=int)
+
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('--mode', choices=('inprocess', 'http', 'async'), default='inprocess')
+    run_parser.add_argument('--action', action='append', choices=READ_ACTIONS + WRITE_ACTIONS)
+    run_parser.add_argument('--read-only', action='store_true')
+    run_parser.add_argument('--requests', type=int, default=200)
+    run_parser.add_argument('--concurrency', type=int, default=4)
+    run_parser.add_argument('--warmup', type=int, default=10)
+    run_parser.add_argument('--save-baseline', action='store_true')
+    run_parser.add_argument('--baseline', type=Path)
+
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('baseline', type=Path)
+    compare_parser.add_argument('current', type=Path)
+
+    for command_parser in (run_parser, compare_parser):
+        command_parser.add_argument('--threshold', type=float, default=0.2, help='допустимый рост p95, доля')
+        command_parser.add_argument('--min-delta-ms', type=float, default=2.0, help='рост p95 меньше этого считается шумом')
+    args = parser.parse_args()
+
+    if args.command == 'seed':
+        sizes = {key: getattr(args, key) or value for key, value in SCALES[args.scale].items()}
+        conn = connect()
+        try:
+            apply_migrations(conn)
+            seed(conn, **sizes)
+        finally:
+            conn.close()
+        return 0
+    if args.command == 'run':
+        return run(args)
+    return report_regressions(json.loads(args.baseline.read_text()), json.loads(args.current.read_text()), args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""Проверка, что копии общих модулей в функциях backend/ совпадают.
+
+Функции деплоятся отдельными пакетами и не могут импортировать код друг
+друга, поэтому framework.py, db.py, tokens.py, presence.py и tracing.py
+лежат в каждой из них. Правка должна попадать во все копии; скрипт
+печатает diff расходящихся копий и завершается с кодом 1.
+
+    python tools/check_shared_modules.py
+"""
+import difflib
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+FUNCTIONS = ('auth', 'messages')
+SHARED_MODULES = ('framework.py', 'db.py', 'tokens.py', 'presence.py', 'tracing.py')
+
+
+def compare(module: str) -> list:
+    """Строки unified diff между первой копией модуля и остальными"""
+    reference_path = BACKEND_DIR / FUNCTIONS[0] / module
+    reference = reference_path.read_text().splitlines(keepends=True)
+    diff = []
+    for function in FUNCTIONS[1:]:
+        path = BACKEND_DIR / function / module
+        if not path.exists():
+            diff.append(f'{path.relative_to(BACKEND_DIR.parent)}: missing\n')
+            continue
+        diff.extend(difflib.unified_diff(
+            reference, path.read_text().splitlines(keepends=True),
+            str(reference_path.relative_to(BACKEND_DIR.parent)), str(path.relative_to(BACKEND_DIR.parent))
+        ))
+    return diff
+
+
+def main() -> int:
+    mismatched = []
+    for module in SHARED_MODULES:
+        diff = compare(module)
+        if diff:
+            mismatched.append(module)
+            sys.stdout.writelines(diff)
+    if mismatched:
+        print(f'Shared modules differ: {", ".join(mismatched)}')
+        return 1
+    print(f'Shared modules are identical: {", ".join(SHARED_MODULES)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
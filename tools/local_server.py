@@ -0,0 +1,221 @@
+"""Локальный HTTP-сервер для облачных функций backend/.
+
+Запросы на /auth и /messages преобразуются в event облачной функции и
+передаются в handler() соответствующего модуля. GET /messages/events —
+поток Server-Sent Events с новыми сообщениями пользователя, работающий на
+LISTEN/NOTIFY без опроса базы.
+
+    DATABASE_URL=postgresql://... STORAGE_URL=file:///path python tools/local_server.py --port 8000
+    DATABASE_URL=postgresql://... python tools/local_server.py --temp-storage
+
+--temp-storage хранит вложения во временном каталоге, который не переживает
+перезагрузку; годится только для разработки.
+"""
+import argparse
+import base64
+import builtins
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+import psycopg2
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+FUNCTIONS = ('auth', 'messages')
+SSE_HEARTBEAT = 15
+TEMP_STORAGE_DIR = Path(tempfile.gettempdir()) / 'messenger-storage'
+
+
+class FunctionModules:
+    """Модули одной функции: index.py и соседние файлы загружаются отдельно
+    от копий в других функциях, как при деплое каждой функции своим пакетом.
+
+    import внутри этих модулей (в том числе ленивый, во время запроса)
+    сначала ищет файл в каталоге функции и только потом — обычным образом.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.function_dir = BACKEND_DIR / name
+        self.modules = {}
+        self.builtins = dict(vars(builtins), __import__=self.import_module)
+        self._lock = threading.RLock()
+
+    def import_module(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level == 0 and (self.function_dir / f'{name}.py').is_file():
+            return self.load(name)
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    def load(self, name: str):
+        with self._lock:
+            if name not in self.modules:
+                module_name = f'{self.name}_{name}'
+                spec = importlib.util.spec_from_file_location(module_name, self.function_dir / f'{name}.py')
+                module = importlib.util.module_from_spec(spec)
+                module.__builtins__ = self.builtins
+                # Модуль в sys.modules под уникальным именем нужен dataclasses и pickle
+                sys.modules[module_name] = module
+                self.modules[name] = module
+                try:
+                    spec.loader.exec_module(module)
+                except BaseException:
+                    del self.modules[name], sys.modules[module_name]
+                    raise
+            return self.modules[name]
+
+
+def load_function(name: str):
+    """Загрузка index.py функции со своими копиями общих модулей"""
+    return FunctionModules(name).load('index')
+
+
+def event_body(body: bytes, content_type: str) -> tuple:
+    """Тело event и isBase64Encoded: JSON и текст как есть, остальное — в base64, как у шлюза"""
+    media_type = content_type.split(';')[0].strip().lower()
+    if media_type in ('', 'application/json') or media_type.startswith('text/'):
+        return body.decode(), False
+    return base64.b64encode(body).decode(), True
+
+
+class FunctionRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    functions = {}
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def do_OPTIONS(self):
+        self.dispatch()
+
+    def dispatch(self):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        if not parts or parts[0] not in self.functions:
+            self.send_error(404)
+            return
+
+        query = dict(parse_qsl(url.query))
+        if parts[1:] == ['events'] and parts[0] == 'messages' and self.command == 'GET':
+            self.stream_events(query)
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body, is_base64 = event_body(self.rfile.read(length) if length else b'', self.headers.get('Content-Type', ''))
+        event = {
+            'httpMethod': self.command,
+            'headers': {key.lower(): value for key, value in self.headers.items()},
+            'queryStringParameters': query,
+            'body': body,
+            'isBase64Encoded': is_base64,
+        }
+        response = self.functions[parts[0]].handler(event, None)
+        self.write_response(response)
+
+    def write_response(self, response: dict):
+        body = response.get('body') or ''
+        if response.get('isBase64Encoded'):
+            payload = base64.b64decode(body)
+        else:
+            payload = body.encode()
+        self.send_response(response.get('statusCode', 200))
+        for key, value in (response.get('headers') or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def stream_events(self, query: dict):
+        messages = self.functions['messages']
+        auth_header = self.headers.get('Authorization', '')
+        token = query.get('token') or auth_header.replace('Bearer ', '').strip()
+        claims = messages.verify_token(token)
+        if not claims:
+            self.send_error(401)
+            return
+        user_id = claims['sub']
+
+        # Поток держит соединение всё время подписки, поэтому оно открывается
+        # отдельно от пула функции
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        try:
+            cur = conn.cursor()
+            if messages.revocations.is_revoked(claims['jti'], cur):
+                self.send_error(401)
+                return
+            cur.execute("SELECT chat_id FROM chat_members WHERE user_id = %s", (user_id,))
+            chat_ids = [row[0] for row in cur.fetchall()]
+            # Курсор — в формате sync; при переподключении браузер передаёт
+            # последний полученный в Last-Event-ID
+            last_event_id = self.headers.get('Last-Event-ID')
+            try:
+                cursor = messages.poll_cursor(cur, {**query, 'cursor': last_event_id} if last_event_id else query)
+            except messages.HttpError:
+                self.send_error(400)
+                return
+            messages.listen_chats(conn, user_id, chat_ids)
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.close_connection = True
+
+            while True:
+                # Поток живёт дольше одного запроса: отзыв или истечение токена
+                # его закрывают. Проверка до commit, чтобы уведомления не ждали транзакцию
+                if claims['exp'] < time.time() or messages.revocations.is_revoked(claims['jti'], cur):
+                    break
+                batch, has_more, next_cursor = messages.fetch_sync_page(cur, user_id, cursor, messages.MAX_PAGE_SIZE)
+                conn.commit()
+                for message in batch:
+                    self.wfile.write(f"event: message\ndata: {json.dumps(message)}\n\n".encode())
+                # id события — курсор после всей пачки: оборванная на середине
+                # пачка при переподключении придёт снова
+                if batch:
+                    self.wfile.write(f"id: {next_cursor}\nevent: cursor\ndata: {next_cursor}\n\n".encode())
+                cursor = messages.decode_sync_cursor(next_cursor)
+                if not has_more and not batch:
+                    channels = messages.wait_for_notify(conn, SSE_HEARTBEAT)
+                    if not channels:
+                        self.wfile.write(b': heartbeat\n\n')
+                    elif f'user_{user_id}' in channels:
+                        # Пользователя добавили в чат: подписка на его сообщения
+                        cur.execute("SELECT chat_id FROM chat_members WHERE user_id = %s", (user_id,))
+                        chat_ids = [row[0] for row in cur.fetchall()]
+                        messages.listen_chats(conn, user_id, chat_ids)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--temp-storage', action='store_true', help=f'store attachments in {TEMP_STORAGE_DIR}')
+    args = parser.parse_args()
+
+    if args.temp_storage:
+        os.environ['STORAGE_URL'] = f'file://{TEMP_STORAGE_DIR}'
+    FunctionRequestHandler.functions = {name: load_function(name) for name in FUNCTIONS}
+    server = ThreadingHTTPServer((args.host, args.port), FunctionRequestHandler)
+    print(f'Serving {", ".join(FUNCTIONS)} on http://{args.host}:{args.port}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
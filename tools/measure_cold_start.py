@@ -0,0 +1,95 @@
+"""Замер холодного старта облачных функций backend/.
+
+Каждый прогон — новый интерпретатор: импорт index.py и первый вызов
+handler() с запросом, которому база не нужна (OPTIONS и запрос без токена).
+Печатает медиану по прогонам и модули, загруженные к концу первого вызова,
+чтобы было видно, что psycopg2 не импортируется раньше времени.
+
+    python tools/measure_cold_start.py --runs 20
+    python tools/measure_cold_start.py --function messages --git-ref HEAD~1
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+FUNCTIONS = ('auth', 'messages')
+WATCHED_MODULES = ('psycopg2', 'orjson', 'redis')
+
+PROBE = r'''
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import index
+imported = time.perf_counter()
+index.handler({'httpMethod': 'OPTIONS', 'headers': {}}, None)
+first_call = time.perf_counter()
+response = index.handler({'httpMethod': sys.argv[2], 'headers': {}, 'body': '{}', 'queryStringParameters': {}}, None)
+rejected = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'options_ms': (first_call - imported) * 1000,
+    'reject_ms': (rejected - first_call) * 1000,
+    'reject_status': response['statusCode'],
+    'modules': sorted(name for name in sys.modules if name.split('.')[0] in sys.argv[3].split(',')),
+}))
+'''
+
+
+def probe(function_dir: Path, method: str) -> dict:
+    """Один холодный старт в отдельном процессе"""
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE, str(function_dir), method, ','.join(WATCHED_MODULES)],
+        check=True, capture_output=True, text=True, cwd=function_dir
+    ).stdout
+    # Выше могут быть строки трассировки запросов (TRACE_LOG), итог — последняя
+    return json.loads(output.splitlines()[-1])
+
+
+def measure(function_dir: Path, runs: int) -> dict:
+    method = 'GET' if function_dir.name == 'messages' else 'POST'
+    samples = [probe(function_dir, method) for _ in range(runs)]
+    result = {
+        key: round(statistics.median(sample[key] for sample in samples), 2)
+        for key in ('import_ms', 'options_ms', 'reject_ms')
+    }
+    result['total_ms'] = round(result['import_ms'] + result['options_ms'], 2)
+    result['reject_status'] = samples[0]['reject_status']
+    result['modules'] = sorted({name.split('.')[0] for name in samples[0]['modules']})
+    return result
+
+
+def checkout(ref: str, target: Path) -> Path:
+    """Дерево backend/ из ревизии ref для сравнения «до» и «после»"""
+    archive = subprocess.run(['git', 'archive', ref, 'backend'], check=True, capture_output=True, cwd=ROOT_DIR).stdout
+    subprocess.run(['tar', '-x', '-C', str(target)], input=archive, check=True)
+    return target / 'backend'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--function', choices=FUNCTIONS, action='append')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--git-ref', help='замерить также backend/ из этой ревизии')
+    args = parser.parse_args()
+
+    trees = {'current': ROOT_DIR / 'backend'}
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.git_ref:
+            trees[args.git_ref] = checkout(args.git_ref, Path(tmp))
+        for name in args.function or FUNCTIONS:
+            for label, backend_dir in trees.items():
+                try:
+                    result = measure(backend_dir / name, args.runs)
+                except subprocess.CalledProcessError as e:
+                    print(f'{name} [{label}]: failed\n{e.stderr.strip()}')
+                    continue
+                print(f'{name} [{label}]: {json.dumps(result)}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())